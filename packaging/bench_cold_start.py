@@ -0,0 +1,111 @@
+"""
+Cold-start benchmark: launch to first rendered billing screen.
+
+Starts the app, waits for the server health check, then opens a session the way
+a browser does and waits for the first script run to finish. Each run starts a
+fresh process:
+    python packaging/bench_cold_start.py --runs 5
+    python packaging/bench_cold_start.py --exe dist/pythonbill/pythonbill --runs 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _launch_command(exe, port):
+    if exe:
+        return [exe]
+    return [
+        sys.executable, "-m", "streamlit", "run", os.path.join(ROOT, "streamlit_app.py"),
+        "--server.port", str(port), "--server.headless", "true",
+        "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"
+    ]
+
+
+def _wait_for_health(port, deadline):
+    url = f"http://localhost:{port}/_stcore/health"
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError("server did not become healthy")
+
+
+async def _first_render(port):
+    """Open a session, request the first script run and wait until it has finished."""
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    from tornado.websocket import websocket_connect
+
+    ws = await websocket_connect(f"ws://localhost:{port}/_stcore/stream")
+    try:
+        request = BackMsg()
+        request.rerun_script.query_string = ""
+        await ws.write_message(request.SerializeToString(), binary=True)
+        while True:
+            data = await ws.read_message()
+            if data is None:
+                raise ConnectionError("session closed before the first render")
+            message = ForwardMsg()
+            message.ParseFromString(data)
+            if message.WhichOneof("type") == "script_finished":
+                return
+    finally:
+        ws.close()
+
+
+def run_once(exe, port, timeout):
+    """Return (seconds to healthy server, seconds to first render) for one fresh launch."""
+    env = dict(os.environ, BILLING_PORT=str(port), BILLING_HEADLESS="1")
+    start = time.monotonic()
+    process = subprocess.Popen(
+        _launch_command(exe, port), cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        _wait_for_health(port, start + timeout)
+        healthy = time.monotonic() - start
+        asyncio.run(asyncio.wait_for(_first_render(port), timeout))
+        rendered = time.monotonic() - start
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return healthy, rendered
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure launch-to-first-render time of the billing app.")
+    parser.add_argument("--exe", default=None, help="Packaged executable (default: streamlit run from source)")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh launches to time")
+    parser.add_argument("--port", type=int, default=8599, help="Port to serve on during the benchmark")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for each launch")
+    args = parser.parse_args(argv)
+
+    results = []
+    for run in range(1, args.runs + 1):
+        healthy, rendered = run_once(args.exe, args.port, args.timeout)
+        results.append((healthy, rendered))
+        print(f"run {run}: server ready {healthy:.2f}s, first render {rendered:.2f}s")
+
+    ready = [r[0] for r in results]
+    rendered = [r[1] for r in results]
+    print(f"server ready: median {statistics.median(ready):.2f}s (min {min(ready):.2f}s, max {max(ready):.2f}s)")
+    print(f"first render: median {statistics.median(rendered):.2f}s (min {min(rendered):.2f}s, max {max(rendered):.2f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,41 @@
+"""
+Entry point of the packaged desktop build.
+
+Starts the Streamlit server on the bundled streamlit_app.py in this process, so
+the executable does not spawn a second Python. Settings:
+    BILLING_PORT      port to serve on (default 8501)
+    BILLING_HEADLESS  set to 1 to skip opening a browser tab (e.g. for the cold-start benchmark)
+"""
+import os
+import sys
+
+
+def bundle_dir():
+    """Return the directory holding streamlit_app.py: the one-dir bundle when frozen, else the repo root."""
+    if getattr(sys, "frozen", False):
+        return sys._MEIPASS
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    from streamlit.web import bootstrap
+
+    # Bills and the master file are written relative to the working directory; keep them beside the executable
+    if getattr(sys, "frozen", False):
+        os.chdir(os.path.dirname(sys.executable))
+
+    flag_options = {
+        "server.port": int(os.environ.get("BILLING_PORT", "8501")),
+        "server.headless": os.environ.get("BILLING_HEADLESS", "") not in ("", "0"),
+        # No file watcher or dev mode: nothing in the bundle changes at runtime
+        "server.fileWatcherType": "none",
+        "server.runOnSave": False,
+        "global.developmentMode": False,
+        "browser.gatherUsageStats": False,
+    }
+    bootstrap.load_config_options(flag_options)
+    bootstrap.run(os.path.join(bundle_dir(), "streamlit_app.py"), False, [], flag_options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- mode: python ; coding: utf-8 -*-
+#
+# Slim one-dir build of the billing app:
+#     pip install pyinstaller
+#     pyinstaller packaging/pythonbill.spec --noconfirm
+#
+# The result is dist/pythonbill/ with the executable next to its libraries, so a
+# launch maps files in place instead of unpacking a one-file archive to a temp
+# dir every time. Library modules ship as optimized bytecode inside the PYZ
+# archive; only streamlit_app.py stays as source because Streamlit execs it.
+import os
+
+from PyInstaller.utils.hooks import collect_data_files, collect_submodules, copy_metadata
+
+ROOT = os.path.dirname(SPECPATH)
+
+# Pulled in by optional imports of the libraries we do use, never by the app
+EXCLUDES = [
+    "matplotlib",
+    "seaborn",
+    "tkinter",
+    "_tkinter",
+    "IPython",
+    "ipykernel",
+    "jupyter_client",
+    "notebook",
+    "pytest",
+    "sphinx",
+    "docutils",
+    "mongomock",
+    "PyQt5",
+    "PyQt6",
+    "PySide2",
+    "PySide6",
+    "torch",
+    "tensorflow",
+    # Arrow RPC and cloud filesystems; Feather and Streamlit only need core Arrow
+    "pyarrow.flight",
+    "pyarrow._flight",
+    "pyarrow._s3fs",
+    "pyarrow._gcsfs",
+    "pyarrow._azurefs",
+    "pyarrow._hdfs",
+]
+
+# Shared libraries of the excluded Arrow modules, which nothing else links against
+EXCLUDED_BINARIES = ("libarrow_flight", "libarrow_python_flight", "libarrow_s3")
+
+datas = [
+    (os.path.join(ROOT, "streamlit_app.py"), "."),
+    (os.path.join(ROOT, "bill.ico"), "."),
+]
+# Streamlit serves its frontend from package data and checks its own version at startup
+datas += collect_data_files("streamlit", excludes=["**/*.py", "**/tests/**"])
+datas += copy_metadata("streamlit")
+
+# The app script is exec'd by Streamlit, so its imports are invisible to the analysis
+hiddenimports = collect_submodules("utils") + collect_submodules("streamlit.runtime") + [
+    "streamlit.web.bootstrap",
+    "plotly.express",
+    "openpyxl",
+    "xlsxwriter",
+    "pyarrow.feather",
+]
+
+a = Analysis(
+    [os.path.join(SPECPATH, "launcher.py")],
+    pathex=[ROOT],
+    binaries=[],
+    datas=datas,
+    hiddenimports=hiddenimports,
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=EXCLUDES,
+    noarchive=False,
+    # Strip asserts; docstrings stay because st.help and plotly read them
+    optimize=1,
+)
+a.binaries = [entry for entry in a.binaries if not os.path.basename(entry[0]).startswith(EXCLUDED_BINARIES)]
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name="pythonbill",
+    icon=os.path.join(ROOT, "bill.ico"),
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    # UPX-compressed libraries must be decompressed on every launch
+    upx=False,
+    console=True,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    name="pythonbill",
+)
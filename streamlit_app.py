@@ -1,9 +1,8 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import glob
 import os
+import time
 from datetime import datetime, timedelta
 
 # Import from our modules
@@ -20,20 +19,45 @@ from utils.bill_operations import (
     generate_bill, 
     save_bill, 
     print_bill, 
-    export_bill_to_excel
+    export_bill_to_excel,
+    build_bill_rows
 )
+from utils.events import publish_bill_saved, publish_bill_exported
+from utils.price_catalog import get_price_catalog
+from utils.promotions import get_promotion_engine
+from utils.cart import Cart
+from utils.billing_client import BillingClient, BillingServiceError
 from utils.email_utils import send_email
+from utils import metrics, profiling, sync_queue
 from utils.data import prices, cosmetic_products, grocery_products, drink_products
 from utils.ui import (
     set_custom_style,
     display_customer_info_section,
     display_product_selection,
+    display_cart_total,
     display_bill_operations_section,
     display_bill_content,
     display_success_message,
-    display_error_message
+    display_error_message,
+    display_latency_panel,
+    display_live_ticker,
+    display_service_search
 )
 
+@st.cache_resource(show_spinner=False)
+def get_billing_client(base_url):
+    return BillingClient(base_url)
+
+# Thin client mode: price, render and store bills through the shared billing service
+billing_client = None
+if os.environ.get("BILLING_SERVICE_URL"):
+    billing_client = get_billing_client(os.environ["BILLING_SERVICE_URL"])
+    generate_bill_number = billing_client.generate_bill_number
+    calculate_total = billing_client.calculate_total
+    generate_bill = billing_client.generate_bill
+    save_bill = billing_client.save_bill
+    export_bill_to_excel = billing_client.export_bill_to_excel
+
 # Set page config
 st.set_page_config(
     page_title="Grocery Billing System",
@@ -44,99 +68,198 @@ st.set_page_config(
 # Apply custom styling
 set_custom_style()
 
-# Initialize session state
-if "billnumber" not in st.session_state:
-    st.session_state.billnumber = generate_bill_number()
+# Start collecting timings for this rerun (and serve /metrics if BILLING_METRICS_PORT is set)
+metrics.begin_rerun()
+rerun_started = time.perf_counter()
+metrics.start_metrics_server()
 
-# Title
-st.title("Grocery Billing System")
+# Ship queued bills to the central store in the background if BILLING_CENTRAL_DIR is set
+sync_queue.start_sync_worker()
 
-# Get customer information
-customer_name, phone_number = display_customer_info_section()
+# Each section below is a fragment: a widget inside one reruns only that section.
+# State shared between sections lives in st.session_state:
+#   billnumber, cart, totals, bill_content  - the bill being built (billing)
+#   notice                                  - message shown after a full rerun (search, save, export, email -> billing)
+#   show_email_form                         - email form visible (billing -> email)
+#   show_analytics                          - analytics open (sidebar -> analytics)
+# A section that changes what another one draws finishes with st.rerun() to redraw the whole app.
 
-# Get product selections
-cosmetic_items, grocery_items, drink_items = display_product_selection(
-    cosmetic_products, grocery_products, drink_products, prices
-)
 
-# Bill operations section
-bill_op_cols = display_bill_operations_section()
-
-# Calculate button
-with bill_op_cols[0]:
-    if st.button("Calculate Total", key="calc_button"):
-        if not customer_name:
-            display_error_message("Please enter customer name")
-        elif not phone_number:
-            display_error_message("Please enter phone number")
-        elif not any(qty > 0 for qty in {**cosmetic_items, **grocery_items, **drink_items}.values()):
-            display_error_message("Please select at least one product")
-        else:
-            # Calculate totals
-            totals = calculate_total(cosmetic_items, grocery_items, drink_items, prices)
-            st.session_state.totals = totals
-            
-            # Generate bill
-            bill_content = generate_bill(
-                customer_name, 
-                phone_number, 
-                st.session_state.billnumber, 
-                cosmetic_items, 
-                grocery_items, 
-                drink_items, 
-                totals,
-                prices
-            )
-            st.session_state.bill_content = bill_content
+@st.fragment
+@metrics.timed("rerun.billing")
+def billing_section():
+    """Customer details, product selection, bill operations and the bill preview."""
+    # Get customer information
+    customer_name, phone_number = display_customer_info_section()
+
+    # Prices in force now, including changes recorded in the price catalog
+    prices = get_price_catalog().prices_as_of()
+
+    # The cart keeps running totals as quantities change (local mode; the service prices remote bills)
+    cart = None
+    if billing_client is None:
+        if "cart" not in st.session_state:
+            st.session_state.cart = Cart({
+                "cosmetic": [v['name'] for variants in cosmetic_products.values() for v in variants],
+                "grocery": [v['name'] for variants in grocery_products.values() for v in variants],
+                "drink": [v['name'] for variants in drink_products.values() for v in variants]
+            }, prices)
+        cart = st.session_state.cart
+        removed = cart.set_prices(prices)
+        if removed:
+            display_error_message(f"No longer priced, removed from the bill: {', '.join(removed)}")
+
+    # Get product selections
+    cosmetic_items, grocery_items, drink_items = display_product_selection(
+        cosmetic_products, grocery_products, drink_products, prices, cart
+    )
+    if cart is not None:
+        display_cart_total(cart.totals(get_promotion_engine()))
+
+    # Bill operations section
+    bill_op_cols = display_bill_operations_section()
+
+    # Calculate button
+    with bill_op_cols[0]:
+        if st.button("Calculate Total", key="calc_button"):
+            if not customer_name:
+                display_error_message("Please enter customer name")
+            elif not phone_number:
+                display_error_message("Please enter phone number")
+            elif not any(qty > 0 for qty in {**cosmetic_items, **grocery_items, **drink_items}.values()):
+                display_error_message("Please select at least one product")
+            else:
+                try:
+                    if cart is not None:
+                        # The cart already holds the subtotals and formatted lines; promotions look only at its lines
+                        st.session_state.totals = cart.totals(get_promotion_engine())
+                        bill_content = cart.receipt(
+                            customer_name, phone_number, st.session_state.billnumber, totals=st.session_state.totals
+                        )
+                    else:
+                        # Calculate totals
+                        totals = calculate_total(cosmetic_items, grocery_items, drink_items, prices)
+                        st.session_state.totals = totals
+                
+                        # Generate bill
+                        bill_content = generate_bill(
+                            customer_name, 
+                            phone_number, 
+                            st.session_state.billnumber, 
+                            cosmetic_items, 
+                            grocery_items, 
+                            drink_items, 
+                            totals,
+                            prices
+                        )
+                    st.session_state.bill_content = bill_content
             
-            # Display success message
-            display_success_message("Bill calculated successfully!")
+                    # Display success message
+                    display_success_message("Bill calculated successfully!")
+                except BillingServiceError as e:
+                    display_error_message(str(e))
 
-# Add the rest of your bill operation buttons (Save, Print, Email, Export)
-with bill_op_cols[1]:
-    if st.button("Save Bill", key="save_button"):
-        if "bill_content" in st.session_state:
-            result = save_bill(st.session_state.bill_content, st.session_state.billnumber)
-            display_success_message(result)
-        else:
-            display_error_message("Please calculate the bill first")
-with bill_op_cols[2]:
-    if st.button("Print Bill", key="print_button"):
-        if "bill_content" in st.session_state:
-            result = print_bill(st.session_state.bill_content)
-            if result.startswith("Error") or "only available" in result:
-                display_error_message(result)
+    # Add the rest of your bill operation buttons (Save, Print, Email, Export)
+    with bill_op_cols[1]:
+        if st.button("Save Bill", key="save_button"):
+            if "bill_content" in st.session_state:
+                # Hand the bill to the outbox and storage consumers first (the service does its own),
+                # so a failing bills/ directory cannot lose it
+                if billing_client is None:
+                    publish_bill_saved(
+                        st.session_state.billnumber,
+                        st.session_state.bill_content,
+                        {**cosmetic_items, **grocery_items, **drink_items},
+                        build_bill_rows(
+                            customer_name,
+                            phone_number,
+                            st.session_state.billnumber,
+                            cosmetic_items,
+                            grocery_items,
+                            drink_items,
+                            prices,
+                            totals=st.session_state.get("totals")
+                        )
+                    )
+                try:
+                    st.session_state.notice = save_bill(st.session_state.bill_content, st.session_state.billnumber)
+                    # The search lists saved bills; rerun the app so it includes this one
+                    st.rerun()
+                except BillingServiceError as e:
+                    display_error_message(str(e))
             else:
-                display_success_message(result)
-        else:
-            display_error_message("Please calculate the bill first")
-with bill_op_cols[3]:
-    if st.button("Email Bill", key="email_button", type="primary"):
-        if "bill_content" in st.session_state:
-            st.session_state.show_email_form = True
-        else:
-            display_error_message("Please calculate the bill first")
+                display_error_message("Please calculate the bill first")
+    with bill_op_cols[2]:
+        if st.button("Print Bill", key="print_button"):
+            if "bill_content" in st.session_state:
+                result = print_bill(st.session_state.bill_content)
+                if result.startswith("Error") or "only available" in result:
+                    display_error_message(result)
+                else:
+                    display_success_message(result)
+            else:
+                display_error_message("Please calculate the bill first")
+    with bill_op_cols[3]:
+        if st.button("Email Bill", key="email_button", type="primary"):
+            if "bill_content" in st.session_state:
+                st.session_state.show_email_form = True
+                # The email form is its own fragment; draw it with a full rerun
+                st.rerun()
+            else:
+                display_error_message("Please calculate the bill first")
+
+    # Add a new column for Export to Excel button
+    with st.container():
+        if st.button("Export to Excel", key="excel_button"):
+            if "totals" in st.session_state:
+                # Queue the bill for the ledger, customers, stock and rollups before writing the workbook
+                # (the service does its own)
+                if billing_client is None:
+                    publish_bill_exported(
+                        st.session_state.billnumber,
+                        {**cosmetic_items, **grocery_items, **drink_items},
+                        build_bill_rows(
+                            customer_name,
+                            phone_number,
+                            st.session_state.billnumber,
+                            cosmetic_items,
+                            grocery_items,
+                            drink_items,
+                            prices,
+                            totals=st.session_state.get("totals")
+                        )
+                    )
+                try:
+                    file_path = export_bill_to_excel(
+                        customer_name,
+                        phone_number,
+                        st.session_state.billnumber,
+                        cosmetic_items,
+                        grocery_items,
+                        drink_items,
+                        st.session_state.totals,
+                        prices
+                    )
+                    st.session_state.notice = f"Bill exported to {file_path}"
+                    # Analytics reads the exported workbooks; rerun the app so it includes this one
+                    st.rerun()
+                except BillingServiceError as e:
+                    display_error_message(str(e))
+            else:
+                display_error_message("Please calculate the bill first")
+
+    # Display bill content if available
+    if "bill_content" in st.session_state:
+        # Saving, exporting, emailing or loading a bill reruns the whole app and leaves its message here
+        if "notice" in st.session_state:
+            display_success_message(st.session_state.pop("notice"))
+        display_bill_content(st.session_state.bill_content)
 
-# Add a new column for Export to Excel button
-with st.container():
-    if st.button("Export to Excel", key="excel_button"):
-        if "totals" in st.session_state:
-            file_path = export_bill_to_excel(
-                customer_name,
-                phone_number,
-                st.session_state.billnumber,
-                cosmetic_items,
-                grocery_items,
-                drink_items,
-                st.session_state.totals,
-                prices
-            )
-            display_success_message(f"Bill exported to {file_path}")
-        else:
-            display_error_message("Please calculate the bill first")
 
-# Email form section
-if "show_email_form" in st.session_state and st.session_state.show_email_form:
+@st.fragment
+@metrics.timed("rerun.email")
+def email_section():
+    """Form for sending the current bill by email."""
     st.markdown("## Send Bill via Email")
     
     email_col1, email_col2 = st.columns(2)
@@ -155,8 +278,10 @@ if "show_email_form" in st.session_state and st.session_state.show_email_form:
                 if "bill_content" in st.session_state:
                     try:
                         if send_email(sender_email, sender_password, receiver_email, st.session_state.bill_content):
-                            display_success_message("Email sent successfully!")
+                            st.session_state.notice = "Email sent successfully!"
                             st.session_state.show_email_form = False
+                            # Closing the form changes the page outside this fragment
+                            st.rerun()
                         else:
                             display_error_message("Failed to send email. Please check your credentials.")
                     except Exception as e:
@@ -170,12 +295,12 @@ if "show_email_form" in st.session_state and st.session_state.show_email_form:
         if st.button("Cancel", key="cancel_email_button"):
             st.session_state.show_email_form = False
             st.rerun()
-# Display bill content if available
-if "bill_content" in st.session_state:
-    display_bill_content(st.session_state.bill_content)
 
-# Add a section for analytics
-if st.sidebar.button("View Sales Analytics", type="primary"):
+
+@st.fragment
+@metrics.timed("rerun.analytics")
+def analytics_section():
+    """Sales analytics over the exported Excel bills, or sample data to start from."""
     # Find all Excel files in the bills directory
     excel_files = glob.glob("bills/*.xlsx")
     if excel_files:
@@ -225,145 +350,211 @@ if st.sidebar.button("View Sales Analytics", type="primary"):
             except Exception as e:
                 display_error_message(f"Error creating sample data: {str(e)}")
 
-# Add a search bill section
-st.sidebar.markdown("---")
-st.sidebar.markdown("## Search Bills")
-search_option = st.sidebar.radio("Search by:", ["Bill Number", "Customer Name", "Date"])
 
-if search_option == "Bill Number":
-    # Get all bill files - fix the pattern to match both formats
-    bill_files = glob.glob("bills/*.txt")  # More general pattern to catch all text files
-    bill_numbers = [os.path.basename(file).replace(".txt", "") for file in bill_files]
-    
-    if bill_numbers:
-        selected_bill = st.sidebar.selectbox("Select Bill Number:", bill_numbers)
-        if st.sidebar.button("View Bill", key="view_bill_by_number"):  # Added unique key
-            bill_path = f"bills/{selected_bill}.txt"
-            try:
-                with open(bill_path, "r", encoding="utf-8") as f:
-                    bill_content = f.read()
-                st.session_state.bill_content = bill_content
-                display_success_message(f"Loaded bill: {selected_bill}")
-            except Exception as e:
-                display_error_message(f"Error loading bill: {str(e)}")
+@st.fragment
+@metrics.timed("rerun.search")
+def search_section():
+    """Bill search; call inside `with st.sidebar`."""
+    if billing_client is not None:
+        # The service owns the bill files; search through it instead of scanning bills/
+        display_service_search(billing_client)
+        search_option = None
     else:
-        st.sidebar.info("No bills found. Please save a bill first.")
+        search_option = st.radio("Search by:", ["Bill Number", "Customer Name", "Date"])
 
-elif search_option == "Customer Name":
-    # Get all bill files
-    bill_files = glob.glob("bills/*.txt")  # More general pattern
-    customer_names = []
-    
-    for file in bill_files:
-        try:
-            with open(file, "r", encoding="utf-8") as f:
-                content = f.read()
-                # Extract customer name from bill content
-                for line in content.split("\n"):
-                    if "Customer Name:" in line:
-                        name = line.split("Customer Name:")[1].strip()
-                        customer_names.append((name, file))
-                        break
-        except Exception as e:
-            st.sidebar.error(f"Error reading {file}: {str(e)}")
+    if search_option == "Bill Number":
+        # Get all bill files - fix the pattern to match both formats
+        bill_files = glob.glob("bills/*.txt")  # More general pattern to catch all text files
+        bill_numbers = [os.path.basename(file).replace(".txt", "") for file in bill_files]
     
-    if customer_names:
-        # Get unique names
-        unique_names = list(set([name for name, _ in customer_names]))
-        selected_name = st.sidebar.selectbox("Select Customer:", unique_names)
-        
-        # Find bills for this customer
-        customer_bills = [file for name, file in customer_names if name == selected_name]
-        
-        if customer_bills:
-            selected_bill = st.sidebar.selectbox(
-                "Select Bill:", 
-                [os.path.basename(file) for file in customer_bills]
-            )
-            
-            if st.sidebar.button("View Bill", key="view_bill_by_customer"):  # Added unique key
+        if bill_numbers:
+            selected_bill = st.selectbox("Select Bill Number:", bill_numbers)
+            if st.button("View Bill", key="view_bill_by_number"):  # Added unique key
+                bill_path = f"bills/{selected_bill}.txt"
                 try:
-                    with open(os.path.join("bills", selected_bill), "r", encoding="utf-8") as f:
+                    with open(bill_path, "r", encoding="utf-8") as f:
                         bill_content = f.read()
                     st.session_state.bill_content = bill_content
-                    display_success_message(f"Loaded bill for {selected_name}")
+                    st.session_state.notice = f"Loaded bill: {selected_bill}"
+                    # The preview is drawn by the billing section; rerun the app so it shows this bill
+                    st.rerun()
                 except Exception as e:
                     display_error_message(f"Error loading bill: {str(e)}")
         else:
-            st.sidebar.info(f"No bills found for {selected_name}.")
-    else:
-        st.sidebar.info("No customer bills found. Please save a bill first.")
+            st.info("No bills found. Please save a bill first.")
 
-elif search_option == "Date":
-    # Get all bill files
-    bill_files = glob.glob("bills/*.txt")  # More general pattern
-    bill_dates = []
+    elif search_option == "Customer Name":
+        # Get all bill files
+        bill_files = glob.glob("bills/*.txt")  # More general pattern
+        customer_names = []
     
-    for file in bill_files:
-        try:
-            with open(file, "r", encoding="utf-8") as f:
-                content = f.read()
-                # Extract date from bill content
-                for line in content.split("\n"):
-                    if "Date:" in line:
-                        date_str = line.split("Date:")[1].strip()
-                        try:
-                            date = datetime.strptime(date_str, "%d-%m-%Y %H:%M:%S").date()
-                            bill_dates.append((date, file))
+        for file in bill_files:
+            try:
+                with open(file, "r", encoding="utf-8") as f:
+                    content = f.read()
+                    # Extract customer name from bill content
+                    for line in content.split("\n"):
+                        if "Customer Name:" in line:
+                            name = line.split("Customer Name:")[1].strip()
+                            customer_names.append((name, file))
                             break
-                        except:
-                            # Try alternative date format if the first one fails
+            except Exception as e:
+                st.error(f"Error reading {file}: {str(e)}")
+    
+        if customer_names:
+            # Get unique names
+            unique_names = list(set([name for name, _ in customer_names]))
+            selected_name = st.selectbox("Select Customer:", unique_names)
+        
+            # Find bills for this customer
+            customer_bills = [file for name, file in customer_names if name == selected_name]
+        
+            if customer_bills:
+                selected_bill = st.selectbox(
+                    "Select Bill:", 
+                    [os.path.basename(file) for file in customer_bills]
+                )
+            
+                if st.button("View Bill", key="view_bill_by_customer"):  # Added unique key
+                    try:
+                        with open(os.path.join("bills", selected_bill), "r", encoding="utf-8") as f:
+                            bill_content = f.read()
+                        st.session_state.bill_content = bill_content
+                        st.session_state.notice = f"Loaded bill for {selected_name}"
+                        # The preview is drawn by the billing section; rerun the app so it shows this bill
+                        st.rerun()
+                    except Exception as e:
+                        display_error_message(f"Error loading bill: {str(e)}")
+            else:
+                st.info(f"No bills found for {selected_name}.")
+        else:
+            st.info("No customer bills found. Please save a bill first.")
+
+    elif search_option == "Date":
+        # Get all bill files
+        bill_files = glob.glob("bills/*.txt")  # More general pattern
+        bill_dates = []
+    
+        for file in bill_files:
+            try:
+                with open(file, "r", encoding="utf-8") as f:
+                    content = f.read()
+                    # Extract date from bill content
+                    for line in content.split("\n"):
+                        if "Date:" in line:
+                            date_str = line.split("Date:")[1].strip()
                             try:
-                                date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S").date()
+                                date = datetime.strptime(date_str, "%d-%m-%Y %H:%M:%S").date()
                                 bill_dates.append((date, file))
                                 break
                             except:
-                                pass
-        except Exception as e:
-            st.sidebar.error(f"Error reading {file}: {str(e)}")
+                                # Try alternative date format if the first one fails
+                                try:
+                                    date = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S").date()
+                                    bill_dates.append((date, file))
+                                    break
+                                except:
+                                    pass
+            except Exception as e:
+                st.error(f"Error reading {file}: {str(e)}")
     
-    if bill_dates:
-        # Sort dates
-        bill_dates.sort(reverse=True)
-        unique_dates = sorted(list(set([date for date, _ in bill_dates])), reverse=True)
+        if bill_dates:
+            # Sort dates
+            bill_dates.sort(reverse=True)
+            unique_dates = sorted(list(set([date for date, _ in bill_dates])), reverse=True)
         
-        selected_date = st.sidebar.selectbox(
-            "Select Date:", 
-            [date.strftime("%d-%m-%Y") for date in unique_dates]
-        )
+            selected_date = st.selectbox(
+                "Select Date:", 
+                [date.strftime("%d-%m-%Y") for date in unique_dates]
+            )
         
-        # Find bills for this date
-        date_obj = datetime.strptime(selected_date, "%d-%m-%Y").date()
-        date_bills = [file for date, file in bill_dates if date == date_obj]
+            # Find bills for this date
+            date_obj = datetime.strptime(selected_date, "%d-%m-%Y").date()
+            date_bills = [file for date, file in bill_dates if date == date_obj]
         
-        if date_bills:
-            selected_bill = st.sidebar.selectbox(
-                "Select Bill:", 
-                [os.path.basename(file) for file in date_bills]
-            )
+            if date_bills:
+                selected_bill = st.selectbox(
+                    "Select Bill:", 
+                    [os.path.basename(file) for file in date_bills]
+                )
             
-            if st.sidebar.button("View Bill", key="view_bill_by_date"):  # Added unique key
-                try:
-                    with open(os.path.join("bills", selected_bill), "r", encoding="utf-8") as f:
-                        bill_content = f.read()
-                    st.session_state.bill_content = bill_content
-                    display_success_message(f"Loaded bill from {selected_date}")
-                except Exception as e:
-                    display_error_message(f"Error loading bill: {str(e)}")
+                if st.button("View Bill", key="view_bill_by_date"):  # Added unique key
+                    try:
+                        with open(os.path.join("bills", selected_bill), "r", encoding="utf-8") as f:
+                            bill_content = f.read()
+                        st.session_state.bill_content = bill_content
+                        st.session_state.notice = f"Loaded bill from {selected_date}"
+                        # The preview is drawn by the billing section; rerun the app so it shows this bill
+                        st.rerun()
+                    except Exception as e:
+                        display_error_message(f"Error loading bill: {str(e)}")
+            else:
+                st.info(f"No bills found for {selected_date}.")
         else:
-            st.sidebar.info(f"No bills found for {selected_date}.")
-    else:
-        st.sidebar.info("No dated bills found. Please save a bill first.")
-
-# Reset button to clear the form
-st.sidebar.markdown("---")
-if st.sidebar.button("New Bill"):
-    # Generate a new bill number
-    st.session_state.billnumber = generate_bill_number()
-    # Clear session state
-    if "bill_content" in st.session_state:
-        del st.session_state.bill_content
-    if "totals" in st.session_state:
-        del st.session_state.totals
-    # Rerun the app to clear inputs
-    st.rerun()
+            st.info("No dated bills found. Please save a bill first.")
+
+
+# Profile this rerun when BILLING_PROFILE is set (see utils/profiling.py); st.rerun() and
+# st.stop() end the script with an exception, so the profile is finished in finally
+rerun_profile = profiling.start_rerun()
+try:
+    # Initialize session state
+    if "billnumber" not in st.session_state:
+        try:
+            st.session_state.billnumber = generate_bill_number()
+        except BillingServiceError as e:
+            # Nothing can be billed without a number; the next rerun asks the service again
+            st.error(str(e))
+            st.stop()
+
+    # Title
+    st.title("Grocery Billing System")
+
+    billing_section()
+
+    if st.session_state.get("show_email_form"):
+        email_section()
+
+    # Today's running totals, polled from the ledger when the sidebar toggle is on
+    display_live_ticker()
+
+    # Add a section for analytics
+    # Keep analytics open across reruns so its filters and buttons keep working
+    if st.sidebar.button("View Sales Analytics", type="primary"):
+        st.session_state.show_analytics = True
+    if st.session_state.get("show_analytics"):
+        if st.sidebar.button("Close Sales Analytics", key="close_analytics"):
+            st.session_state.show_analytics = False
+            st.rerun()
+        analytics_section()
+
+    # Add a search bill section
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("## Search Bills")
+    with st.sidebar:
+        search_section()
+
+    # Show this rerun's latencies and export the metrics file if BILLING_METRICS_FILE is set
+    st.sidebar.markdown("---")
+    metrics.observe("rerun.app", time.perf_counter() - rerun_started)
+    display_latency_panel()
+    metrics.flush()
+
+    # Reset button to clear the form
+    st.sidebar.markdown("---")
+    if st.sidebar.button("New Bill"):
+        # Generate a new bill number
+        try:
+            st.session_state.billnumber = generate_bill_number()
+        except BillingServiceError as e:
+            st.sidebar.error(str(e))
+            st.stop()
+        # Clear session state
+        if "bill_content" in st.session_state:
+            del st.session_state.bill_content
+        if "totals" in st.session_state:
+            del st.session_state.totals
+        # Rerun the app to clear inputs
+        st.rerun()
+finally:
+    profiling.finish_rerun(rerun_profile, st.session_state)
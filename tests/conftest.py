@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# The app runs from the repository root, which holds the utils package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import gst  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def default_slabs(tmp_path, monkeypatch):
+    """Tax with the built-in slab table rather than any data/gst_slabs.json on this machine."""
+    monkeypatch.setattr(gst, "default_slabs_path", lambda: str(tmp_path / "gst_slabs.json"))
+
+
+@pytest.fixture
+def when():
+    """A sale time inside the date windows of random_rules."""
+    return "2025-12-15 12:00:00"
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from utils.bill_operations import calculate_total
+from utils.cart import Cart
+from utils.gst import CATEGORY_NAMES, product_categories
+from utils.promotions import PromotionEngine, base_prices, random_rules
+
+KEYS = {name: key for key, name in CATEGORY_NAMES.items()}
+
+
+def products_by_category():
+    products = {key: [] for key in CATEGORY_NAMES}
+    for sku in sorted(base_prices):
+        products[KEYS[product_categories[sku]]].append(sku)
+    return products
+
+
+def random_cart(rng):
+    """Return {category key: {sku: quantity}} with a few lines."""
+    items = {key: {} for key in CATEGORY_NAMES}
+    for sku in rng.sample(sorted(base_prices), rng.randint(1, 8)):
+        items[KEYS[product_categories[sku]]][sku] = rng.randint(1, 6)
+    return items
+
+
+def fill(cart, items):
+    for key, quantities in items.items():
+        for sku, qty in quantities.items():
+            cart.set_quantity(key, sku, qty)
+
+
+def comparable(totals):
+    """Totals with the applied promotions in id order; the receipt lists them in line order."""
+    if "promotions" in totals:
+        totals = {**totals, "promotions": sorted(totals["promotions"], key=lambda promotion: promotion["id"])}
+    return totals
+
+
+def shuffled(items, rng):
+    skus = list(items)
+    rng.shuffle(skus)
+    return {sku: items[sku] for sku in skus}
+
+
+@pytest.mark.parametrize("with_promotions", [False, True])
+def test_cart_totals_match_calculate_total(with_promotions, when):
+    rng = random.Random(3)
+    engine = PromotionEngine(random_rules(300)) if with_promotions else None
+    for _ in range(100):
+        items = random_cart(rng)
+        cart = Cart(products_by_category(), base_prices)
+        fill(cart, items)
+        # calculate_total sees the lines in whatever order the dicts hold them
+        cosmetic, grocery, drink = (shuffled(items[key], rng) for key in ("cosmetic", "grocery", "drink"))
+        discounts = engine.evaluate_items(base_prices, cosmetic, grocery, drink, when=when) if engine else None
+        expected = calculate_total(cosmetic, grocery, drink, base_prices, discounts, when)
+        assert comparable(cart.totals(engine, when)) == comparable(expected)
+
+
+def test_quantity_changes_keep_subtotals_in_step():
+    rng = random.Random(4)
+    cart = Cart(products_by_category(), base_prices)
+    items = random_cart(rng)
+    fill(cart, items)
+    first_key = next(key for key in items if items[key])
+    sku = next(iter(items[first_key]))
+    cart.set_quantity(first_key, sku, 0)
+    del items[first_key][sku]
+    cart.set_quantity(first_key, sku, 2)
+    items[first_key][sku] = 2
+    for key, quantities in items.items():
+        assert cart.subtotals[key] == sum(base_prices[s] * q for s, q in quantities.items())
+    assert cart.item_count == sum(len(quantities) for quantities in items.values())
+
+
+def test_set_prices_reprices_copies_and_drops_unpriced_skus(when):
+    products = products_by_category()
+    kept, dropped = products["drink"][:2]
+    cart = Cart(products, base_prices)
+    cart.set_quantity("drink", kept, 2)
+    cart.set_quantity("drink", dropped, 1)
+    before = cart.totals(None, when)
+
+    prices = {sku: price for sku, price in base_prices.items() if sku != dropped}
+    prices[kept] += 5
+    assert cart.set_prices(prices) == [dropped]
+    prices[kept] = 1
+    assert cart.subtotals["drink"] == 2 * (base_prices[kept] + 5)
+    assert cart.items("drink") == {kept: 2}
+    assert cart.item_count == 1
+    assert cart.totals(None, when) != before
@@ -0,0 +1,17 @@
+from utils.customers import load_customers, update_customers
+
+
+def bill(bill_number, total):
+    return [{'Date': "2025-12-15 12:00:00", 'Bill Number': bill_number, 'Customer Name': "Asha K",
+             'Phone': "98-76", 'Total': total}]
+
+
+def test_a_bill_exported_after_later_bills_counts_once(tmp_path):
+    path = str(tmp_path / "customers.json")
+    update_customers(bill("BILL10001", 100.0), path)
+    update_customers(bill("BILL10002", 50.0), path)
+    # BILL10001 saved earlier is exported only now
+    update_customers(bill("BILL10001", 100.0), path)
+    record = load_customers(path)["asha k|9876"]
+    assert record["frequency"] == 2
+    assert record["monetary"] == 150.0
@@ -0,0 +1,66 @@
+import itertools
+import random
+
+import pytest
+
+from utils.gst import _allocate, get_gst_engine, net_line_paise, product_categories, tax_paise, to_paise
+
+
+def test_to_paise_rounds_to_the_nearest_paisa():
+    assert to_paise(0.1 + 0.2) == 30
+    assert to_paise(19.999) == 2000
+    assert list(to_paise([1.005, 2.675])) == [100, 268]
+
+
+def test_tax_paise_rounds_half_up():
+    # 25 paise at 18% is 4.5 paise
+    assert tax_paise(25, 1800) == 5
+    assert tax_paise(24, 1800) == 4
+    assert list(tax_paise([100, 1000], [500, 1200])) == [5, 120]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_allocate_takes_exactly_the_total(seed):
+    rng = random.Random(seed)
+    amounts = [rng.randint(1, 50000) for _ in range(rng.randint(1, 8))]
+    total = rng.randint(0, sum(amounts))
+    keys = [f"SKU{i}" for i in range(len(amounts))]
+    nets = _allocate(amounts, total, keys)
+    assert sum(amounts) - sum(nets) == total
+    for amount, net in zip(amounts, nets):
+        # Each share is within a paisa of its exact proportion
+        assert abs((amount - net) - total * amount / sum(amounts)) < 1
+        assert net >= 0
+
+
+def test_allocate_breaks_ties_by_key_not_position():
+    assert _allocate([100, 100, 100], 1, ["c", "a", "b"]) == [100, 99, 100]
+    assert _allocate([100, 100, 100], 1, ["a", "b", "c"]) == [99, 100, 100]
+    assert _allocate([100, 100], 0, ["a", "b"]) == [100, 100]
+
+
+def test_coupon_share_does_not_depend_on_line_order(when):
+    drinks = sorted(sku for sku, category in product_categories.items() if category == "Drinks")[:3]
+    # Equal lines leave equal remainders; one paisa has to go to one of them
+    lines = [(sku, 1, 100) for sku in drinks]
+    discounts = {"lines": {}, "categories": {"Drinks": 0.01}}
+    results = {
+        tuple(sorted(net_line_paise(list(order), discounts)))
+        for order in itertools.permutations(lines)
+    }
+    assert len(results) == 1
+    taxes = {
+        tuple(sorted(get_gst_engine().category_taxes(list(order), discounts, when).items()))
+        for order in itertools.permutations(lines)
+    }
+    assert len(taxes) == 1
+
+
+def test_net_line_paise_nets_line_and_coupon_discounts():
+    drinks = sorted(sku for sku, category in product_categories.items() if category == "Drinks")[:2]
+    lines = [(drinks[0], 2, 60), (drinks[1], 1, 110)]
+    discounts = {"lines": {drinks[0]: 12.0}, "categories": {"Drinks": 12.0 + 2.35}}
+    nets = net_line_paise(lines, discounts)
+    assert [(sku, gross) for sku, gross, _ in nets] == [(drinks[0], 12000), (drinks[1], 11000)]
+    assert sum(gross - net for _, gross, net in nets) == 1435
+    assert nets[0][1] - nets[0][2] >= 1200
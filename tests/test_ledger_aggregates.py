@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+from utils.ledger import append_bills, read_line_items
+from utils.ledger_aggregates import LedgerAggregates, _synthetic_ledger
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    _synthetic_ledger(path, 3000)
+    return path
+
+
+def expected_by(line_items, field):
+    return line_items.groupby(field)[['Total', 'Quantity']].sum().reset_index()
+
+
+def test_small_chunks_match_the_full_read(ledger_path):
+    line_items = read_line_items(ledger_path)
+    # Chunks much smaller than a day's sales, ending part-way through bills
+    aggregates = LedgerAggregates(ledger_path, chunk_rows=7)
+    aggregates.refresh()
+
+    summary = aggregates.sales_summary()
+    assert summary["total"] == pytest.approx(line_items['Total'].sum())
+    assert summary["quantity"] == line_items['Quantity'].sum()
+    assert summary["bills"] == line_items['Bill Number'].nunique()
+    assert summary["average"] == pytest.approx(line_items['Total'].mean())
+
+    for field in ('Category', 'Product'):
+        pd.testing.assert_frame_equal(
+            aggregates.sales_by(field), expected_by(line_items, field), check_dtype=False
+        )
+
+    days = aggregates.sales_over_time("Day").set_index('Date')['Total']
+    expected_days = line_items.groupby(line_items['Date'].dt.date)['Total'].sum()
+    pd.testing.assert_series_equal(days, expected_days, check_names=False, check_index_type=False)
+
+    months = aggregates.sales_over_time("Month").set_index('Month')['Total']
+    expected_months = line_items.groupby(line_items['Date'].dt.strftime('%Y-%m'))['Total'].sum()
+    pd.testing.assert_series_equal(months, expected_months, check_names=False)
+
+
+def test_filters_match_the_full_read(ledger_path):
+    line_items = read_line_items(ledger_path)
+    aggregates = LedgerAggregates(ledger_path, chunk_rows=11)
+    aggregates.refresh()
+    category = sorted(line_items['Category'].unique())[0]
+    start, end = pd.Timestamp("2024-03-01").date(), pd.Timestamp("2024-08-31").date()
+
+    summary = aggregates.sales_summary(start, end, category)
+    selected = line_items[
+        (line_items['Category'] == category)
+        & (line_items['Date'].dt.date >= start) & (line_items['Date'].dt.date <= end)
+    ]
+    assert summary["total"] == pytest.approx(selected['Total'].sum())
+    assert summary["quantity"] == selected['Quantity'].sum()
+    assert summary["bills"] == selected['Bill Number'].nunique()
+
+
+def test_refresh_folds_in_only_new_bills(ledger_path):
+    aggregates = LedgerAggregates(ledger_path, chunk_rows=13)
+    first = aggregates.refresh()
+    new_bill = pd.DataFrame([{
+        'Date': pd.Timestamp("2025-06-01 10:00:00"), 'Bill Number': "NEW0001", 'Customer Name': "Asha",
+        'Phone': "9000000001", 'Category': "Drinks", 'Product': "Red Bull", 'Quantity': 3,
+        'Price': 120, 'Discount': 0.0, 'Total': 360.0
+    }])
+    append_bills(new_bill, source="test", ledger_path=ledger_path)
+
+    assert aggregates.refresh() == 1
+    assert aggregates.rows == first + 1
+    line_items = read_line_items(ledger_path)
+    summary = aggregates.sales_summary()
+    assert summary["total"] == pytest.approx(line_items['Total'].sum())
+    assert summary["bills"] == line_items['Bill Number'].nunique()
@@ -0,0 +1,24 @@
+import random
+
+from utils.bill_operations import build_bill_rows
+from utils.cart import Cart
+from utils.migrate_bills import parse_txt_bill
+from utils.promotions import PromotionEngine, base_prices, random_rules
+
+from test_cart import fill, products_by_category, random_cart
+
+
+def test_text_bills_migrate_net_of_discount_like_excel_rows(tmp_path, when):
+    rng = random.Random(5)
+    engine = PromotionEngine(random_rules(300))
+    for i in range(100):
+        items = random_cart(rng)
+        cart = Cart(products_by_category(), base_prices)
+        fill(cart, items)
+        totals = cart.totals(engine, when)
+        bill_path = tmp_path / f"BILL{i:05d}.txt"
+        bill_path.write_text(cart.receipt("Asha", "9876543210", f"BILL{i:05d}", totals=totals), encoding="utf-8")
+        expected = build_bill_rows("Asha", "9876543210", f"BILL{i:05d}", items["cosmetic"], items["grocery"],
+                                   items["drink"], base_prices, totals=totals)
+        parsed = {row["Product"]: (row.get("Discount", 0.0), row["Total"]) for row in parse_txt_bill(bill_path)}
+        assert parsed == {row["Product"]: (row["Discount"], row["Total"]) for row in expected}
@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from utils.gst import to_paise
+from utils.promotions import PromotionEngine, _scan_total, base_prices, random_rules
+
+
+def random_carts(n, seed=1):
+    rng = random.Random(seed)
+    skus = sorted(base_prices)
+    return [
+        [(sku, rng.randint(1, 6), base_prices[sku]) for sku in rng.sample(skus, rng.randint(1, 10))]
+        for _ in range(n)
+    ]
+
+
+@pytest.mark.parametrize("n_rules", [10, 300, 2000])
+def test_indexed_evaluation_matches_full_scan(n_rules, when):
+    rules = random_rules(n_rules)
+    engine = PromotionEngine(rules)
+    for cart in random_carts(200):
+        assert engine.evaluate(cart, when)["total"] == pytest.approx(_scan_total(rules, cart, when), abs=0.011)
+
+
+def test_line_discounts_add_up_to_the_total(when):
+    rules = random_rules(500)
+    engine = PromotionEngine(rules)
+    for cart in random_carts(100, seed=2):
+        discounts = engine.evaluate(cart, when)
+        # Compared in paise: the category shares must add up to the saving printed on the receipt
+        assert sum(to_paise(list(discounts["lines"].values()))) + to_paise(discounts["cart"]) == to_paise(discounts["total"])
+        assert sum(to_paise(list(discounts["categories"].values()))) == to_paise(discounts["total"])
+
+
+def test_coupon_is_split_across_categories_to_the_paisa(when):
+    skus = ["Dove Bath Soap", "Basmati Rice", "Red Bull"]
+    rules = [{"id": "T1", "type": "threshold", "min_subtotal": 1, "amount_off": 50,
+              "start": "2020-01-01 00:00:00", "end": "2030-01-01 00:00:00"}]
+    discounts = PromotionEngine(rules).evaluate([(sku, 1, base_prices[sku]) for sku in skus], when)
+    assert discounts["total"] == 50
+    assert sum(to_paise(list(discounts["categories"].values()))) == 5000
+
+
+def test_rules_outside_their_dates_do_not_apply():
+    sku = sorted(base_prices)[0]
+    rules = [{"id": "P1", "type": "percent_off", "sku": sku, "percent": 10,
+              "start": "2026-01-01 00:00:00", "end": "2026-02-01 00:00:00"}]
+    engine = PromotionEngine(rules)
+    cart = [(sku, 2, base_prices[sku])]
+    assert engine.evaluate(cart, "2025-12-31 23:59:59")["total"] == 0
+    assert engine.evaluate(cart, "2026-01-15 10:00:00")["total"] == pytest.approx(0.2 * base_prices[sku])
@@ -0,0 +1,78 @@
+import glob
+import os
+
+from utils import sync_queue
+from utils.ledger import read_line_items
+from utils.sync_queue import Outbox, ingest
+
+
+def rows(bill_number, product, total):
+    return {"rows": [{
+        'Date': "2025-12-15 12:00:00", 'Bill Number': bill_number, 'Customer Name': "Asha",
+        'Phone': "9800000000", 'Category': "Drinks", 'Product': product,
+        'Quantity': 1, 'Price': total, 'Discount': 0.0, 'Total': total
+    }]}
+
+
+def drain(outbox, central):
+    while outbox.sync(central)["result"] == "shipped":
+        pass
+
+
+def test_outboxes_sharing_a_directory_number_records_in_turn(tmp_path):
+    # Two processes, such as the app and batch billing, each with their own Outbox
+    app, batch = Outbox(str(tmp_path / "outbox"), "till1"), Outbox(str(tmp_path / "outbox"), "till1")
+    assert app.enqueue("bill", "BILL10001", {"content": "a"}) == 1
+    assert batch.enqueue("bill", "BILL10002", {"content": "b"}) == 2
+    assert app.enqueue("bill", "BILL10003", {"content": "c"}) == 3
+
+    central = str(tmp_path / "central")
+    os.makedirs(central)
+    drain(batch, central)
+    ingest(central)
+    # The other process's compaction keeps the records it has not seen acknowledged
+    assert app.sync(central)["pending"] == 0
+    assert app.enqueue("bill", "BILL10004", {"content": "d"}) == 4
+    assert sorted(os.listdir(os.path.join(central, "bills"))) == [
+        f"till1-BILL1000{i}.txt" for i in range(1, 4)
+    ]
+
+
+def test_terminals_drawing_the_same_bill_number_keep_both_bills(tmp_path):
+    central = str(tmp_path / "central")
+    os.makedirs(central)
+    for terminal, product, total in (("till1", "Red Bull", 125.0), ("till2", "Coca Cola", 40.0)):
+        outbox = Outbox(str(tmp_path / terminal), terminal)
+        outbox.enqueue("rows", "BILL12345", rows("BILL12345", product, total))
+        outbox.enqueue("bill", "BILL12345", {"content": product})
+        drain(outbox, central)
+    assert ingest(central)["new_bills"] == 2
+
+    line_items = read_line_items(os.path.join(central, "ledger.db")).set_index('Bill Number')
+    assert line_items.loc["till1-BILL12345", 'Product'] == "Red Bull"
+    assert line_items.loc["till2-BILL12345", 'Product'] == "Coca Cola"
+    with open(os.path.join(central, "bills", "till2-BILL12345.txt"), encoding="utf-8") as f:
+        assert f.read() == "Coca Cola"
+
+
+def test_rejected_delta_is_not_acknowledged_past(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_queue, "MAX_BATCH_RECORDS", 1)
+    central = str(tmp_path / "central")
+    os.makedirs(central)
+    outbox = Outbox(str(tmp_path / "outbox"), "till1")
+    for i in range(1, 4):
+        outbox.enqueue("bill", f"BILL1000{i}", {"content": str(i)})
+    drain(outbox, central)
+
+    first = sorted(glob.glob(os.path.join(central, "inbox", "*.jsonl.gz")))[0]
+    with open(first, "wb") as f:
+        f.write(b"not gzip")
+    ingest(central)
+    assert os.listdir(os.path.join(central, "rejected")) == [os.path.basename(first)]
+
+    # Nothing is acknowledged past the gap, so the terminal ships the records again
+    assert outbox.sync(central)["acked_seq"] == 0
+    drain(outbox, central)
+    ingest(central)
+    assert outbox.sync(central)["pending"] == 0
+    assert len(os.listdir(os.path.join(central, "bills"))) == 3
@@ -3,13 +3,412 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import io
+import tempfile
 from datetime import datetime
 import os
+
+from . import figure_cache, metrics, mongo_storage, profiling
+from .basket import update_basket
+from .customers import load_customers, rebuild_customers, rfm_table, top_customers
+from .excel_cache import read_excel_cached
+from .forecasting import reorder_plan
+from .gst import get_gst_engine
+from .inventory import get_stock_ledger, read_counts_from
+from .ledger_aggregates import get_ledger_aggregates
+from .price_catalog import get_price_catalog
+from .sketches import load_sketch, rebuild_sketches
+from .sql_analytics import line_items, preview_query, stream_query
 # Removed seaborn and matplotlib imports
 # Removed streamlit_mito import
 
+# "files" loads the bill files into one frame; "ledger" reads chunked aggregates of the ledger
+ANALYTICS_SOURCE = os.environ.get("BILLING_ANALYTICS_SOURCE", "files")
+
 def visualize_sales_data(excel_files=None):
     """Visualize sales data based on date, week, month, and year."""
+    # Time each stage of the run (load, normalize, filter, aggregate, chart, report)
+    timer = metrics.StageTimer("analytics")
+    try:
+        if ANALYTICS_SOURCE == "ledger":
+            _render_ledger_analytics(timer)
+        else:
+            _render_sales_data(excel_files, timer)
+    finally:
+        timer.finish()
+
+def _pushdown_filters():
+    """Return the active analytics filters as keyword arguments for the MongoDB aggregates."""
+    return {
+        "start_date": st.session_state.get('start_date'),
+        "end_date": st.session_state.get('end_date'),
+        "category": st.session_state.get('selected_category', 'All'),
+        "product": st.session_state.get('selected_product', 'All')
+    }
+
+
+def _pushdown_source(version, sales_data):
+    """
+    Return mongo_storage when the charts aggregate in MongoDB, else None to aggregate the frame.
+
+    MongoDB only has the bills mirrored since it was enabled (plus any backfill),
+    so it is used only while it holds every bill in sales_data; the check is
+    remembered per data version.
+    """
+    if not mongo_storage.enabled():
+        return None
+    checked = st.session_state.get('mongo_coverage')
+    if checked is None or checked[0] != version:
+        try:
+            covered = mongo_storage.covers(sales_data['Bill Number'].unique())
+        except Exception as e:
+            print(f"Error checking MongoDB coverage: {e}")
+            covered = False
+        checked = (version, covered)
+        st.session_state.mongo_coverage = checked
+    return mongo_storage if checked[1] else None
+
+
+def _render_custom_query():
+    """Run a read-only SQL query over the sales ledger and stream its result to CSV/Excel."""
+    st.caption("Query the `sales` view: the ledger line items matching the filters above "
+               "(columns: date, bill_number, customer_name, phone, category, product, quantity, price, discount, "
+               "total net of discount).")
+    sql = st.text_area(
+        "SQL Query",
+        "SELECT product, SUM(quantity) AS quantity, SUM(total) AS total\nFROM sales\nGROUP BY product\nORDER BY total DESC",
+        key="custom_query_sql"
+    )
+    output_format = st.radio("Output Format", ["CSV", "Excel"], horizontal=True, key="custom_query_format")
+    if not st.button("Run Query", key="run_custom_query"):
+        return
+
+    filters = _pushdown_filters()
+    try:
+        st.dataframe(preview_query(sql, **filters), use_container_width=True)
+
+        # Stream the full result to a temporary file rather than a DataFrame
+        with tempfile.TemporaryFile() as out:
+            if output_format == "CSV":
+                text_out = io.TextIOWrapper(out, encoding="utf-8", newline="")
+                rows = stream_query(sql, text_out, "csv", **filters)
+                text_out.flush()
+                text_out.detach()
+                extension, mime = "csv", "text/csv"
+            else:
+                rows = stream_query(sql, out, "xlsx", **filters)
+                extension, mime = "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            out.seek(0)
+            data = out.read()
+    except Exception as e:
+        st.error(f"Query failed: {e}")
+        return
+
+    st.caption(f"{rows} rows")
+    st.download_button(
+        label="Download Query Result",
+        data=data,
+        file_name=f"custom_query_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+        mime=mime,
+        key="download_custom_query"
+    )
+
+
+def _category_figures(sales_data, source=None):
+    """Build the pie and bar charts of sales by category."""
+    if source is not None:
+        category_sales = source.sales_by('Category', **_pushdown_filters())[['Category', 'Total']]
+    else:
+        category_sales = sales_data.groupby('Category')['Total'].sum().reset_index()
+    
+    # Pie chart for category distribution using Plotly
+    pie = px.pie(
+        category_sales, 
+        values='Total', 
+        names='Category', 
+        title='Sales by Category',
+        hover_data=['Total'],
+        labels={'Total': 'Sales Amount (₹)'},
+        color_discrete_sequence=px.colors.qualitative.Bold
+    )
+    pie.update_traces(textposition='inside', textinfo='percent+label')
+    pie.update_layout(
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=14,
+            font_family="Arial"
+        )
+    )
+    
+    # Bar chart for category sales using Plotly
+    bar = px.bar(
+        category_sales, 
+        x='Category', 
+        y='Total', 
+        title='Total Sales by Category',
+        labels={'Total': 'Sales Amount (₹)', 'Category': 'Product Category'},
+        color='Category',
+        color_discrete_sequence=px.colors.qualitative.Bold
+    )
+    bar.update_layout(
+        xaxis_tickangle=-45,
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=14,
+            font_family="Arial"
+        )
+    )
+    return pie, bar
+
+
+def _trend_figures(sales_data, time_grouping, source=None):
+    """Build the line and bar charts of sales per day, week or month."""
+    if source is not None:
+        time_data = source.sales_over_time(time_grouping, **_pushdown_filters())
+        x_label = {"Day": 'Date', "Week": 'Period', "Month": 'Month'}[time_grouping]
+    elif time_grouping == "Day":
+        time_data = sales_data.groupby(sales_data['Date'].dt.date)['Total'].sum().reset_index()
+        x_label = 'Date'
+    elif time_grouping == "Week":
+        time_data = sales_data.groupby(['Year', 'Week'])['Total'].sum().reset_index()
+        time_data['Period'] = time_data['Year'].astype(str) + '-W' + time_data['Week'].astype(str)
+        x_label = 'Period'
+    else:  # Month
+        time_data = sales_data.groupby('Month')['Total'].sum().reset_index()
+        x_label = 'Month'
+    
+    # Create interactive line plot with Plotly
+    if x_label == 'Period':
+        line = px.line(
+            time_data, 
+            x='Period', 
+            y='Total', 
+            title=f'Sales Trend by {time_grouping}',
+            markers=True,
+            labels={'Total': 'Sales Amount (₹)', 'Period': 'Time Period'},
+            line_shape='spline',
+            render_mode='svg'
+        )
+    else:
+        line = px.line(
+            time_data, 
+            x=x_label, 
+            y='Total', 
+            title=f'Sales Trend by {time_grouping}',
+            markers=True,
+            labels={'Total': 'Sales Amount (₹)', x_label: f'{time_grouping}'},
+            line_shape='spline',
+            render_mode='svg'
+        )
+    
+    line.update_traces(
+        line=dict(width=3),
+        marker=dict(size=8)
+    )
+    line.update_layout(
+        xaxis_tickangle=-45 if x_label != 'Date' else 0,
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=14,
+            font_family="Arial"
+        ),
+        hovermode="x unified"
+    )
+    
+    # Add a bar chart showing the same data
+    if x_label == 'Period':
+        bar = px.bar(
+            time_data,
+            x='Period',
+            y='Total',
+            title=f'Sales by {time_grouping}',
+            labels={'Total': 'Sales Amount (₹)', 'Period': 'Time Period'},
+            color_discrete_sequence=['#1f77b4']
+        )
+    else:
+        bar = px.bar(
+            time_data,
+            x=x_label,
+            y='Total',
+            title=f'Sales by {time_grouping}',
+            labels={'Total': 'Sales Amount (₹)', x_label: f'{time_grouping}'},
+            color_discrete_sequence=['#1f77b4']
+        )
+    
+    bar.update_layout(
+        xaxis_tickangle=-45 if x_label != 'Date' else 0,
+        hoverlabel=dict(
+            bgcolor="white",
+            font_size=14,
+            font_family="Arial"
+        )
+    )
+    return line, bar
+
+
+def _product_figure(sales_data, product, time_period, source=None):
+    """Build the quantity and sales chart of one product over time, or None if it has no sales."""
+    if source is not None:
+        filters = _pushdown_filters()
+        if filters['product'] not in ('All', product):
+            return None
+        filters['product'] = product
+        product_time_grouped = source.sales_over_time(time_period, **filters)
+        x_axis = {"Day": 'Date', "Week": 'Period', "Month": 'Month'}[time_period]
+        if time_period == "Day":
+            # The daily chart shows quantity only, as the pandas path does
+            product_time_grouped = product_time_grouped.drop(columns='Total')
+        return _product_time_figure(product_time_grouped, product, time_period, x_axis)
+    
+    # Filter data for the selected product
+    product_time_data = sales_data[sales_data['Product'] == product]
+    
+    if time_period == "Day":
+        product_time_grouped = product_time_data.groupby(product_time_data['Date'].dt.date)['Quantity'].sum().reset_index()
+        x_axis = 'Date'
+    elif time_period == "Week":
+        product_time_grouped = product_time_data.groupby(['Year', 'Week'])[['Quantity', 'Total']].sum().reset_index()
+        product_time_grouped['Period'] = product_time_grouped['Year'].astype(str) + '-W' + product_time_grouped['Week'].astype(str)
+        x_axis = 'Period'
+    else:  # Month
+        product_time_grouped = product_time_data.groupby('Month')[['Quantity', 'Total']].sum().reset_index()
+        x_axis = 'Month'
+    return _product_time_figure(product_time_grouped, product, time_period, x_axis)
+
+
+def _product_time_figure(product_time_grouped, product, time_period, x_axis):
+    """Draw quantity (and sales, when grouped) of one product against x_axis."""
+    if product_time_grouped.empty:
+        return None
+    
+    # Create a two-line chart showing quantity and sales amount
+    fig = go.Figure()
+    
+    # Add quantity line
+    fig.add_trace(go.Scatter(
+        x=product_time_grouped[x_axis],
+        y=product_time_grouped['Quantity'],
+        name='Quantity Sold',
+        line=dict(color='#1f77b4', width=3),
+        mode='lines+markers'
+    ))
+    
+    # Add sales amount line if available
+    if 'Total' in product_time_grouped.columns:
+        fig.add_trace(go.Scatter(
+            x=product_time_grouped[x_axis],
+            y=product_time_grouped['Total'],
+            name='Sales Amount (₹)',
+            line=dict(color='#ff7f0e', width=3),
+            mode='lines+markers',
+            yaxis='y2'
+        ))
+    # Update layout for dual y-axis
+    fig.update_layout(
+        title=f'{product} Performance by {time_period}',
+        xaxis=dict(title=time_period),
+        yaxis=dict(
+            title='Quantity Sold', 
+            title_font=dict(color='#1f77b4'),  # Changed from titlefont to title_font
+            tickfont=dict(color='#1f77b4')
+        ),
+        yaxis2=dict(
+            title='Sales Amount (₹)', 
+            title_font=dict(color='#ff7f0e'),  # Changed from titlefont to title_font
+            tickfont=dict(color='#ff7f0e'), 
+            anchor='x', 
+            overlaying='y', 
+            side='right'
+        ),
+        hovermode='x unified',
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+        margin=dict(l=60, r=60, t=50, b=50)
+    )
+    return fig
+
+
+def _render_visualizations(version, products, sales_data=None, source=None):
+    """
+    Render the selected chart view from the shared figure cache.
+
+    Args:
+        version: data version the cached figures are keyed by
+        products (list): products offered in the Product Analysis view
+        sales_data (pd.DataFrame): filtered line items, when the charts aggregate in pandas
+        source: mongo_storage or LedgerAggregates, when the charts read pre-aggregated sales instead
+    """
+    st.subheader("Sales Visualizations")
+    
+    # Only the selected view is aggregated and drawn; its figures come from the shared figure cache
+    view = st.radio(
+        "View",
+        ["Sales by Category", "Sales Trends", "Product Analysis"],
+        horizontal=True,
+        key="analytics_view",
+        label_visibility="collapsed"
+    )
+    filters = tuple(_pushdown_filters().items())
+    
+    # Sales by Category view
+    if view == "Sales by Category":
+        st.markdown("### Sales by Category")
+        
+        pie, bar = figure_cache.get_figures(
+            (version, filters, "category"),
+            lambda: _category_figures(sales_data, source)
+        )
+        st.plotly_chart(pie, use_container_width=True)
+        st.plotly_chart(bar, use_container_width=True)
+    
+    # Sales Trends view
+    elif view == "Sales Trends":
+        st.markdown("### Sales Trends")
+        
+        # Time series plot using Plotly
+        time_grouping = st.selectbox(
+            "Group By",
+            ["Day", "Week", "Month"],
+            key="time_grouping"
+        )
+        
+        line, bar = figure_cache.get_figures(
+            (version, filters, "trends", time_grouping),
+            lambda: _trend_figures(sales_data, time_grouping, source)
+        )
+        st.plotly_chart(line, use_container_width=True)
+        st.plotly_chart(bar, use_container_width=True)
+    
+    # Product Analysis view
+    elif products:
+        # Add product performance over time
+        st.markdown("### Product Performance Over Time")
+        
+        # Select a specific product to analyze
+        selected_product_analysis = st.selectbox(
+            "Select Product for Time Analysis",
+            products,
+            key="product_time_analysis"
+        )
+        
+        # Group by time period
+        time_period = st.radio(
+            "Select Time Period",
+            ["Day", "Week", "Month"],
+            horizontal=True,
+            key="product_time_period"
+        )
+        
+        fig = figure_cache.get_figures(
+            (version, filters, "product", selected_product_analysis, time_period),
+            lambda: _product_figure(sales_data, selected_product_analysis, time_period, source)
+        )
+        if fig is not None:
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info(f"No time-series data available for {selected_product_analysis}.")
+
+
+def _render_sales_data(excel_files, timer):
+    """Load the bill files and render the analytics sections."""
     st.markdown('<div class="section-header">Sales Data Visualization</div>', unsafe_allow_html=True)
     
     # If no files are provided, use the master file
@@ -30,8 +429,8 @@ def visualize_sales_data(excel_files=None):
     all_data = []
     for file in excel_files:
         try:
-            # Read the Excel file - assuming all bills are in a single sheet
-            df = pd.read_excel(file)
+            # Read the Excel file (or its cached Feather copy) - assuming all bills are in a single sheet
+            df = read_excel_cached(file)
             
             # Skip the summary row (last row) if it exists
             if not df.empty and 'Category' in df.columns:
@@ -45,6 +444,10 @@ def visualize_sales_data(excel_files=None):
         except Exception as e:
             st.warning(f"Could not read {file}: {e}")
     
+    # Charts are cached against the files they were built from
+    version = figure_cache.data_version(excel_files)
+    timer.mark("load")
+    
     if not all_data:
         st.warning("No valid data found in the Excel files.")
         return
@@ -71,6 +474,7 @@ def visualize_sales_data(excel_files=None):
     except Exception as e:
         st.error(f"Error processing date columns: {e}")
         return
+    timer.mark("normalize")
     
     # Store filter state in session state to persist between reruns
     if 'filter_expanded' not in st.session_state:
@@ -170,7 +574,10 @@ def visualize_sales_data(excel_files=None):
         st.experimental_rerun()
     
     # Use the filtered data for the rest of the application
+    all_sales_data = sales_data
     sales_data = filtered_data
+    timer.mark("filter")
+    profiling.note_frame("analytics.sales_data", sales_data)
     
     # Check if filtered data is empty
     if sales_data.empty:
@@ -179,292 +586,210 @@ def visualize_sales_data(excel_files=None):
     
     # Display summary metrics
     st.subheader("Sales Summary")
-    col1, col2, col3, col4 = st.columns(4)
+    
+    pushdown = _pushdown_source(version, all_sales_data)
+    
+    # Use the day/category sketches when they hold exactly this history and no product filter is set
+    sketch = load_sketch()
+    sketch_covers = sketch.seeded and sketch.covers(all_sales_data, version)
+    if sketch_covers and st.session_state.get('selected_product', 'All') == 'All':
+        summary = sketch.summarize(
+            st.session_state.get('start_date'),
+            st.session_state.get('end_date'),
+            st.session_state.get('selected_category', 'All')
+        )
+        st.caption("Transaction counts and bill percentiles are approximate (from sales sketches).")
+    elif pushdown is not None:
+        # Aggregated by MongoDB; only the metric values come back
+        summary = mongo_storage.sales_summary(**_pushdown_filters())
+    else:
+        bill_values = sales_data.groupby('Bill Number')['Total'].sum()
+        summary = {
+            "total": sales_data['Total'].sum(),
+            "quantity": sales_data['Quantity'].sum(),
+            "average": sales_data['Total'].mean(),
+            "bills": sales_data['Bill Number'].nunique(),
+            "median_bill": bill_values.median(),
+            "p90_bill": bill_values.quantile(0.9)
+        }
+        if not sketch_covers and st.button("Build Summary Sketches", key="rebuild_sketches"):
+            rebuild_sketches(all_sales_data)
+            st.rerun()
+    
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
     
     with col1:
-        st.metric("Total Sales", f"₹{sales_data['Total'].sum():.2f}")
+        st.metric("Total Sales", f"₹{summary['total']:.2f}")
     with col2:
-        st.metric("Total Items Sold", f"{sales_data['Quantity'].sum()}")
+        st.metric("Total Items Sold", f"{summary['quantity']}")
     with col3:
-        st.metric("Average Sale Value", f"₹{sales_data['Total'].mean():.2f}")
+        st.metric("Average Sale Value", f"₹{summary['average']:.2f}")
     with col4:
-        st.metric("Number of Transactions", f"{sales_data['Bill Number'].nunique()}")
+        st.metric("Number of Transactions", f"{summary['bills']}")
+    with col5:
+        st.metric("Median Bill", f"₹{summary['median_bill']:.2f}")
+    with col6:
+        st.metric("90th Percentile Bill", f"₹{summary['p90_bill']:.2f}")
+    timer.mark("aggregate")
     
     # Visualization section
-    st.subheader("Sales Visualizations")
-    
-    # Create tabs for different visualizations
-    viz_tabs = st.tabs(["Sales by Category", "Sales Trends", "Product Analysis"])
-    
-    # Sales by Category tab
-    with viz_tabs[0]:
-        st.markdown("### Sales by Category")
-        
-        # Pie chart for category distribution using Plotly
-        category_sales = sales_data.groupby('Category')['Total'].sum().reset_index()
-        
-        fig = px.pie(
-            category_sales, 
-            values='Total', 
-            names='Category', 
-            title='Sales by Category',
-            hover_data=['Total'],
-            labels={'Total': 'Sales Amount (₹)'},
-            color_discrete_sequence=px.colors.qualitative.Bold
-        )
-        fig.update_traces(textposition='inside', textinfo='percent+label')
-        fig.update_layout(
-            hoverlabel=dict(
-                bgcolor="white",
-                font_size=14,
-                font_family="Arial"
-            )
-        )
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # Bar chart for category sales using Plotly
-        fig = px.bar(
-            category_sales, 
-            x='Category', 
-            y='Total', 
-            title='Total Sales by Category',
-            labels={'Total': 'Sales Amount (₹)', 'Category': 'Product Category'},
-            color='Category',
-            color_discrete_sequence=px.colors.qualitative.Bold
-        )
-        fig.update_layout(
-            xaxis_tickangle=-45,
-            hoverlabel=dict(
-                bgcolor="white",
-                font_size=14,
-                font_family="Arial"
-            )
-        )
-        st.plotly_chart(fig, use_container_width=True)
-    
-    # Sales Trends tab
-    with viz_tabs[1]:
-        st.markdown("### Sales Trends")
-        
-        # Time series plot using Plotly
-        time_grouping = st.selectbox(
-            "Group By",
-            ["Day", "Week", "Month"],
-            key="time_grouping"
-        )
-        
-        if time_grouping == "Day":
-            time_data = sales_data.groupby(sales_data['Date'].dt.date)['Total'].sum().reset_index()
-            x_label = 'Date'
-        elif time_grouping == "Week":
-            time_data = sales_data.groupby(['Year', 'Week'])['Total'].sum().reset_index()
-            time_data['Period'] = time_data['Year'].astype(str) + '-W' + time_data['Week'].astype(str)
-            x_label = 'Period'
-        else:  # Month
-            time_data = sales_data.groupby('Month')['Total'].sum().reset_index()
-            x_label = 'Month'
-        
-        # Create interactive line plot with Plotly
-        if x_label == 'Period':
-            fig = px.line(
-                time_data, 
-                x='Period', 
-                y='Total', 
-                title=f'Sales Trend by {time_grouping}',
-                markers=True,
-                labels={'Total': 'Sales Amount (₹)', 'Period': 'Time Period'},
-                line_shape='spline',
-                render_mode='svg'
-            )
-        else:
-            fig = px.line(
-                time_data, 
-                x=x_label, 
-                y='Total', 
-                title=f'Sales Trend by {time_grouping}',
-                markers=True,
-                labels={'Total': 'Sales Amount (₹)', x_label: f'{time_grouping}'},
-                line_shape='spline',
-                render_mode='svg'
-            )
-        
-        fig.update_traces(
-            line=dict(width=3),
-            marker=dict(size=8)
-        )
-        fig.update_layout(
-            xaxis_tickangle=-45 if x_label != 'Date' else 0,
-            hoverlabel=dict(
-                bgcolor="white",
-                font_size=14,
-                font_family="Arial"
-            ),
-            hovermode="x unified"
-        )
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # Add a bar chart showing the same data
-        if x_label == 'Period':
-            fig = px.bar(
-                time_data,
-                x='Period',
-                y='Total',
-                title=f'Sales by {time_grouping}',
-                labels={'Total': 'Sales Amount (₹)', 'Period': 'Time Period'},
-                color_discrete_sequence=['#1f77b4']
-            )
-        else:
-            fig = px.bar(
-                time_data,
-                x=x_label,
-                y='Total',
-                title=f'Sales by {time_grouping}',
-                labels={'Total': 'Sales Amount (₹)', x_label: f'{time_grouping}'},
-                color_discrete_sequence=['#1f77b4']
-            )
-        
-        fig.update_layout(
-            xaxis_tickangle=-45 if x_label != 'Date' else 0,
-            hoverlabel=dict(
-                bgcolor="white",
-                font_size=14,
-                font_family="Arial"
-            )
-        )
-        st.plotly_chart(fig, use_container_width=True)
-    # Product Analysis tab (continued)
-    with viz_tabs[2]:
-        # Add product performance over time
-        if not sales_data.empty and 'Product' in sales_data.columns and sales_data['Product'].nunique() > 0:
-            st.markdown("### Product Performance Over Time")
-            
-            # Select a specific product to analyze
-            available_products = sorted(sales_data['Product'].unique().tolist())
-            if available_products:
-                selected_product_analysis = st.selectbox(
-                    "Select Product for Time Analysis",
-                    available_products,
-                    key="product_time_analysis"
-                )
-                
-                # Filter data for the selected product
-                product_time_data = sales_data[sales_data['Product'] == selected_product_analysis]
-                
-                # Group by time period
-                time_period = st.radio(
-                    "Select Time Period",
-                    ["Day", "Week", "Month"],
-                    horizontal=True,
-                    key="product_time_period"
-                )
-                
-                if time_period == "Day":
-                    product_time_grouped = product_time_data.groupby(product_time_data['Date'].dt.date)['Quantity'].sum().reset_index()
-                    x_axis = 'Date'
-                elif time_period == "Week":
-                    product_time_grouped = product_time_data.groupby(['Year', 'Week'])[['Quantity', 'Total']].sum().reset_index()
-                    product_time_grouped['Period'] = product_time_grouped['Year'].astype(str) + '-W' + product_time_grouped['Week'].astype(str)
-                    x_axis = 'Period'
-                else:  # Month
-                    product_time_grouped = product_time_data.groupby('Month')[['Quantity', 'Total']].sum().reset_index()
-                    x_axis = 'Month'
-                
-                # Create visualization
-                if not product_time_grouped.empty:
-                    # Create a two-line chart showing quantity and sales amount
-                    fig = go.Figure()
-                    
-                    # Add quantity line
-                    fig.add_trace(go.Scatter(
-                        x=product_time_grouped[x_axis],
-                        y=product_time_grouped['Quantity'],
-                        name='Quantity Sold',
-                        line=dict(color='#1f77b4', width=3),
-                        mode='lines+markers'
-                    ))
-                    
-                    # Add sales amount line if available
-                    if 'Total' in product_time_grouped.columns:
-                        fig.add_trace(go.Scatter(
-                            x=product_time_grouped[x_axis],
-                            y=product_time_grouped['Total'],
-                            name='Sales Amount (₹)',
-                            line=dict(color='#ff7f0e', width=3),
-                            mode='lines+markers',
-                            yaxis='y2'
-                        ))
-                    # Update layout for dual y-axis
-                    fig.update_layout(
-                        title=f'{selected_product_analysis} Performance by {time_period}',
-                        xaxis=dict(title=time_period),
-                        yaxis=dict(
-                            title='Quantity Sold', 
-                            title_font=dict(color='#1f77b4'),  # Changed from titlefont to title_font
-                            tickfont=dict(color='#1f77b4')
-                        ),
-                        yaxis2=dict(
-                            title='Sales Amount (₹)', 
-                            title_font=dict(color='#ff7f0e'),  # Changed from titlefont to title_font
-                            tickfont=dict(color='#ff7f0e'), 
-                            anchor='x', 
-                            overlaying='y', 
-                            side='right'
-                        ),
-                        hovermode='x unified',
-                        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
-                        margin=dict(l=60, r=60, t=50, b=50)
-                    )
-                    st.plotly_chart(fig, use_container_width=True)
-                else:
-                    st.info(f"No time-series data available for {selected_product_analysis}.")
+    products = sorted(sales_data['Product'].unique().tolist()) if 'Product' in sales_data.columns else []
+    _render_visualizations(version, products, sales_data, pushdown)
+    timer.mark("chart")
     
-    # Add a new tab for customer analysis if customer data is available
-    if 'Customer' in sales_data.columns:
+    # Customer analysis reads the customer dimension kept up to date at save time
+    if 'Customer Name' in sales_data.columns:
         customer_tab = st.expander("Customer Analysis", expanded=False)
         with customer_tab:
             st.markdown("### Customer Analysis")
             
-            # Top customers by sales
-            top_customers = sales_data.groupby('Customer')['Total'].sum().reset_index()
-            top_customers = top_customers.sort_values('Total', ascending=False).head(10)
-            
-            if not top_customers.empty:
+            if not load_customers():
+                st.info("No customer history yet. Saved bills are added automatically; "
+                        "rebuild it to include the bills loaded here.")
+                if st.button("Rebuild Customer History", key="rebuild_customers"):
+                    rebuild_customers(all_sales_data)
+                    st.rerun()
+            else:
+                # Top customers by sales
+                top_by_sales = pd.DataFrame(top_customers(10, by="monetary"))
                 fig = px.bar(
-                    top_customers,
-                    x='Customer',
-                    y='Total',
+                    top_by_sales,
+                    x='name',
+                    y='monetary',
                     title='Top 10 Customers by Sales',
-                    labels={'Total': 'Sales Amount (₹)', 'Customer': 'Customer Name'},
-                    color='Total',
+                    labels={'monetary': 'Sales Amount (₹)', 'name': 'Customer Name'},
+                    color='monetary',
                     color_continuous_scale='Viridis'
                 )
                 fig.update_layout(xaxis_tickangle=-45)
                 st.plotly_chart(fig, use_container_width=True)
-            
-            # Customer purchase frequency
-            if 'Bill Number' in sales_data.columns:
-                customer_frequency = sales_data.groupby('Customer')['Bill Number'].nunique().reset_index()
-                customer_frequency.columns = ['Customer', 'Purchase Frequency']
-                customer_frequency = customer_frequency.sort_values('Purchase Frequency', ascending=False).head(10)
                 
-                if not customer_frequency.empty:
-                    fig = px.bar(
-                        customer_frequency,
-                        x='Customer',
-                        y='Purchase Frequency',
-                        title='Top 10 Customers by Purchase Frequency',
-                        labels={'Purchase Frequency': 'Number of Purchases', 'Customer': 'Customer Name'},
-                        color='Purchase Frequency',
-                        color_continuous_scale='Viridis'
-                    )
-                    fig.update_layout(xaxis_tickangle=-45)
-                    st.plotly_chart(fig, use_container_width=True)
+                # Customer purchase frequency
+                top_by_frequency = pd.DataFrame(top_customers(10, by="frequency"))
+                fig = px.bar(
+                    top_by_frequency,
+                    x='name',
+                    y='frequency',
+                    title='Top 10 Customers by Purchase Frequency',
+                    labels={'frequency': 'Number of Purchases', 'name': 'Customer Name'},
+                    color='frequency',
+                    color_continuous_scale='Viridis'
+                )
+                fig.update_layout(xaxis_tickangle=-45)
+                st.plotly_chart(fig, use_container_width=True)
+                
+                # Recency, frequency and monetary value per customer
+                st.markdown("### Customer RFM")
+                rfm = rfm_table().sort_values('Monetary', ascending=False)
+                st.dataframe(rfm, use_container_width=True, hide_index=True)
+        timer.mark("chart")
     
     # Add a new tab for inventory analysis
+    basket_tab = st.expander("Basket Analysis", expanded=False)
+    with basket_tab:
+        st.markdown("### Frequently Bought Together")
+        # Expanders run their contents even when closed; the model is only read once asked for
+        if st.checkbox("Show basket analysis", key="show_basket"):
+            # Incremental: only bills added to the ledger since the last update are read
+            basket = update_basket()
+            if not basket.n_bills:
+                st.info("No bills in the ledger yet. Export bills to Excel to build the basket model.")
+            else:
+                st.caption(f"Based on {basket.n_bills} bills in the ledger")
+                basket_product = st.selectbox("Product", sorted(basket.skus), key="basket_product")
+                st.dataframe(basket.bought_with(basket_product), use_container_width=True, hide_index=True)
+
+                st.markdown("#### Product Pairs by Lift")
+                min_support = st.slider("Minimum Support (% of bills)", min_value=0.1, max_value=10.0, value=1.0,
+                                        step=0.1, key="basket_min_support") / 100
+                st.dataframe(basket.pairs(min_support=min_support).head(50), use_container_width=True, hide_index=True)
+                if st.button("Find Frequent Itemsets", key="basket_itemsets"):
+                    itemsets = basket.frequent_itemsets(min_support)
+                    itemsets = itemsets[itemsets['Size'] > 1].assign(Itemset=lambda df: df['Itemset'].map(" + ".join))
+                    st.dataframe(itemsets.head(100), use_container_width=True, hide_index=True)
+    timer.mark("chart")
+    
     inventory_tab = st.expander("Inventory Analysis", expanded=False)
     with inventory_tab:
         st.markdown("### Inventory Analysis")
-        
+
+        # Live stock position from the stock ledger, independent of the date filters
+        stock = get_stock_ledger()
+        st.markdown("#### Stock on Hand")
+        alerts = stock.reorder_alerts()
+        if alerts:
+            st.warning(f"{len(alerts)} products at or below their reorder level: "
+                       + ", ".join(f"{sku} ({on_hand}/{level})" for sku, on_hand, level in alerts))
+        st.dataframe(pd.DataFrame(stock.stock_table()), use_container_width=True)
+
+        stock_col1, stock_col2 = st.columns(2)
+        with stock_col1:
+            with st.form("receive_stock_form"):
+                receive_sku = st.selectbox("Product", sorted(stock.on_hand_by_sku), key="receive_sku")
+                receive_qty = st.number_input("Units Received", min_value=1, value=1, step=1, key="receive_qty")
+                if st.form_submit_button("Receive Stock"):
+                    stock.receive(receive_sku, receive_qty, reference="manual")
+                    st.success(f"Received {receive_qty} x {receive_sku}")
+        with stock_col2:
+            with st.form("reorder_level_form"):
+                level_sku = st.selectbox("Product", sorted(stock.on_hand_by_sku), key="level_sku")
+                level_value = st.number_input("Reorder Level", min_value=0, value=stock.reorder_level(level_sku),
+                                              step=1, key="level_value")
+                if st.form_submit_button("Set Reorder Level"):
+                    stock.set_reorder_level(level_sku, level_value)
+                    st.success(f"Reorder level for {level_sku} set to {level_value}")
+
+        # Products are only flagged for reordering once counted, received or given a level
+        with st.form("stock_count_form"):
+            count_file = st.file_uploader("Stock Count CSV (Product, On Hand)", type=["csv"], key="stock_count_file")
+            if st.form_submit_button("Import Stock Count") and count_file is not None:
+                try:
+                    counts = read_counts_from(io.TextIOWrapper(count_file, encoding="utf-8-sig"))
+                except (KeyError, ValueError) as e:
+                    st.error(f"Error reading stock count: {e}")
+                else:
+                    counted = stock.import_counts(counts, reference=count_file.name)
+                    st.success(f"Counted {counted} products")
+
+        # Versioned prices: a change applies from its effective date, earlier bills keep their price
+        catalog = get_price_catalog()
+        st.markdown("#### Price Catalog")
+        with st.form("price_change_form"):
+            price_col1, price_col2, price_col3 = st.columns(3)
+            with price_col1:
+                price_sku = st.selectbox("Product", sorted(catalog.history), key="price_sku")
+            with price_col2:
+                new_price = st.number_input("New Price (₹)", min_value=0.0, step=1.0, key="new_price")
+            with price_col3:
+                effective_date = st.date_input("Effective From", value=datetime.now().date(), key="price_effective")
+            if st.form_submit_button("Record Price Change"):
+                effective_from = datetime.combine(effective_date, datetime.min.time())
+                if effective_date == datetime.now().date():
+                    effective_from = datetime.now()
+                catalog.set_price(price_sku, new_price, effective_from)
+                st.success(f"{price_sku} is ₹{new_price:.2f} from {effective_from:%Y-%m-%d %H:%M}")
+        history = catalog.history_frame()
+        changed = history['Product'].duplicated(keep=False)
+        if changed.any():
+            st.dataframe(history[changed].sort_values(['Product', 'Effective From']), use_container_width=True)
+
+        # Forecast every SKU at once from the full history (not the filtered view)
+        st.markdown("#### Demand Forecast")
+        if st.checkbox("Show demand forecast", key="show_forecast"):
+            forecast_col1, forecast_col2 = st.columns(2)
+            with forecast_col1:
+                horizon = st.slider("Forecast Days", min_value=7, max_value=60, value=14, key="forecast_horizon")
+            with forecast_col2:
+                lead_time = st.number_input("Supplier Lead Time (days)", min_value=1, max_value=60, value=7,
+                                            key="forecast_lead_time")
+            plan = reorder_plan(all_sales_data, stock.on_hand_by_sku, horizon=horizon, lead_time_days=lead_time,
+                                version=version)
+            to_order = plan[plan['Reorder Qty'] > 0]
+            if not to_order.empty:
+                st.info(f"{len(to_order)} products need reordering to cover the next {horizon} days "
+                        f"plus {lead_time} days lead time.")
+            st.dataframe(plan, use_container_width=True, hide_index=True)
+
         if 'Product' in sales_data.columns and 'Quantity' in sales_data.columns:
             # Calculate total quantity sold per product
             product_quantity = sales_data.groupby('Product')['Quantity'].sum().reset_index()
@@ -500,7 +825,18 @@ def visualize_sales_data(excel_files=None):
             else:
                 inventory_table = product_quantity.sort_values('Quantity', ascending=False)
                 st.dataframe(inventory_table, use_container_width=True)
+    timer.mark("chart")
     
+    _render_reports(sales_data)
+    timer.mark("report")
+    
+    # Add a footer with timestamp
+    st.markdown("---")
+    st.markdown(f"<div style='text-align: center; color: gray; font-size: 0.8em;'>Report generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>", unsafe_allow_html=True)
+
+
+def _render_reports(sales_data):
+    """Render the report export panel over the loaded line items."""
     # Add export options for reports
     report_tab = st.expander("Generate Reports", expanded=False)
     with report_tab:
@@ -508,10 +844,14 @@ def visualize_sales_data(excel_files=None):
         
         report_type = st.selectbox(
             "Select Report Type",
-            ["Sales Summary", "Product Performance", "Category Analysis", "Time Series Analysis"],
+            ["Sales Summary", "Product Performance", "Category Analysis", "Time Series Analysis", "GST Summary", "Custom Query"],
             key="report_type"
         )
         
+        if report_type == "Custom Query":
+            _render_custom_query()
+            return
+        
         # Create a buffer for the report
         report_buffer = io.BytesIO()
         
@@ -563,6 +903,17 @@ def visualize_sales_data(excel_files=None):
                     product_metrics = product_metrics.sort_values('Total Sales', ascending=False)
                     product_metrics.to_excel(writer, sheet_name='Product Metrics', index=False)
         
+                # Charged price against the catalog price in force on each sale date
+                if 'Price' in sales_data.columns:
+                    realized = get_price_catalog().as_of_join(sales_data[['Date', 'Product', 'Quantity', 'Price']])
+                    realized['List Value'] = realized['List Price'] * realized['Quantity']
+                    realized['Charged Value'] = realized['Price'] * realized['Quantity']
+                    price_realization = realized.groupby('Product')[['List Value', 'Charged Value']].sum().reset_index()
+                    price_realization['Realization %'] = (
+                        price_realization['Charged Value'] / price_realization['List Value'] * 100
+                    ).round(2)
+                    price_realization.to_excel(writer, sheet_name='Price Realization', index=False)
+        
         elif report_type == "Category Analysis":
             with pd.ExcelWriter(report_buffer, engine='xlsxwriter') as writer:
                 if 'Category' in sales_data.columns:
@@ -597,6 +948,13 @@ def visualize_sales_data(excel_files=None):
                 monthly_sales = sales_data.groupby(['Year', 'MonthName'])['Total'].sum().reset_index()
                 monthly_sales.to_excel(writer, sheet_name='Monthly Sales', index=False)
         
+        elif report_type == "GST Summary":
+            with pd.ExcelWriter(report_buffer, engine='xlsxwriter') as writer:
+                # Tax from the slab table in force on each sale date, per HSN code and rate
+                gst = get_gst_engine()
+                gst.tax_summary(sales_data, by_day=False).to_excel(writer, sheet_name='HSN Summary', index=False)
+                gst.tax_summary(sales_data).to_excel(writer, sheet_name='Daily Tax', index=False)
+        
         # Download button for the report
         st.download_button(
             label=f"Download {report_type} Report",
@@ -604,7 +962,188 @@ def visualize_sales_data(excel_files=None):
             file_name=f"{report_type.lower().replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
             mime="application/vnd.ms-excel"
         )
+
+
+def _render_ledger_analytics(timer):
+    """Render the charts and reports from bounded-memory aggregates of the ledger."""
+    st.markdown('<div class="section-header">Sales Data Visualization</div>', unsafe_allow_html=True)
+    
+    # Only line items appended since the last run are read
+    try:
+        aggregates = get_ledger_aggregates()
+    except MemoryError as e:
+        st.error(str(e))
+        return
+    timer.mark("load")
+    if aggregates.is_empty():
+        st.warning("No bills in the ledger yet. Export bills to Excel to analyze them.")
+        return
+    
+    # Same filters and session keys as the file-based view
+    min_date, max_date = aggregates.date_range()
+    for key, default in (('start_date', min_date), ('end_date', max_date),
+                         ('selected_category', 'All'), ('selected_product', 'All')):
+        if key not in st.session_state:
+            st.session_state[key] = default
+    with st.expander("Filter Options", expanded=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            date_range = st.date_input(
+                "Select Date Range",
+                value=(st.session_state.start_date, st.session_state.end_date),
+                min_value=min_date,
+                max_value=max_date,
+                key="date_range_filter"
+            )
+            if len(date_range) == 2:
+                st.session_state.start_date, st.session_state.end_date = date_range
+        with col2:
+            categories = ['All'] + aggregates.categories()
+            if st.session_state.selected_category not in categories:
+                st.session_state.selected_category = 'All'
+            st.session_state.selected_category = st.selectbox(
+                "Select Category",
+                categories,
+                index=categories.index(st.session_state.selected_category),
+                key="category_filter"
+            )
+            
+            products = ['All'] + aggregates.products(st.session_state.selected_category)
+            if st.session_state.selected_product not in products:
+                st.session_state.selected_product = 'All'
+            st.session_state.selected_product = st.selectbox(
+                "Select Product",
+                products,
+                index=products.index(st.session_state.selected_product),
+                key="product_filter"
+            )
+    
+    if st.button("Reset Filters"):
+        st.session_state.selected_category = 'All'
+        st.session_state.selected_product = 'All'
+        st.session_state.start_date = min_date
+        st.session_state.end_date = max_date
+        st.rerun()
+    timer.mark("filter")
+    
+    filters = _pushdown_filters()
+    summary = aggregates.sales_summary(**filters)
+    if not summary['bills']:
+        st.warning("No data available for the selected filters.")
+        return
+    
+    st.subheader("Sales Summary")
+    if filters['product'] == 'All':
+        st.caption("Bill percentiles are approximate (from per-day t-digests).")
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    with col1:
+        st.metric("Total Sales", f"₹{summary['total']:.2f}")
+    with col2:
+        st.metric("Total Items Sold", f"{summary['quantity']}")
+    with col3:
+        st.metric("Average Sale Value", f"₹{summary['average']:.2f}")
+    with col4:
+        st.metric("Number of Transactions", f"{summary['bills']}")
+    with col5:
+        st.metric("Median Bill", f"₹{summary['median_bill']:.2f}")
+    with col6:
+        st.metric("90th Percentile Bill", f"₹{summary['p90_bill']:.2f}")
+    timer.mark("aggregate")
+    
+    # Charts are cached against the last line item folded in
+    by_product = aggregates.sales_by_category_product(**filters)
+    _render_visualizations(("ledger", aggregates.last_id), sorted(by_product['Product'].unique().tolist()),
+                           source=aggregates)
+    timer.mark("chart")
+    
+    report_tab = st.expander("Generate Reports", expanded=False)
+    with report_tab:
+        st.markdown("### Export Reports")
+        st.caption("Line item reports from the ledger aggregates; GST and price realization read only "
+                   "the columns they need of the filtered ledger rows.")
+        
+        report_type = st.selectbox(
+            "Select Report Type",
+            ["Sales Summary", "Product Performance", "Category Analysis", "Time Series Analysis", "GST Summary", "Custom Query"],
+            key="report_type"
+        )
+        
+        if report_type == "Custom Query":
+            _render_custom_query()
+        else:
+            report_buffer = io.BytesIO()
+            with pd.ExcelWriter(report_buffer, engine='xlsxwriter') as writer:
+                for sheet_name, sheet in _ledger_report(aggregates, report_type, summary, by_product, filters):
+                    sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+            
+            st.download_button(
+                label=f"Download {report_type} Report",
+                data=report_buffer.getvalue(),
+                file_name=f"{report_type.lower().replace(' ', '_')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                mime="application/vnd.ms-excel"
+            )
+    timer.mark("report")
     
-    # Add a footer with timestamp
     st.markdown("---")
-    st.markdown(f"<div style='text-align: center; color: gray; font-size: 0.8em;'>Report generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>", unsafe_allow_html=True)
\ No newline at end of file
+    st.markdown(f"<div style='text-align: center; color: gray; font-size: 0.8em;'>Report generated on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>", unsafe_allow_html=True)
+
+
+def _ledger_report(aggregates, report_type, summary, by_product, filters):
+    """Return the (sheet name, DataFrame) pairs of a report built from the ledger aggregates."""
+    if report_type == "Sales Summary":
+        summary_data = pd.DataFrame({
+            'Metric': ['Total Sales', 'Total Items Sold', 'Average Sale Value', 'Number of Transactions'],
+            'Value': [
+                f"₹{summary['total']:.2f}",
+                f"{summary['quantity']}",
+                f"₹{summary['average']:.2f}",
+                f"{summary['bills']}"
+            ]
+        })
+        daily_sales = aggregates.sales_over_time("Day", **filters)[['Date', 'Total']]
+        category_sales = aggregates.sales_by('Category', **filters)[['Category', 'Total']]
+        return [('Summary', summary_data), ('Daily Sales', daily_sales), ('Category Sales', category_sales)]
+    
+    if report_type == "Product Performance":
+        product_metrics = by_product.groupby('Product')[['Total', 'Quantity', 'Lines']].sum().reset_index()
+        # Line items per product stand in for the bills a product appears on
+        product_metrics.columns = ['Product', 'Total Sales', 'Quantity Sold', 'Line Items']
+        product_metrics['Average Price'] = product_metrics['Total Sales'] / product_metrics['Quantity Sold']
+        # Charged price against the catalog price in force on each sale date
+        realized = get_price_catalog().as_of_join(line_items(['Date', 'Product', 'Quantity', 'Price'], **filters))
+        realized['List Value'] = realized['List Price'] * realized['Quantity']
+        realized['Charged Value'] = realized['Price'] * realized['Quantity']
+        price_realization = realized.groupby('Product')[['List Value', 'Charged Value']].sum().reset_index()
+        price_realization['Realization %'] = (
+            price_realization['Charged Value'] / price_realization['List Value'] * 100
+        ).round(2)
+        return [
+            ('Product Sales', product_metrics[['Product', 'Total Sales']].rename(columns={'Total Sales': 'Total'})
+             .sort_values('Total', ascending=False)),
+            ('Product Quantities', product_metrics[['Product', 'Quantity Sold']].rename(columns={'Quantity Sold': 'Quantity'})
+             .sort_values('Quantity', ascending=False)),
+            ('Product Metrics', product_metrics.sort_values('Total Sales', ascending=False)),
+            ('Price Realization', price_realization)
+        ]
+    
+    if report_type == "Category Analysis":
+        category_sales = aggregates.sales_by('Category', **filters)
+        category_products = by_product[['Category', 'Product', 'Total']].sort_values(['Category', 'Total'], ascending=[True, False])
+        return [
+            ('Category Sales', category_sales[['Category', 'Total']].sort_values('Total', ascending=False)),
+            ('Category Quantities', category_sales[['Category', 'Quantity']].sort_values('Quantity', ascending=False)),
+            ('Products by Category', category_products)
+        ]
+    
+    if report_type == "GST Summary":
+        # Tax from the slab table in force on each sale date, per HSN code and rate
+        taxable = line_items(['Date', 'Product', 'Total'], **filters)
+        gst = get_gst_engine()
+        return [('HSN Summary', gst.tax_summary(taxable, by_day=False)), ('Daily Tax', gst.tax_summary(taxable))]
+    
+    # Time Series Analysis
+    return [
+        ('Daily Sales', aggregates.sales_over_time("Day", **filters)[['Date', 'Total']]),
+        ('Weekly Sales', aggregates.sales_over_time("Week", **filters)[['Year', 'Week', 'Total', 'Period']]),
+        ('Monthly Sales', aggregates.monthly_sales(**filters))
+    ]
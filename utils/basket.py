@@ -0,0 +1,309 @@
+"""
+Market-basket analysis over the ledger's line items.
+
+Bills are turned into a sparse bills x SKU incidence matrix X one chunk at a
+time, and X.T @ X is added to a running SKU x SKU co-occurrence matrix whose
+diagonal holds the number of bills containing each SKU. Memory is bounded by
+the chunk size and the number of SKUs, not the number of bills.
+
+The model remembers the ledger rowid it has read up to, so updates only read
+bills appended since:
+    python -m utils.basket --min-support 0.01
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from .ledger import default_ledger_path
+
+# Line items read from the ledger per chunk
+CHUNK_ROWS = 200000
+
+_lock = threading.Lock()
+
+# basket_path -> (file version, model), so a rerun only reloads a model another process saved
+_models = {}
+
+
+def default_basket_path():
+    """Return the default model file, data/basket.npz."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'basket.npz')
+
+
+class BasketModel:
+    """SKU co-occurrence counts over every bill read so far."""
+
+    def __init__(self, skus=None, cooccurrence=None, n_bills=0, last_id=0):
+        self.skus = list(skus or [])
+        self.index = {sku: i for i, sku in enumerate(self.skus)}
+        size = len(self.skus)
+        self.cooccurrence = cooccurrence if cooccurrence is not None else sparse.csr_matrix((size, size), dtype=np.int64)
+        self.n_bills = n_bills
+        self.last_id = last_id
+
+    def _codes(self, products):
+        """Map product names to column codes, adding columns for new SKUs."""
+        new = [sku for sku in pd.unique(products) if sku not in self.index]
+        if new:
+            for sku in new:
+                self.index[sku] = len(self.skus)
+                self.skus.append(sku)
+            self.cooccurrence.resize((len(self.skus), len(self.skus)))
+        return np.fromiter((self.index[sku] for sku in products), dtype=np.int64, count=len(products))
+
+    def incidence(self, bill_numbers, products):
+        """Return the 0/1 bills x SKU matrix for line items given as parallel arrays."""
+        bill_codes, bills = pd.factorize(np.asarray(bill_numbers))
+        sku_codes = self._codes(np.asarray(products))
+        ones = np.ones(len(bill_codes), dtype=np.int64)
+        matrix = sparse.csr_matrix((ones, (bill_codes, sku_codes)), shape=(len(bills), len(self.skus)))
+        # A SKU on two lines of one bill still counts once for that bill
+        matrix.data[:] = 1
+        return matrix
+
+    def add_line_items(self, bill_numbers, products):
+        """Fold whole bills (all of their line items) into the counts."""
+        if len(bill_numbers) == 0:
+            return
+        matrix = self.incidence(bill_numbers, products)
+        self.cooccurrence = (self.cooccurrence + (matrix.T @ matrix).tocsr()).tocsr()
+        self.n_bills += matrix.shape[0]
+
+    def update_from_ledger(self, ledger_path=None, chunk_rows=CHUNK_ROWS):
+        """
+        Read the bills appended to the ledger since the last update.
+
+        Returns:
+            int: number of line items read
+        """
+        ledger_path = ledger_path or default_ledger_path()
+        read = 0
+        for last_id, bill_numbers, products in _ledger_chunks(ledger_path, self.last_id, None, chunk_rows):
+            self.add_line_items(bill_numbers, products)
+            self.last_id = last_id
+            read += len(bill_numbers)
+        return read
+
+    def item_counts(self):
+        """Return the number of bills containing each SKU, in self.skus order."""
+        return self.cooccurrence.diagonal()
+
+    def pairs(self, min_support=0.0, min_bills=1):
+        """
+        Return co-purchase statistics for every pair of SKUs bought together.
+
+        Returns:
+            pd.DataFrame: Product A, Product B, Bills, Support, Confidence A->B,
+            Confidence B->A and Lift, highest lift first
+        """
+        columns = ['Product A', 'Product B', 'Bills', 'Support', 'Confidence A->B', 'Confidence B->A', 'Lift']
+        if not self.n_bills:
+            return pd.DataFrame(columns=columns)
+        upper = sparse.triu(self.cooccurrence, k=1).tocoo()
+        keep = (upper.data >= max(min_bills, min_support * self.n_bills)) & (upper.data > 0)
+        a, b, together = upper.row[keep], upper.col[keep], upper.data[keep].astype(float)
+        counts = self.item_counts().astype(float)
+        skus = np.array(self.skus, dtype=object)
+        result = pd.DataFrame({
+            'Product A': skus[a],
+            'Product B': skus[b],
+            'Bills': together.astype(int),
+            'Support': together / self.n_bills,
+            'Confidence A->B': together / counts[a],
+            'Confidence B->A': together / counts[b],
+            'Lift': together * self.n_bills / (counts[a] * counts[b])
+        }, columns=columns)
+        return result.sort_values(['Lift', 'Bills'], ascending=False).reset_index(drop=True)
+
+    def bought_with(self, sku, n=10):
+        """Return the n SKUs most often on the same bill as sku, with confidence and lift."""
+        columns = ['Product', 'Bills', 'Confidence', 'Lift']
+        if sku not in self.index:
+            return pd.DataFrame(columns=columns)
+        i = self.index[sku]
+        row = self.cooccurrence.getrow(i).tocoo()
+        counts = self.item_counts().astype(float)
+        others = row.col != i
+        cols, together = row.col[others], row.data[others].astype(float)
+        result = pd.DataFrame({
+            'Product': np.array(self.skus, dtype=object)[cols],
+            'Bills': together.astype(int),
+            'Confidence': together / counts[i],
+            'Lift': together * self.n_bills / (counts[i] * counts[cols])
+        }, columns=columns)
+        return result.sort_values(['Bills', 'Lift'], ascending=False).head(n).reset_index(drop=True)
+
+    def frequent_itemsets(self, min_support=0.01, max_size=3, ledger_path=None, chunk_rows=CHUNK_ROWS):
+        """
+        Return itemsets bought together on at least min_support of bills.
+
+        Singles and pairs come from the stored counts. Larger itemsets are counted
+        Apriori-style: only sets whose every subset is frequent are candidates, and
+        they are counted in one chunked pass over the ledger per size.
+
+        Returns:
+            pd.DataFrame: Itemset (tuple of SKUs), Size, Bills and Support, largest support first
+        """
+        if not self.n_bills:
+            return pd.DataFrame(columns=['Itemset', 'Size', 'Bills', 'Support'])
+        threshold = min_support * self.n_bills
+        counts = self.item_counts()
+        found = {(i,): int(c) for i, c in enumerate(counts) if c >= threshold and c > 0}
+        if max_size >= 2:
+            upper = sparse.triu(self.cooccurrence, k=1).tocoo()
+            for i, j, c in zip(upper.row, upper.col, upper.data):
+                if c >= threshold and c > 0:
+                    found[(int(i), int(j))] = int(c)
+
+        frequent = [key for key in found if len(key) == 2]
+        for size in range(3, max_size + 1):
+            candidates = _apriori_candidates(frequent, size)
+            if not candidates:
+                break
+            totals = self._count_itemsets(candidates, ledger_path, chunk_rows)
+            frequent = [itemset for itemset, c in totals.items() if c >= threshold and c > 0]
+            found.update((itemset, totals[itemset]) for itemset in frequent)
+
+        rows = [
+            (tuple(self.skus[i] for i in itemset), len(itemset), c, c / self.n_bills)
+            for itemset, c in found.items()
+        ]
+        result = pd.DataFrame(rows, columns=['Itemset', 'Size', 'Bills', 'Support'])
+        return result.sort_values(['Support', 'Size'], ascending=[False, False]).reset_index(drop=True)
+
+    def _count_itemsets(self, candidates, ledger_path, chunk_rows):
+        """Count the bills containing each candidate itemset with one chunked pass over the ledger."""
+        totals = dict.fromkeys(candidates, 0)
+        scan = BasketModel(self.skus)
+        ledger_path = ledger_path or default_ledger_path()
+        # Only the bills already in the counts, so the itemset supports match the pair supports
+        for _, bill_numbers, products in _ledger_chunks(ledger_path, 0, self.last_id, chunk_rows):
+            matrix = scan.incidence(bill_numbers, products).tocsc()
+            for itemset in candidates:
+                # Bills containing every SKU of the set: elementwise product of the columns
+                present = matrix[:, itemset[0]]
+                for sku in itemset[1:]:
+                    present = present.multiply(matrix[:, sku])
+                totals[itemset] += int(present.sum())
+        return totals
+
+    def save(self, basket_path=None):
+        """Write the model to basket_path atomically."""
+        basket_path = basket_path or default_basket_path()
+        os.makedirs(os.path.dirname(os.path.abspath(basket_path)), exist_ok=True)
+        matrix = self.cooccurrence.tocsr()
+        tmp_path = f"{basket_path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+            skus=np.array(json.dumps(self.skus)),
+            n_bills=self.n_bills, last_id=self.last_id
+        )
+        os.replace(tmp_path, basket_path)
+
+
+def _ledger_chunks(ledger_path, after_id, until_id, chunk_rows):
+    """
+    Yield (last id, bill numbers, products) for the ledger rows after after_id, chunk by chunk.
+
+    A bill's rows are written in one transaction, so only the last bill of a full
+    chunk can be cut off; it is held back and read whole with the next chunk.
+    """
+    if not os.path.exists(ledger_path):
+        return
+    conn = sqlite3.connect(f"file:{os.path.abspath(ledger_path)}?mode=ro", uri=True, timeout=30)
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT id, bill_number, product FROM line_items WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                (after_id, until_id if until_id is not None else 2 ** 63 - 1, chunk_rows)
+            ).fetchall()
+            if not rows:
+                return
+            ids, bill_numbers, products = (np.array(column, dtype=object) for column in zip(*rows))
+            if len(rows) == chunk_rows:
+                complete = bill_numbers != bill_numbers[-1]
+                if complete.any():
+                    ids, bill_numbers, products = ids[complete], bill_numbers[complete], products[complete]
+            after_id = int(ids[-1])
+            yield after_id, bill_numbers, products
+    finally:
+        conn.close()
+
+
+def _apriori_candidates(frequent, size):
+    """Return the size-item sets whose every (size - 1)-item subset is in frequent."""
+    frequent = set(frequent)
+    items = sorted({i for itemset in frequent for i in itemset})
+    candidates = []
+    for itemset in frequent:
+        for i in items:
+            if i <= itemset[-1]:
+                continue
+            candidate = itemset + (i,)
+            if all(subset in frequent for subset in combinations(candidate, size - 1)):
+                candidates.append(candidate)
+    return candidates
+
+
+def load_basket(basket_path=None):
+    """Load the saved model, or an empty one if none has been built yet."""
+    basket_path = basket_path or default_basket_path()
+    if not os.path.exists(basket_path):
+        return BasketModel()
+    with np.load(basket_path) as saved:
+        skus = json.loads(str(saved["skus"]))
+        size = len(skus)
+        matrix = sparse.csr_matrix((saved["data"], saved["indices"], saved["indptr"]), shape=(size, size))
+        return BasketModel(skus, matrix, int(saved["n_bills"]), int(saved["last_id"]))
+
+
+def update_basket(ledger_path=None, basket_path=None):
+    """Fold bills appended to the ledger into the saved model and return it."""
+    basket_path = basket_path or default_basket_path()
+    with _lock:
+        version = _file_version(basket_path)
+        cached = _models.get(basket_path)
+        model = cached[1] if cached and cached[0] == version else load_basket(basket_path)
+        if model.update_from_ledger(ledger_path):
+            model.save(basket_path)
+            version = _file_version(basket_path)
+        _models[basket_path] = (version, model)
+        return model
+
+
+def _file_version(path):
+    # Every save replaces the file, so another process's save changes the inode as well as the mtime
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update the basket model from the ledger and print frequent itemsets.")
+    parser.add_argument("--ledger", default=None, help="Ledger database (default: data/ledger.db)")
+    parser.add_argument("--basket", default=None, help="Model file (default: data/basket.npz)")
+    parser.add_argument("--min-support", type=float, default=0.01, help="Minimum share of bills for an itemset")
+    parser.add_argument("--max-size", type=int, default=3, help="Largest itemset size")
+    parser.add_argument("--top", type=int, default=20, help="Number of pairs and itemsets to print")
+    args = parser.parse_args(argv)
+
+    model = update_basket(args.ledger, args.basket)
+    print(f"{model.n_bills} bills, {len(model.skus)} products")
+    print(model.pairs(min_support=args.min_support).head(args.top).to_string(index=False))
+    itemsets = model.frequent_itemsets(args.min_support, args.max_size, args.ledger)
+    print(itemsets[itemsets['Size'] > 1].head(args.top).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,232 @@
+"""
+Headless batch billing.
+
+Prices, renders and stores a file of carts the same way the Streamlit buttons do:
+    python -m utils.batch_billing carts.jsonl --workers 8
+
+JSONL input has one cart per line:
+    {"customer": "Asha", "phone": "98...", "items": {"Toor Dal": 2, "Red Bull": 1},
+     "bill_number": "BILL12345", "date": "2025-03-01 10:15:00"}
+CSV input has one line item per row with columns customer, phone, sku, qty and
+optional cart_id, bill_number, date; consecutive rows of the same cart form one bill.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .bill_operations import (
+    build_bill_rows, calculate_total, export_bill_to_excel, generate_bill, is_valid_bill_number, save_bill, unused_bill_number
+)
+from .bill_storage import save_bill_to_master
+from .customers import update_customers
+from .data import product_categories
+from .inventory import get_stock_ledger, sales_from_rows
+from .ledger import append_bills
+from .price_catalog import get_price_catalog
+from .promotions import get_promotion_engine
+from .sync_queue import queue_rows
+from .sketches import update_sketches
+
+# Number of bills collected before each ledger append
+DEFAULT_BATCH_SIZE = 500
+
+
+def read_carts(file_path):
+    """Yield carts as dicts with customer, phone, items and optional bill_number/date."""
+    if file_path.lower().endswith(".jsonl"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    with open(file_path, "r", encoding="utf-8", newline="") as f:
+        cart = None
+        cart_key = None
+        for row in csv.DictReader(f):
+            key = row.get("cart_id") or row.get("bill_number") or (row["customer"], row["phone"])
+            if cart is None or key != cart_key:
+                if cart is not None:
+                    yield cart
+                cart = {
+                    "customer": row["customer"],
+                    "phone": row["phone"],
+                    "items": {},
+                    "bill_number": row.get("bill_number") or None,
+                    "date": row.get("date") or None
+                }
+                cart_key = key
+            cart["items"][row["sku"]] = cart["items"].get(row["sku"], 0) + int(row["qty"])
+        if cart is not None:
+            yield cart
+
+
+def assign_bill_numbers(carts, bills_dir="bills"):
+    """
+    Give every cart a bill number that is unique in this run and in bills_dir.
+
+    Raises:
+        RuntimeError: once every bill number is taken
+    """
+    used = {os.path.splitext(os.path.basename(path))[0] for path in glob.glob(f"{bills_dir}/BILL*")}
+    for cart in carts:
+        bill_number = cart.get("bill_number")
+        # A missing, taken or malformed number is replaced by a free one
+        if not is_valid_bill_number(bill_number) or bill_number in used:
+            bill_number = unused_bill_number(used)
+        used.add(bill_number)
+        cart["bill_number"] = bill_number
+        yield cart
+
+
+def split_items(items):
+    """Split a flat {sku: qty} cart into the cosmetic, grocery and drink dicts."""
+    sections = {"Cosmetics": {}, "Groceries": {}, "Drinks": {}}
+    for sku, qty in items.items():
+        if sku not in product_categories:
+            raise KeyError(f"Unknown SKU: {sku}")
+        sections[product_categories[sku]][sku] = int(qty)
+    return sections["Cosmetics"], sections["Groceries"], sections["Drinks"]
+
+
+def bill_cart(cart, bills_dir="bills", export_excel=True):
+    """Price, render and save one cart; runs inside a worker process."""
+    try:
+        cosmetic_items, grocery_items, drink_items = split_items(cart["items"])
+        bill_date = pd.to_datetime(cart["date"]).to_pydatetime() if cart.get("date") else None
+        bill_number = cart["bill_number"]
+        # Price the cart as of its own date, so back-dated carts get the prices of that day
+        prices = get_price_catalog().prices_as_of(bill_date)
+
+        # Promotions too are those in force on the cart's date
+        discounts = get_promotion_engine().evaluate_items(
+            prices, cosmetic_items, grocery_items, drink_items, when=bill_date
+        )
+        totals = calculate_total(cosmetic_items, grocery_items, drink_items, prices, discounts, bill_date)
+        bill_content = generate_bill(
+            cart["customer"], cart["phone"], bill_number,
+            cosmetic_items, grocery_items, drink_items, totals, prices, bill_date
+        )
+        save_bill(bill_content, bill_number, bills_dir)
+        if export_excel:
+            export_bill_to_excel(
+                cart["customer"], cart["phone"], bill_number,
+                cosmetic_items, grocery_items, drink_items, totals, prices, bill_date, bills_dir
+            )
+        rows = build_bill_rows(
+            cart["customer"], cart["phone"], bill_number,
+            cosmetic_items, grocery_items, drink_items, prices, bill_date, totals
+        )
+        return bill_number, rows, None
+    except Exception as e:
+        return cart.get("bill_number"), [], str(e)
+
+
+def _record_rows(rows):
+    """Append one batch of bills to the ledger and the incremental rollups."""
+    append_bills(pd.DataFrame(rows), source="batch")
+    queue_rows(rows)
+    update_customers(rows)
+    get_stock_ledger().record_sales(sales_from_rows(rows))
+    update_sketches(rows)
+
+
+def _bill_cart_worker(args):
+    return bill_cart(*args)
+
+
+def run_batch(carts_path, workers=None, batch_size=DEFAULT_BATCH_SIZE, bills_dir="bills",
+              master_file_path=None, export_excel=True, write_master=True, chunksize=64):
+    """
+    Bill every cart in carts_path across a process pool.
+
+    Bills are rendered and saved by the workers; their ledger rows come back in input
+    order and are appended to the ledger batch_size bills at a time. The Excel master
+    is rewritten whole on every save, so it gets all of the run's rows once, at the end.
+
+    Returns:
+        dict: counts of billed and failed carts, elapsed seconds and bills per second
+    """
+    start = time.perf_counter()
+    carts = assign_bill_numbers(read_carts(carts_path), bills_dir)
+    jobs = ((cart, bills_dir, export_excel) for cart in carts)
+
+    billed = 0
+    errors = []
+    pending_rows = []
+    pending_bills = 0
+    master_frames = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() yields results in input order, so the ledger keeps the cart order
+        for bill_number, rows, error in pool.map(_bill_cart_worker, jobs, chunksize=chunksize):
+            if error:
+                errors.append((bill_number, error))
+                continue
+            billed += 1
+            pending_rows.extend(rows)
+            pending_bills += 1
+            if pending_bills >= batch_size:
+                _record_rows(pending_rows)
+                if write_master:
+                    master_frames.append(pd.DataFrame(pending_rows))
+                pending_rows = []
+                pending_bills = 0
+
+    if pending_rows:
+        _record_rows(pending_rows)
+        if write_master:
+            master_frames.append(pd.DataFrame(pending_rows))
+    if master_frames:
+        save_bill_to_master(pd.concat(master_frames, ignore_index=True), master_file_path)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "billed": billed,
+        "failed": len(errors),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "bills_per_second": round(billed / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bill a CSV/JSONL file of carts without the Streamlit UI.")
+    parser.add_argument("carts", help="Path to a .csv or .jsonl file of carts")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Bills per ledger append")
+    parser.add_argument("--bills-dir", default="bills", help="Directory for the bill .txt/.xlsx files")
+    parser.add_argument("--master", default=None, help="Master ledger path (default: data/master_bills.xlsx)")
+    parser.add_argument("--no-excel", action="store_true", help="Skip the per-bill Excel export")
+    parser.add_argument("--no-master", action="store_true", help="Skip the master Excel ledger")
+    args = parser.parse_args(argv)
+
+    try:
+        result = run_batch(
+            args.carts,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            bills_dir=args.bills_dir,
+            master_file_path=args.master,
+            export_excel=not args.no_excel,
+            write_master=not args.no_master
+        )
+    except RuntimeError as e:
+        # Bill numbers ran out; map() assigns them all before any cart is billed
+        print(f"Error: {e}")
+        return 1
+    for bill_number, error in result["errors"]:
+        print(f"Failed {bill_number}: {error}")
+    print(f"Billed {result['billed']} carts ({result['failed']} failed) in {result['seconds']}s "
+          f"- {result['bills_per_second']} bills/s")
+    return 0 if not result["failed"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
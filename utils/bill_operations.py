@@ -1,5 +1,6 @@
 import os
 import random
+import re
 import datetime
 from datetime import datetime  # Add this specific import
 import streamlit as st
@@ -14,6 +15,10 @@ import threading
 import time
 import subprocess
 
+from .cart import category_footer, compute_totals, discounts_from_totals, offers_section
+from .gst import get_gst_engine, net_line_paise
+from .metrics import timed
+
 # Remove duplicate imports
 # import os
 # import random
@@ -49,44 +54,62 @@ prices = {
     "Coca Cola": 60
 }
 
+# Bill numbers name files in bills/, so anything but BILL and digits is refused
+BILL_NUMBER_PATTERN = re.compile(r"BILL\d+")
+BILL_NUMBER_MIN = 10000
+BILL_NUMBER_MAX = 99999
+
 def generate_bill_number():
     # Generate a random bill number
-    return f"BILL{random.randint(10000, 99999)}"
+    return f"BILL{random.randint(BILL_NUMBER_MIN, BILL_NUMBER_MAX)}"
+
+def is_valid_bill_number(bill_number):
+    """True if bill_number is BILL followed by digits, and so safe to use as a file name."""
+    return isinstance(bill_number, str) and BILL_NUMBER_PATTERN.fullmatch(bill_number) is not None
+
+def unused_bill_number(used, attempts=32):
+    """
+    Return a random bill number not in used.
 
-def calculate_total(cosmetic_items, grocery_items, drink_items, prices):
+    After `attempts` collisions the numbers are scanned in order from a random
+    start, so a crowded range costs one pass rather than an endless loop.
+
+    Raises:
+        RuntimeError: if every number from BILL10000 to BILL99999 is in used
+    """
+    for _ in range(attempts):
+        bill_number = generate_bill_number()
+        if bill_number not in used:
+            return bill_number
+    span = BILL_NUMBER_MAX - BILL_NUMBER_MIN + 1
+    start = random.randrange(span)
+    for offset in range(span):
+        bill_number = f"BILL{BILL_NUMBER_MIN + (start + offset) % span}"
+        if bill_number not in used:
+            return bill_number
+    raise RuntimeError(f"All {span} bill numbers BILL{BILL_NUMBER_MIN}-BILL{BILL_NUMBER_MAX} are in use")
+
+@timed()
+def calculate_total(cosmetic_items, grocery_items, drink_items, prices, discounts=None, bill_date=None):
     # Calculate totals for each category
-    cosmetic_total = sum(prices[item] * qty for item, qty in cosmetic_items.items() if qty > 0)
-    grocery_total = sum(prices[item] * qty for item, qty in grocery_items.items() if qty > 0)
-    drink_total = sum(prices[item] * qty for item, qty in drink_items.items() if qty > 0)
-    
-    # Calculate tax
-    cosmetic_tax = cosmetic_total * 0.12
-    grocery_tax = grocery_total * 0.05
-    drink_tax = drink_total * 0.18
-    
-    # Calculate final totals
-    cosmetic_final = cosmetic_total + cosmetic_tax
-    grocery_final = grocery_total + grocery_tax
-    drink_final = drink_total + drink_tax
-    
-    # Calculate grand total
-    grand_total = cosmetic_final + grocery_final + drink_final
-    
-    return {
-        "cosmetic_total": cosmetic_total,
-        "grocery_total": grocery_total,
-        "drink_total": drink_total,
-        "cosmetic_tax": cosmetic_tax,
-        "grocery_tax": grocery_tax,
-        "drink_tax": drink_tax,
-        "cosmetic_final": cosmetic_final,
-        "grocery_final": grocery_final,
-        "drink_final": drink_final,
-        "grand_total": grand_total
+    subtotals = {
+        "cosmetic": sum(prices[item] * qty for item, qty in cosmetic_items.items() if qty > 0),
+        "grocery": sum(prices[item] * qty for item, qty in grocery_items.items() if qty > 0),
+        "drink": sum(prices[item] * qty for item, qty in drink_items.items() if qty > 0)
     }
-def generate_bill(customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, totals, prices):
-    # Get current time
-    current_time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    
+    # Tax every line at its GST slab on the sale date (net of promotion discounts, if any)
+    lines = [
+        (item, qty, prices[item])
+        for items in (cosmetic_items, grocery_items, drink_items)
+        for item, qty in items.items() if qty > 0
+    ]
+    taxes = get_gst_engine().category_taxes(lines, discounts, bill_date)
+    return compute_totals(subtotals, taxes, discounts)
+@timed()
+def generate_bill(customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, totals, prices, bill_date=None):
+    # Get current time (or the original sale time when back-filling)
+    current_time = (bill_date or datetime.now()).strftime("%d-%m-%Y %H:%M:%S")
     
     # Create bill header
     bill = f"""
@@ -110,8 +133,7 @@ Product                 Quantity         Price         Total
                 price = prices[item]
                 total = price * qty
                 bill += f"{item:<25}{qty:<15}{price:<15}{total}\n"
-        bill += f"Cosmetic Tax: {totals['cosmetic_tax']:.2f}\n"
-        bill += f"Cosmetic Total: {totals['cosmetic_final']:.2f}\n\n"
+        bill += category_footer("cosmetic", "Cosmetic", totals)
     
     # Add grocery items to bill
     if any(qty > 0 for qty in grocery_items.values()):
@@ -121,8 +143,7 @@ Product                 Quantity         Price         Total
                 price = prices[item]
                 total = price * qty
                 bill += f"{item:<25}{qty:<15}{price:<15}{total}\n"
-        bill += f"Grocery Tax: {totals['grocery_tax']:.2f}\n"
-        bill += f"Grocery Total: {totals['grocery_final']:.2f}\n\n"
+        bill += category_footer("grocery", "Grocery", totals)
     
     # Add drink items to bill
     if any(qty > 0 for qty in drink_items.values()):
@@ -132,8 +153,10 @@ Product                 Quantity         Price         Total
                 price = prices[item]
                 total = price * qty
                 bill += f"{item:<25}{qty:<15}{price:<15}{total}\n"
-        bill += f"Drink Tax: {totals['drink_tax']:.2f}\n"
-        bill += f"Drink Total: {totals['drink_final']:.2f}\n\n"
+        bill += category_footer("drink", "Drink", totals)
+    
+    # List the promotions applied, if any
+    bill += offers_section(totals)
     
     # Add grand total
     bill += f"{'=' * 70}\n"
@@ -142,13 +165,14 @@ Product                 Quantity         Price         Total
     bill += f"Thank you for shopping with us!\n"
     
     return bill
-def save_bill(bill_content, bill_number):
+@timed()
+def save_bill(bill_content, bill_number, bills_dir="bills"):
     # Create bills directory if it doesn't exist
-    if not os.path.exists("bills"):
-        os.makedirs("bills")
+    if not os.path.exists(bills_dir):
+        os.makedirs(bills_dir, exist_ok=True)
     
     # Save bill to text file with UTF-8 encoding
-    file_path = f"bills/{bill_number}.txt"
+    file_path = f"{bills_dir}/{bill_number}.txt"
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(bill_content)
     
@@ -178,71 +202,55 @@ def print_bill(bill_content):
         return "Bill sent to printer successfully!"
     except Exception as e:
         return f"Error printing bill: {str(e)}"
-def export_bill_to_excel(customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, totals, prices):
-    """Export bill to Excel file"""
-    # Create bills directory if it doesn't exist
-    os.makedirs("bills", exist_ok=True)
+def build_bill_rows(customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, prices, bill_date=None, totals=None):
+    """
+    Build the line-item rows written to Excel and the master ledger for one bill.
+
+    With the bill's totals, each line's promotion discount (its own offer plus its
+    share of the cart coupon) goes in Discount and Total is net of it, as taxed on
+    the receipt.
+    """
+    # Current date and time (or the original sale time when back-filling)
+    now = bill_date or datetime.now()
     
-    # Current date and time
-    now = datetime.now()
-    date_str = now.strftime("%d-%m-%Y %H:%M:%S")
+    lines = [
+        (category, item, qty, prices.get(item, 0))
+        for category, items in (('Cosmetics', cosmetic_items), ('Groceries', grocery_items), ('Drinks', drink_items))
+        for item, qty in items.items() if qty > 0
+    ]
+    nets = net_line_paise([(item, qty, price) for _, item, qty, price in lines], discounts_from_totals(totals))
     
     # Create a list to store all items
     all_items = []
     
-    # Add cosmetic items
-    for item, qty in cosmetic_items.items():
-        if qty > 0:
-            price = prices.get(item, 0)
-            all_items.append({
-                'Date': now,
-                'Bill Number': bill_number,
-                'Customer Name': customer_name,
-                'Phone': phone_number,
-                'Category': 'Cosmetics',
-                'Product': item,
-                'Quantity': qty,
-                'Price': price,
-                'Total': qty * price
-            })
-    
-    # Add grocery items
-    for item, qty in grocery_items.items():
-        if qty > 0:
-            price = prices.get(item, 0)
-            all_items.append({
-                'Date': now,
-                'Bill Number': bill_number,
-                'Customer Name': customer_name,
-                'Phone': phone_number,
-                'Category': 'Groceries',
-                'Product': item,
-                'Quantity': qty,
-                'Price': price,
-                'Total': qty * price
-            })
-    
-    # Add drink items
-    for item, qty in drink_items.items():
-        if qty > 0:
-            price = prices.get(item, 0)
-            all_items.append({
-                'Date': now,
-                'Bill Number': bill_number,
-                'Customer Name': customer_name,
-                'Phone': phone_number,
-                'Category': 'Drinks',
-                'Product': item,
-                'Quantity': qty,
-                'Price': price,
-                'Total': qty * price
-            })
+    for (category, item, qty, price), (_, gross, net) in zip(lines, nets):
+        all_items.append({
+            'Date': now,
+            'Bill Number': bill_number,
+            'Customer Name': customer_name,
+            'Phone': phone_number,
+            'Category': category,
+            'Product': item,
+            'Quantity': qty,
+            'Price': price,
+            'Discount': (gross - net) / 100,
+            'Total': net / 100
+        })
+    
+    return all_items
+@timed()
+def export_bill_to_excel(customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, totals, prices, bill_date=None, bills_dir="bills"):
+    """Export bill to Excel file"""
+    # Create bills directory if it doesn't exist
+    os.makedirs(bills_dir, exist_ok=True)
     
     # Create DataFrame
-    df = pd.DataFrame(all_items)
+    df = pd.DataFrame(build_bill_rows(
+        customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, prices, bill_date, totals
+    ))
     
     # Save to Excel
-    file_path = f"bills/{bill_number}.xlsx"
+    file_path = f"{bills_dir}/{bill_number}.xlsx"
     df.to_excel(file_path, index=False)
     
     return file_path
@@ -4,6 +4,10 @@ from datetime import datetime
 import openpyxl
 from openpyxl.utils.dataframe import dataframe_to_rows
 
+from .excel_cache import read_excel_cached, write_sidecar
+from .metrics import timed
+
+@timed()
 def save_bill_to_master(bill_data, master_file_path=None):
     """
     Save bill data to a master Excel file.
@@ -26,14 +30,15 @@ def save_bill_to_master(bill_data, master_file_path=None):
     # Check if the master file already exists
     if os.path.exists(master_file_path):
         try:
-            # Read existing data
-            existing_data = pd.read_excel(master_file_path)
+            # Read existing data (from the Feather sidecar when it is current)
+            existing_data = read_excel_cached(master_file_path)
             
             # Append new data
             combined_data = pd.concat([existing_data, bill_data], ignore_index=True)
             
-            # Save the combined data
+            # Save the combined data and refresh the sidecar so the next read skips Excel
             combined_data.to_excel(master_file_path, index=False)
+            write_sidecar(master_file_path, combined_data)
         except Exception as e:
             print(f"Error appending to master file: {e}")
             # If there's an error, create a new file
@@ -0,0 +1,77 @@
+import requests
+
+# Seconds to wait for the billing service before giving up
+REQUEST_TIMEOUT = 10
+
+
+class BillingServiceError(Exception):
+    """The billing service could not be reached or refused a request."""
+
+
+class BillingClient:
+    """
+    Thin client for utils.billing_service.
+
+    The methods take the same arguments as the bill_operations functions they
+    replace, so the Streamlit app can switch between local and service mode.
+    Prices, promotions and totals always come from the service, so the totals
+    arguments are not sent.
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=REQUEST_TIMEOUT, **kwargs)
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            raise BillingServiceError(f"Billing service at {self.base_url} unavailable: {e}") from e
+
+    def _post(self, path, payload):
+        return self._request("POST", path, json=payload)
+
+    def _get(self, path, params=None):
+        return self._request("GET", path, params=params)
+
+    def generate_bill_number(self):
+        return self._post("/bill-number", {})["bill_number"]
+
+    def calculate_total(self, cosmetic_items, grocery_items, drink_items, prices=None):
+        return self._post("/calculate", {
+            "cosmetic_items": cosmetic_items,
+            "grocery_items": grocery_items,
+            "drink_items": drink_items
+        })
+
+    def generate_bill(self, customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, totals, prices=None):
+        return self._post("/render", {
+            "customer_name": customer_name,
+            "phone_number": phone_number,
+            "bill_number": bill_number,
+            "cosmetic_items": cosmetic_items,
+            "grocery_items": grocery_items,
+            "drink_items": drink_items
+        })["bill_content"]
+
+    def save_bill(self, bill_content, bill_number):
+        return self._post("/save", {"bill_content": bill_content, "bill_number": bill_number})["message"]
+
+    def export_bill_to_excel(self, customer_name, phone_number, bill_number, cosmetic_items, grocery_items, drink_items, totals, prices=None):
+        return self._post("/export", {
+            "customer_name": customer_name,
+            "phone_number": phone_number,
+            "bill_number": bill_number,
+            "cosmetic_items": cosmetic_items,
+            "grocery_items": grocery_items,
+            "drink_items": drink_items
+        })["file_path"]
+
+    def search_bills(self, by, value=""):
+        """Return bills matching a search: by is "number", "customer" or "date"."""
+        return self._get("/search", {"by": by, "value": value})["bills"]
+
+    def load_bill(self, bill_number):
+        return self._get(f"/bills/{bill_number}")["bill_content"]
@@ -0,0 +1,387 @@
+"""
+Shared billing API for several tills.
+
+    python -m utils.billing_service --host 0.0.0.0 --port 8600
+
+Exposes the bill_operations functions over HTTP/JSON. Every bill file write goes
+through one writer task, which batches queued writes and runs them in order on a
+single thread, so tills no longer race on the bills/ directory. Exported bills are
+published on the event bus (utils/events.py) like the app's, which queues them for
+central sync and the ledger, customer, stock, sketch and MongoDB consumers.
+
+Routes:
+    POST /bill-number    -> {"bill_number"}
+    POST /calculate      {cosmetic_items, grocery_items, drink_items} -> totals
+    POST /render         {customer_name, phone_number, bill_number, *_items} -> {"bill_content"}
+    POST /save           {bill_content, bill_number} -> {"message"}
+    POST /export         {customer_name, phone_number, bill_number, *_items} -> {"file_path"}
+
+/render and /export price the items themselves, from the service's catalog and
+promotions; totals sent by a till are ignored.
+    GET  /search?by=number|customer|date&value=...  -> {"bills": [...]}
+    GET  /bills/<number> -> {"bill_content"}
+    GET  /stats          -> throughput, latency and queue numbers
+    GET  /metrics        -> Prometheus text
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+from . import metrics, sync_queue
+from .bill_operations import (
+    build_bill_rows, calculate_total, export_bill_to_excel, generate_bill, is_valid_bill_number, save_bill, unused_bill_number
+)
+from .events import publish_bill_exported
+from .price_catalog import get_price_catalog
+from .promotions import get_promotion_engine
+
+# Largest number of queued writes handled in one batch, and how long to wait to fill it
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_WINDOW = 0.005
+
+# Writes queued beyond this make callers wait (backpressure)
+WRITE_QUEUE_SIZE = 1024
+
+DATE_FORMATS = ["%d-%m-%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S"]
+
+# Bill numbers handed out by /bill-number and not yet saved or exported, kept in bills_dir
+# so a restart does not reissue them
+RESERVED_FILE = ".reserved_bill_numbers"
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def _items(payload):
+    """Pull the three item dicts out of a request body."""
+    return (
+        {k: int(v) for k, v in payload.get("cosmetic_items", {}).items()},
+        {k: int(v) for k, v in payload.get("grocery_items", {}).items()},
+        {k: int(v) for k, v in payload.get("drink_items", {}).items()}
+    )
+
+
+def _totals(prices, items):
+    """Price the three item dicts with the promotions in force now."""
+    discounts = get_promotion_engine().evaluate_items(prices, *items)
+    return calculate_total(*items, prices, discounts)
+
+
+def _bill_header(lines):
+    """Return (customer name, date) from the lines of a bill rendered by generate_bill."""
+    customer_name = None
+    bill_date = None
+    for line in lines:
+        if line.startswith("Customer Name:"):
+            customer_name = line.split("Customer Name:", 1)[1].strip()
+        elif line.startswith("Date:"):
+            date_str = line.split("Date:", 1)[1].strip()
+            for date_format in DATE_FORMATS:
+                try:
+                    bill_date = datetime.strptime(date_str, date_format).date()
+                    break
+                except ValueError:
+                    pass
+            break
+    return customer_name, bill_date
+
+
+def _route_name(path):
+    """Metric name for a route, e.g. /bill-number -> api_bill_number, /bills/X -> api_bills."""
+    if path.startswith("/bills/"):
+        return "api_bills"
+    return "api_" + (path.strip("/").replace("-", "_") or "root")
+
+
+class StorageWriter:
+    """Queue of storage writes drained in batches by a single writer task."""
+
+    def __init__(self, bills_dir="bills", ledger_path=None):
+        self.bills_dir = bills_dir
+        self.ledger_path = ledger_path
+        self.queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+        # One thread: writes happen one after another, in queue order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.writes = 0
+
+    async def submit(self, kind, payload):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((kind, payload, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + WRITE_BATCH_WINDOW
+            while len(batch) < WRITE_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            results = await loop.run_in_executor(self.executor, self._write_batch, batch)
+            self.batches += 1
+            self.writes += len(batch)
+            metrics.inc("api_write_batches")
+            metrics.inc("api_writes", len(batch))
+            for (_, _, future), (error, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(value)
+
+    def _write_batch(self, batch):
+        """Run one batch of writes in order; the event consumers batch the exports' stores."""
+        results = []
+        prices = get_price_catalog().prices_as_of()
+        for kind, payload, _ in batch:
+            try:
+                if kind == "save":
+                    # Fsynced to the sync outbox first, as the app's saves are
+                    sync_queue.queue_bill_text(payload["bill_number"], payload["bill_content"])
+                    results.append((None, save_bill(payload["bill_content"], payload["bill_number"], self.bills_dir)))
+                elif kind == "export":
+                    cosmetic_items, grocery_items, drink_items = _items(payload)
+                    totals = _totals(prices, (cosmetic_items, grocery_items, drink_items))
+                    # Queue the bill for central sync and the stores before writing the workbook, as the app does
+                    publish_bill_exported(
+                        payload["bill_number"],
+                        {**cosmetic_items, **grocery_items, **drink_items},
+                        build_bill_rows(
+                            payload["customer_name"], payload["phone_number"], payload["bill_number"],
+                            cosmetic_items, grocery_items, drink_items, prices, totals=totals
+                        ),
+                        source="service",
+                        ledger_path=self.ledger_path
+                    )
+                    file_path = export_bill_to_excel(
+                        payload["customer_name"], payload["phone_number"], payload["bill_number"],
+                        cosmetic_items, grocery_items, drink_items, totals, prices,
+                        bills_dir=self.bills_dir
+                    )
+                    results.append((None, file_path))
+                else:
+                    results.append((ValueError(f"Unknown write: {kind}"), None))
+            except Exception as e:
+                results.append((e, None))
+        return results
+
+
+class BillingService:
+    """HTTP front end over bill_operations with a shared writer and bill index."""
+
+    def __init__(self, bills_dir="bills", ledger_path=None):
+        self.bills_dir = bills_dir
+        self.writer = StorageWriter(bills_dir, ledger_path)
+        # bill number -> (customer name, date) of every saved bill, for search
+        self.index = {}
+        # Numbers handed out but not yet saved or exported, as kept in RESERVED_FILE
+        self.reserved = set()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+
+    def load_index(self):
+        # Numbers already reserved or only exported are taken, though not searchable
+        reserved_path = os.path.join(self.bills_dir, RESERVED_FILE)
+        if os.path.exists(reserved_path):
+            with open(reserved_path, "r", encoding="utf-8") as f:
+                self.reserved = {line.strip() for line in f if line.strip()}
+            self.index.update((bill_number, (None, None)) for bill_number in self.reserved)
+        for file_path in glob.glob(os.path.join(self.bills_dir, "*.xlsx")):
+            self.index.setdefault(os.path.splitext(os.path.basename(file_path))[0], (None, None))
+        for file_path in glob.glob(os.path.join(self.bills_dir, "*.txt")):
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    self.index[os.path.splitext(os.path.basename(file_path))[0]] = _bill_header(f)
+            except OSError as e:
+                print(f"Error reading {file_path}: {e}")
+        # Reservations whose bill was saved or exported before a crash or restart
+        stored = {os.path.splitext(os.path.basename(path))[0] for path in glob.glob(os.path.join(self.bills_dir, "BILL*"))}
+        if self.reserved & stored:
+            self.release(*(self.reserved & stored))
+
+    def next_bill_number(self):
+        """Hand out a bill number no till has used yet."""
+        bill_number = unused_bill_number(self.index)
+        # Reserve it until the bill is saved, across restarts too
+        os.makedirs(self.bills_dir, exist_ok=True)
+        with open(os.path.join(self.bills_dir, RESERVED_FILE), "a", encoding="utf-8") as f:
+            f.write(bill_number + "\n")
+        self.reserved.add(bill_number)
+        self.index[bill_number] = (None, None)
+        return bill_number
+
+    def release(self, *bill_numbers):
+        """Drop reservations once their bills are stored; the bill files keep the numbers taken."""
+        if not self.reserved.intersection(bill_numbers):
+            return
+        self.reserved.difference_update(bill_numbers)
+        reserved_path = os.path.join(self.bills_dir, RESERVED_FILE)
+        tmp_path = f"{reserved_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{bill_number}\n" for bill_number in sorted(self.reserved))
+        os.replace(tmp_path, reserved_path)
+
+    async def handle(self, method, path, query, payload):
+        """Route one request; returns (status, body)."""
+        # The bill number becomes a file name, so it is checked before anything is queued
+        if "bill_number" in payload and not is_valid_bill_number(payload["bill_number"]):
+            return 400, {"error": f"Invalid bill number: {payload['bill_number']!r}"}
+        if method == "POST" and path == "/bill-number":
+            return 200, {"bill_number": self.next_bill_number()}
+        if method == "POST" and path == "/calculate":
+            return 200, _totals(get_price_catalog().prices_as_of(), _items(payload))
+        if method == "POST" and path == "/render":
+            prices = get_price_catalog().prices_as_of()
+            items = _items(payload)
+            bill_content = generate_bill(
+                payload["customer_name"], payload["phone_number"], payload["bill_number"],
+                *items, _totals(prices, items), prices
+            )
+            return 200, {"bill_content": bill_content}
+        if method == "POST" and path == "/save":
+            message = await self.writer.submit("save", payload)
+            self.index[payload["bill_number"]] = _bill_header(payload["bill_content"].splitlines())
+            self.release(payload["bill_number"])
+            return 200, {"message": message}
+        if method == "POST" and path == "/export":
+            file_path = await self.writer.submit("export", payload)
+            self.release(payload["bill_number"])
+            return 200, {"file_path": file_path}
+        if method == "GET" and path == "/search":
+            return 200, {"bills": self.search(query.get("by", ["number"])[0], query.get("value", [""])[0])}
+        if method == "GET" and path.startswith("/bills/"):
+            bill_number = path[len("/bills/"):]
+            if not is_valid_bill_number(bill_number):
+                return 400, {"error": f"Invalid bill number: {bill_number!r}"}
+            file_path = os.path.join(self.bills_dir, f"{bill_number}.txt")
+            if not os.path.exists(file_path):
+                return 404, {"error": f"Bill {bill_number} not found"}
+            with open(file_path, "r", encoding="utf-8") as f:
+                return 200, {"bill_content": f.read()}
+        if method == "GET" and path == "/stats":
+            return 200, self.stats()
+        if method in ("GET", "POST"):
+            return 404, {"error": f"No route for {path}"}
+        return 405, {"error": f"Method {method} not allowed"}
+
+    def search(self, by, value):
+        """Search saved bills by number prefix, customer name or dd-mm-YYYY date."""
+        bills = [
+            {"bill_number": number, "customer_name": name, "date": bill_date.strftime("%d-%m-%Y") if bill_date else None}
+            for number, (name, bill_date) in self.index.items()
+            if name is not None
+        ]
+        if by == "number":
+            return sorted((b for b in bills if b["bill_number"].startswith(value)), key=lambda b: b["bill_number"])
+        if by == "customer":
+            return [b for b in bills if not value or b["customer_name"] == value]
+        if by == "date":
+            return [b for b in bills if not value or b["date"] == value]
+        raise ValueError(f"Unknown search field: {by}")
+
+    def stats(self):
+        uptime = time.monotonic() - self.started
+        return {
+            "uptime_seconds": round(uptime, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "requests_per_second": round(self.requests / uptime, 2) if uptime else 0.0,
+            "write_queue_depth": self.writer.queue.qsize(),
+            "write_batches": self.writer.batches,
+            "writes": self.writer.writes,
+            "latency": metrics.snapshot()
+        }
+
+    async def serve_connection(self, reader, writer):
+        """Minimal HTTP/1.1 loop with keep-alive and JSON bodies."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+
+                url = urlsplit(target)
+                start = time.perf_counter()
+                self.requests += 1
+                content_type = "application/json"
+                try:
+                    if url.path == "/metrics":
+                        status, response = 200, metrics.render_prometheus().encode("utf-8")
+                        content_type = "text/plain; version=0.0.4"
+                    else:
+                        payload = json.loads(body) if body else {}
+                        status, result = await self.handle(method, url.path, parse_qs(url.query), payload)
+                        response = json.dumps(result).encode("utf-8")
+                except (KeyError, ValueError, TypeError) as e:
+                    status, response = 400, json.dumps({"error": str(e)}).encode("utf-8")
+                except Exception as e:
+                    status, response = 500, json.dumps({"error": str(e)}).encode("utf-8")
+                if status >= 400:
+                    self.errors += 1
+                metrics.observe(_route_name(url.path), time.perf_counter() - start)
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(response)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + response
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8600):
+        self.load_index()
+        writer_task = asyncio.create_task(self.writer.run())
+        server = await asyncio.start_server(self.serve_connection, host, port)
+        print(f"Billing service listening on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the shared billing API service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--bills-dir", default="bills", help="Directory for the bill .txt/.xlsx files")
+    parser.add_argument("--ledger", default=None, help="Ledger database path (default: data/ledger.db)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(BillingService(args.bills_dir, args.ledger).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
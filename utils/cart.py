@@ -0,0 +1,224 @@
+"""
+Incrementally maintained shopping cart.
+
+Each quantity change adjusts its category subtotal by the difference and
+re-formats only that receipt line, so subtotals cost O(1) per change and the
+final receipt is assembled from the stored lines without recomputing anything.
+Promotions and GST still look at every line of the cart, so totals() costs
+O(lines); it is cached until the cart, the promotion or slab tables, or the
+second of sale change, so reruns that change nothing reuse it.
+Totals and the receipt match calculate_total and generate_bill, which share
+the totals and receipt footer helpers below.
+"""
+from datetime import datetime
+
+import pandas as pd
+
+from .gst import CATEGORY_NAMES, get_gst_engine, to_paise
+
+# (key, receipt heading, label on tax/total lines) in receipt order
+CATEGORIES = (
+    ("cosmetic", "COSMETICS", "Cosmetic"),
+    ("grocery", "GROCERIES", "Grocery"),
+    ("drink", "DRINKS", "Drink"),
+)
+
+
+def format_line(item, qty, price):
+    """Format one receipt line the way generate_bill does."""
+    return f"{item:<25}{qty:<15}{price:<15}{price * qty}\n"
+
+
+def compute_totals(subtotals, taxes, discounts=None):
+    """
+    Turn per-category subtotals and taxes into the totals dict of calculate_total.
+
+    Args:
+        subtotals (dict): {category key: price x quantity summed over its lines}
+        taxes (dict): {category key: tax}, from GSTEngine.category_taxes
+        discounts (dict, optional): PromotionEngine.evaluate result
+
+    Returns:
+        dict: <key>_total, <key>_tax, <key>_final per category and grand_total; with
+        discounts also <key>_discount, discount_total, the applied promotions and
+        line_discounts {sku: discount}
+    """
+    totals = {}
+    grand_total = 0
+    # Sums are taken in paise so the totals carry no float residue
+    for key, _, _ in CATEGORIES:
+        subtotal = subtotals.get(key, 0)
+        totals[f"{key}_total"] = subtotal
+        net = int(to_paise(subtotal))
+        if discounts is not None:
+            discount = discounts["categories"].get(CATEGORY_NAMES[key], 0)
+            totals[f"{key}_discount"] = discount
+            net -= int(to_paise(discount))
+        final = net + int(to_paise(taxes.get(key, 0)))
+        totals[f"{key}_tax"] = taxes.get(key, 0)
+        totals[f"{key}_final"] = final / 100
+        grand_total += final
+    totals["grand_total"] = grand_total / 100
+    if discounts is not None:
+        totals["discount_total"] = discounts["total"]
+        totals["promotions"] = discounts["applied"]
+        # Kept so the exported line items can carry their discounts
+        totals["line_discounts"] = dict(discounts["lines"])
+    return totals
+
+
+def discounts_from_totals(totals):
+    """Rebuild the line and category discounts of a totals dict, or None if no promotions were evaluated."""
+    if not totals or "line_discounts" not in totals:
+        return None
+    return {
+        "lines": totals["line_discounts"],
+        "categories": {category: totals.get(f"{key}_discount", 0) for key, category in CATEGORY_NAMES.items()}
+    }
+
+
+def category_footer(key, label, totals):
+    """Return the discount, tax and total lines closing a category section of the receipt."""
+    footer = ""
+    if totals.get(f"{key}_discount"):
+        footer += f"{label} Discount: -{totals[f'{key}_discount']:.2f}\n"
+    footer += f"{label} Tax: {totals[f'{key}_tax']:.2f}\n"
+    footer += f"{label} Total: {totals[f'{key}_final']:.2f}\n\n"
+    return footer
+
+
+def offers_section(totals):
+    """Return the receipt lines listing the promotions applied, if any."""
+    if not totals.get("promotions"):
+        return ""
+    section = "OFFERS APPLIED\n"
+    for promotion in totals["promotions"]:
+        section += f"{promotion['description']:<55}-{promotion['amount']:.2f}\n"
+    section += f"You saved: {totals['discount_total']:.2f}\n\n"
+    return section
+
+
+class Cart:
+    """Quantities, running subtotals and formatted receipt lines for one bill."""
+
+    def __init__(self, products_by_category, prices):
+        """
+        Args:
+            products_by_category (dict): {category key: [sku, ...]} in display order
+            prices (dict): {sku: unit price}
+        """
+        self.prices = dict(prices)
+        self.rank = {sku: i for skus in products_by_category.values() for i, sku in enumerate(skus)}
+        self.quantities = {key: {} for key, _, _ in CATEGORIES}
+        self.lines = {key: {} for key, _, _ in CATEGORIES}
+        self.subtotals = dict.fromkeys(self.quantities, 0)
+        self.item_count = 0
+        # Bumped on every change; keys the cached totals
+        self.version = 0
+        self._totals_key = None
+        self._totals = None
+
+    def set_quantity(self, category, sku, qty):
+        """Set the quantity of one SKU and update its category subtotal by the difference."""
+        price = self.prices[sku]
+        old = self.quantities[category].get(sku, 0)
+        if qty == old:
+            return
+        self.version += 1
+        self.subtotals[category] += (qty - old) * price
+        self.item_count += (qty > 0) - (old > 0)
+        if qty > 0:
+            self.quantities[category][sku] = qty
+            self.lines[category][sku] = format_line(sku, qty, price)
+        else:
+            self.quantities[category].pop(sku, None)
+            self.lines[category].pop(sku, None)
+
+    def set_prices(self, prices):
+        """
+        Take new unit prices, repricing only the SKUs in the cart whose price changed.
+
+        SKUs in the cart with no new price can no longer be sold and are taken out.
+
+        Returns:
+            list: the SKUs taken out of the cart
+        """
+        removed = []
+        for category, quantities in self.quantities.items():
+            for sku, qty in list(quantities.items()):
+                old, new = self.prices.get(sku), prices.get(sku)
+                if new is None:
+                    self.set_quantity(category, sku, 0)
+                    removed.append(sku)
+                elif new != old:
+                    self.version += 1
+                    self.subtotals[category] += (new - old) * qty
+                    self.lines[category][sku] = format_line(sku, qty, new)
+        self.prices = dict(prices)
+        return removed
+
+    def is_empty(self):
+        return self.item_count == 0
+
+    def items(self, category):
+        """Return {sku: quantity} of the SKUs in a category with a non-zero quantity."""
+        return dict(self.quantities[category])
+
+    def lines_for_promotions(self):
+        """Return (sku, quantity, unit price) for every line in receipt order, as PromotionEngine.evaluate expects."""
+        return [
+            (sku, quantities[sku], self.prices[sku])
+            for quantities in self.quantities.values()
+            for sku in sorted(quantities, key=lambda sku: self.rank.get(sku, 0))
+        ]
+
+    def totals(self, promotions=None, when=None):
+        """
+        Return the totals dict in the format of calculate_total.
+
+        Args:
+            promotions (PromotionEngine, optional): engine to apply; it only looks at this cart's lines
+            when (datetime, optional): moment of sale for the promotions. If None, now.
+        """
+        gst = get_gst_engine()
+        # Promotions and slabs change on whole seconds, so totals hold for the rest of one
+        when = (pd.Timestamp(when) if when is not None else pd.Timestamp.now()).strftime('%Y-%m-%d %H:%M:%S')
+        key = (self.version, id(promotions), getattr(promotions, "mtime", None), id(gst), gst.mtime, when)
+        if key != self._totals_key:
+            lines = self.lines_for_promotions()
+            discounts = promotions.evaluate(lines, when) if promotions is not None else None
+            # Tax is worked out line by line from the slab table; only this cart's lines are looked up
+            self._totals = compute_totals(self.subtotals, gst.category_taxes(lines, discounts, when), discounts)
+            self._totals_key = key
+        return dict(self._totals)
+
+    def receipt(self, customer_name, phone_number, bill_number, bill_date=None, totals=None):
+        """Assemble the bill text from the stored lines and the running (or given) totals."""
+        current_time = (bill_date or datetime.now()).strftime("%d-%m-%Y %H:%M:%S")
+        parts = [f"""
+{'*' * 70}
+                      GROCERY BILLING SYSTEM
+{'*' * 70}
+Bill Number: {bill_number}
+Customer Name: {customer_name}
+Phone Number: {phone_number}
+Date: {current_time}
+{'=' * 70}
+Product                 Quantity         Price         Total
+{'=' * 70}
+"""]
+        totals = totals or self.totals()
+        for key, heading, label in CATEGORIES:
+            lines = self.lines[key]
+            if not lines:
+                continue
+            parts.append(f"{heading}\n")
+            # Lines are kept unordered; the receipt lists them in display order
+            parts.extend(lines[sku] for sku in sorted(lines, key=lambda sku: self.rank.get(sku, 0)))
+            parts.append(category_footer(key, label, totals))
+        parts.append(offers_section(totals))
+        parts.append(f"{'=' * 70}\n")
+        parts.append(f"Grand Total: ₹{totals['grand_total']:.2f}\n")
+        parts.append(f"{'=' * 70}\n")
+        parts.append("Thank you for shopping with us!\n")
+        return "".join(parts)
@@ -0,0 +1,159 @@
+import heapq
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from .file_lock import file_lock
+
+# Bill numbers remembered per customer, so saving and exporting a bill counts it once
+RECENT_BILLS = 50
+
+_lock = threading.Lock()
+# (path, mtime_ns) -> records, so reruns don't re-parse an unchanged file
+_cache = {}
+
+
+def default_customers_path():
+    """Return the default customer dimension file, data/customers.json."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'customers.json')
+
+
+def customer_key(name, phone):
+    """Normalize a customer to 'name|digits', e.g. ' Asha  K ', '98-76' -> 'asha k|9876'."""
+    name = re.sub(r"\s+", " ", str(name or "")).strip().casefold()
+    phone = re.sub(r"\D", "", str(phone or ""))
+    return f"{name}|{phone}"
+
+
+def load_customers(customers_path=None):
+    """Load the customer dimension as {key: record}."""
+    customers_path = customers_path or default_customers_path()
+    if not os.path.exists(customers_path):
+        return {}
+    mtime = os.stat(customers_path).st_mtime_ns
+    cached = _cache.get(customers_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    records = _read_customers(customers_path)
+    _cache[customers_path] = (mtime, records)
+    return records
+
+
+def _read_customers(customers_path):
+    if not os.path.exists(customers_path):
+        return {}
+    with open(customers_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_customers(records, customers_path):
+    os.makedirs(os.path.dirname(os.path.abspath(customers_path)), exist_ok=True)
+    tmp_path = f"{customers_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(records, f)
+    os.replace(tmp_path, customers_path)
+    _cache[customers_path] = (os.stat(customers_path).st_mtime_ns, records)
+
+
+def _bill_summaries(bill_rows):
+    """Collapse line items to one (bill, name, phone, date, total) tuple per bill."""
+    df = pd.DataFrame(bill_rows)
+    if df.empty:
+        return []
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    bills = df.groupby('Bill Number', sort=False).agg(
+        name=('Customer Name', 'first'),
+        phone=('Phone', 'first'),
+        date=('Date', 'first'),
+        total=('Total', 'sum')
+    ).reset_index()
+    return list(bills.itertuples(index=False, name=None))
+
+
+def _apply_bill(records, bill_number, name, phone, date, total):
+    key = customer_key(name, phone)
+    visit = (date if pd.notna(date) else datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+    record = records.get(key)
+    if record is None:
+        record = records[key] = {
+            "name": str(name),
+            "phone": str(phone),
+            "first_visit": visit,
+            "last_visit": visit,
+            "frequency": 0,
+            "monetary": 0.0,
+            "recent_bills": []
+        }
+    # Saving and then exporting the same bill must not count it twice, even with other bills in between
+    if bill_number in record["recent_bills"]:
+        return
+    record["frequency"] += 1
+    record["monetary"] = round(record["monetary"] + float(total), 2)
+    record["first_visit"] = min(record["first_visit"], visit)
+    record["last_visit"] = max(record["last_visit"], visit)
+    record["recent_bills"] = (record["recent_bills"] + [bill_number])[-RECENT_BILLS:]
+
+
+def update_customers(bill_rows, customers_path=None):
+    """
+    Fold newly saved bills into the customer dimension.
+
+    Args:
+        bill_rows (list or pd.DataFrame): line items as built by build_bill_rows
+        customers_path (str, optional): dimension file. If None, data/customers.json is used.
+
+    Returns:
+        int: number of customers in the dimension
+    """
+    customers_path = customers_path or default_customers_path()
+    os.makedirs(os.path.dirname(os.path.abspath(customers_path)), exist_ok=True)
+    # The app, the billing service and batch billing update the file from separate processes
+    with _lock, file_lock(f"{customers_path}.lock"):
+        # Read past the cache: another process may have replaced the file within the same mtime tick
+        records = _read_customers(customers_path)
+        for bill in _bill_summaries(bill_rows):
+            _apply_bill(records, *bill)
+        _save_customers(records, customers_path)
+        return len(records)
+
+
+def rebuild_customers(sales_data, customers_path=None):
+    """Rebuild the dimension from a full line-item history (e.g. after a migration)."""
+    customers_path = customers_path or default_customers_path()
+    records = {}
+    if sales_data is not None and not sales_data.empty:
+        # Oldest first so recent_bills keeps the latest bills
+        history = sales_data.assign(Date=pd.to_datetime(sales_data['Date'], errors='coerce')).sort_values('Date')
+        for bill in _bill_summaries(history):
+            _apply_bill(records, *bill)
+    os.makedirs(os.path.dirname(os.path.abspath(customers_path)), exist_ok=True)
+    with _lock, file_lock(f"{customers_path}.lock"):
+        _save_customers(records, customers_path)
+    return len(records)
+
+
+def top_customers(n=10, by="monetary", customers_path=None):
+    """Return the top n customer records by 'monetary' or 'frequency'."""
+    return heapq.nlargest(n, load_customers(customers_path).values(), key=lambda r: r[by])
+
+
+def rfm_table(as_of=None, customers_path=None):
+    """Return recency (days), frequency and monetary totals per customer as a DataFrame."""
+    records = load_customers(customers_path)
+    df = pd.DataFrame(list(records.values()),
+                      columns=["name", "phone", "first_visit", "last_visit", "frequency", "monetary", "recent_bills"])
+    as_of = pd.Timestamp(as_of or datetime.now())
+    df["recency_days"] = (as_of - pd.to_datetime(df["last_visit"])).dt.days
+    return df.drop(columns=["recent_bills"]).rename(columns={
+        "name": "Customer Name",
+        "phone": "Phone",
+        "first_visit": "First Visit",
+        "last_visit": "Last Visit",
+        "frequency": "Frequency",
+        "monetary": "Monetary",
+        "recency_days": "Recency (days)"
+    })
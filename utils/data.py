@@ -108,4 +108,11 @@ prices = {}
 for category_dict in [cosmetic_products, grocery_products, drink_products]:
     for product_type, variants in category_dict.items():
         for variant in variants:
-            prices[variant["name"]] = variant["price"]
\ No newline at end of file
+            prices[variant["name"]] = variant["price"]
+
+# Category of each product variant, used to split a flat cart into bill sections
+product_categories = {}
+for category, category_dict in [("Cosmetics", cosmetic_products), ("Groceries", grocery_products), ("Drinks", drink_products)]:
+    for product_type, variants in category_dict.items():
+        for variant in variants:
+            product_categories[variant["name"]] = category
\ No newline at end of file
@@ -2,6 +2,9 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from .metrics import timed
+
+@timed()
 def send_email(sender_email, sender_password, receiver_email, message):
     try:
         # Create message
@@ -0,0 +1,229 @@
+"""
+In-process bill event bus.
+
+The till publishes one event when a bill is saved or exported and returns;
+every storage consumer (ledger, customers, stock, sketches, MongoDB) is a
+subscriber with its own bounded queue and worker thread. Workers take events
+in batches, so a burst of bills costs each consumer one write, and failed
+batches are retried with backoff before going to a dead-letter file.
+
+Queued events live only in memory, so the bill is first appended to the
+durable sync outbox (when central sync is on) before publish returns; only
+shipping it to the central store happens in the background.
+
+Settings:
+    BILLING_EVENT_QUEUE  events each subscriber may hold before publish waits (default 1000)
+
+Metrics per subscriber: events.<name> (handler latency), events.<name>.lag
+(publish to handled), gauge events_<name>_queued and counters
+events_<name>_retries / events_<name>_failed.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from . import metrics, mongo_storage, sync_queue
+from .customers import update_customers
+from .inventory import get_stock_ledger
+from .ledger import append_bills
+from .sketches import update_sketches
+
+BILL_SAVED = "bill.saved"
+BILL_EXPORTED = "bill.exported"
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def default_dead_letter_path():
+    """Return the file failed event batches are appended to, data/dead_letter.jsonl."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'dead_letter.jsonl')
+
+
+class Subscriber:
+    """One consumer: a bounded queue drained in batches by a worker thread."""
+
+    def __init__(self, name, handler, event_types, batch_size=50, max_queue=1000, retries=3):
+        self.name = name
+        self.handler = handler
+        self.event_types = set(event_types)
+        self.batch_size = batch_size
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, name=f"events-{name}", daemon=True)
+        self.thread.start()
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Wait rather than drop: a lost event is a bill missing from a store
+            metrics.inc(f"events_{self.name}_blocked")
+            self.queue.put(event)
+        metrics.set_gauge(f"events_{self.name}_queued", self.queue.qsize())
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # Whatever else is already queued rides along in the same batch
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._handle(batch)
+            for _ in batch:
+                self.queue.task_done()
+            metrics.set_gauge(f"events_{self.name}_queued", self.queue.qsize())
+
+    def _handle(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.track(f"events.{self.name}"):
+                    self.handler(batch)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    metrics.inc(f"events_{self.name}_failed", len(batch))
+                    print(f"Error in {self.name} consumer, {len(batch)} events sent to dead letter: {e}")
+                    _dead_letter(self.name, batch, e)
+                    return
+                metrics.inc(f"events_{self.name}_retries")
+                time.sleep(0.5 * 2 ** attempt)
+        now = time.time()
+        for event in batch:
+            metrics.observe(f"events.{self.name}.lag", now - event["published_at"])
+
+
+class EventBus:
+    """Fan each published event out to the subscribers of its type."""
+
+    def __init__(self, max_queue=None):
+        self.max_queue = max_queue or int(os.environ.get("BILLING_EVENT_QUEUE", "1000"))
+        self.subscribers = {}
+
+    def subscribe(self, name, handler, event_types, batch_size=50, retries=3):
+        """
+        Register handler(events) for the given event types; a name is registered once.
+
+        Args:
+            name (str): consumer name used in metrics and error messages
+            handler (callable): called with a list of events from a worker thread
+            event_types (iterable): event types to receive
+            batch_size (int): most events passed to one handler call
+            retries (int): retries of a failing batch before it is dead-lettered
+        """
+        if name not in self.subscribers:
+            self.subscribers[name] = Subscriber(name, handler, event_types, batch_size, self.max_queue, retries)
+        return self.subscribers[name]
+
+    def publish(self, event_type, **payload):
+        """Queue an event for its subscribers and return immediately."""
+        with metrics.track("events.publish"):
+            event = {"type": event_type, "published_at": time.time(), **payload}
+            for subscriber in self.subscribers.values():
+                if event_type in subscriber.event_types:
+                    subscriber.put(event)
+
+    def drain(self, timeout=None):
+        """Wait until every queued event has been handled; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for subscriber in self.subscribers.values():
+            while subscriber.queue.unfinished_tasks:
+                if deadline is not None and time.monotonic() > deadline:
+                    return False
+                time.sleep(0.01)
+        return True
+
+
+def _dead_letter(name, batch, error):
+    path = default_dead_letter_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for event in batch:
+            f.write(json.dumps({
+                "subscriber": name,
+                "error": str(error),
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "event": event
+            }, default=str) + "\n")
+
+
+def _rows(events):
+    return [row for event in events for row in event.get("rows") or []]
+
+
+def _by_destination(events):
+    """Group events by their (ledger path, source); the billing service publishes its own."""
+    groups = {}
+    for event in events:
+        groups.setdefault((event.get("ledger_path"), event.get("source", "app")), []).append(event)
+    return groups.items()
+
+
+def _write_ledger(events):
+    for (ledger_path, source), group in _by_destination(events):
+        rows = _rows(group)
+        if rows:
+            append_bills(pd.DataFrame(rows), source=source, ledger_path=ledger_path)
+
+
+def _mirror_mongo(events):
+    for (_, source), group in _by_destination(events):
+        rows = _rows(group)
+        if rows:
+            mongo_storage.mirror_bills(pd.DataFrame(rows), source=source)
+
+
+def _update_customers(events):
+    rows = _rows(events)
+    if rows:
+        update_customers(rows)
+
+
+def _update_sketches(events):
+    rows = _rows(events)
+    if rows:
+        update_sketches(rows)
+
+
+def _record_stock(events):
+    # Saving and exporting the same bill publish two events; the stock ledger skips the second
+    get_stock_ledger().record_sales([(event["bill_number"], event["items"]) for event in events])
+
+
+def get_bus():
+    """Return the process-wide bus with the bill storage consumers subscribed."""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            bus = EventBus()
+            bus.subscribe("ledger", _write_ledger, [BILL_EXPORTED])
+            bus.subscribe("mongo", _mirror_mongo, [BILL_EXPORTED])
+            bus.subscribe("customers", _update_customers, [BILL_SAVED, BILL_EXPORTED])
+            bus.subscribe("sketches", _update_sketches, [BILL_EXPORTED])
+            bus.subscribe("stock", _record_stock, [BILL_SAVED, BILL_EXPORTED])
+            # Let queued bills reach their stores before the process exits
+            atexit.register(bus.drain, 30)
+            _bus = bus
+        return _bus
+
+
+def publish_bill_saved(bill_number, content, items, rows):
+    """Publish a saved bill: its text, {sku: quantity} and ledger rows."""
+    # Fsynced to the outbox before returning; a crash after this cannot lose the bill for central sync
+    sync_queue.queue_bill_text(bill_number, content)
+    get_bus().publish(BILL_SAVED, bill_number=bill_number, content=content, items=items, rows=rows)
+
+
+def publish_bill_exported(bill_number, items, rows, source="app", ledger_path=None):
+    """Publish an exported bill: {sku: quantity} and ledger rows, stored under source in ledger_path."""
+    sync_queue.queue_rows(rows)
+    get_bus().publish(BILL_EXPORTED, bill_number=bill_number, items=items, rows=rows,
+                      source=source, ledger_path=ledger_path)
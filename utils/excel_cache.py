@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# pyarrow is optional; without it every read falls back to pd.read_excel
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+from .metrics import inc, timed
+
+# Schema metadata key holding the source file's mtime, size and hash
+SOURCE_META_KEY = b"billing_source"
+
+
+def sidecar_path(file_path):
+    """Return the hidden Feather sidecar path for a workbook, e.g. bills/.BILL1.xlsx.feather."""
+    directory, name = os.path.split(file_path)
+    return os.path.join(directory, f".{name}.feather")
+
+
+def _file_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_sidecar(path):
+    """Memory-map a sidecar; returns None if it is missing or unreadable."""
+    try:
+        source = pa.memory_map(path, "r")
+        return pa.ipc.open_file(source).read_all()
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+def write_sidecar(file_path, df, file_hash=None):
+    """
+    Write the Feather copy of a workbook that was just read or written.
+
+    Args:
+        file_path (str): path of the source .xlsx file
+        df (pd.DataFrame): the workbook contents
+        file_hash (str, optional): sha1 of the source file if already known
+
+    Returns:
+        bool: True if the sidecar was written
+    """
+    if feather is None:
+        return False
+    try:
+        stat = os.stat(file_path)
+        meta = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha1": file_hash or _file_hash(file_path)
+        }
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Excel columns can mix numbers and text (e.g. Phone); store those as text, keeping empty cells null
+            mixed = [column for column in df.columns if df[column].dtype == object]
+            df = df.assign(**{column: df[column].where(df[column].isna(), df[column].astype(str)) for column in mixed})
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), SOURCE_META_KEY: json.dumps(meta)})
+        path = sidecar_path(file_path)
+        tmp_path = f"{path}.tmp"
+        # Uncompressed so later reads can map the columns without copying
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+        return True
+    except (OSError, pa.ArrowException) as e:
+        # Mixed-type columns or a sidecar still mapped elsewhere (Windows); just skip the cache
+        print(f"Could not write cache for {file_path}: {e}")
+        return False
+
+
+@timed()
+def read_excel_cached(file_path):
+    """
+    Read a bill workbook, using its Feather sidecar when it is still valid.
+
+    The sidecar is valid when the source mtime and size match, or when the
+    source was only touched and its hash is unchanged. Anything else re-reads
+    the workbook and rewrites the sidecar.
+    """
+    if feather is None:
+        return pd.read_excel(file_path)
+
+    stat = os.stat(file_path)
+    table = _load_sidecar(sidecar_path(file_path))
+    if table is not None and table.schema.metadata and SOURCE_META_KEY in table.schema.metadata:
+        meta = json.loads(table.schema.metadata[SOURCE_META_KEY])
+        if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+            inc("excel_cache_hits")
+            return table.to_pandas(split_blocks=True)
+        if meta["size"] == stat.st_size:
+            file_hash = _file_hash(file_path)
+            if file_hash == meta["sha1"]:
+                inc("excel_cache_hits")
+                df = table.to_pandas(split_blocks=True)
+                # Same contents with a new mtime; store the new mtime
+                write_sidecar(file_path, df, file_hash)
+                return df
+
+    inc("excel_cache_misses")
+    df = pd.read_excel(file_path)
+    write_sidecar(file_path, df)
+    return df
@@ -0,0 +1,79 @@
+"""
+Process-wide cache of the analytics Plotly figures.
+
+Aggregating the sales frame and building a px/go figure is the costly part of
+an analytics rerun. Figures are kept by (data version, filter state, chart,
+grouping) and shared by every session, so switching views, or toggling a
+filter back to a state seen before, reuses the figure built then. Cached
+figures are never modified after they are built.
+
+Settings:
+    BILLING_FIGURE_CACHE  figures kept before the least recently used is dropped (default 128)
+    BILLING_FIGURE_TTL    seconds figures built from MongoDB aggregates are reused (default 60)
+
+Metrics: figures.build (build latency), counters figure_cache_hits / figure_cache_misses.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import metrics, mongo_storage
+
+MAX_FIGURES = int(os.environ.get("BILLING_FIGURE_CACHE", "128"))
+MONGO_TTL = float(os.environ.get("BILLING_FIGURE_TTL", "60"))
+
+_figures = OrderedDict()
+_lock = threading.Lock()
+
+
+def data_version(file_paths):
+    """
+    Cheap fingerprint of the bill files behind the charts; changes whenever one is rewritten.
+
+    With MongoDB pushdown the aggregates also see bills from other terminals, so
+    the version then rolls over every BILLING_FIGURE_TTL seconds as well.
+    """
+    version = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            version.append((file_path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append((file_path, None, None))
+    if mongo_storage.enabled():
+        version.append(("mongo", int(time.time() // MONGO_TTL)))
+    return tuple(version)
+
+
+def get_figures(key, build):
+    """
+    Return the cached figures for key, calling build() to make them on a miss.
+
+    Args:
+        key (tuple): hashable (data version, filters, chart, grouping...) key
+        build (callable): returns the figure, a tuple of figures, or None when there is nothing to plot
+
+    Returns:
+        whatever build returned for this key
+    """
+    with _lock:
+        if key in _figures:
+            _figures.move_to_end(key)
+            metrics.inc("figure_cache_hits")
+            return _figures[key]
+    metrics.inc("figure_cache_misses")
+    with metrics.track("figures.build"):
+        figures = build()
+    with _lock:
+        _figures[key] = figures
+        # Drop the least recently used figures past the limit
+        while len(_figures) > MAX_FIGURES:
+            _figures.popitem(last=False)
+    return figures
+
+
+def clear():
+    """Forget every cached figure."""
+    with _lock:
+        _figures.clear()
@@ -0,0 +1,26 @@
+import platform
+from contextlib import contextmanager
+
+if platform.system() == 'Windows':
+    import msvcrt
+else:
+    import fcntl
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path across processes (the app, batch billing and the service)."""
+    with open(path, "a+b") as f:
+        if platform.system() == 'Windows':
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if platform.system() == 'Windows':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,166 @@
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Smoothing factor of the exponential smoothing model
+DEFAULT_ALPHA = 0.3
+
+# Days held out to choose between the models per SKU
+HOLDOUT_DAYS = 14
+
+# Safety stock in standard deviations of daily demand (about 95% service level)
+SAFETY_Z = 1.65
+
+_cache = {}
+_cache_lock = threading.Lock()
+# Forecast results kept for the most recent data versions
+CACHE_SIZE = 8
+
+
+def demand_matrix(sales_data, history_days=None):
+    """
+    Build a SKU x day matrix of units sold.
+
+    Args:
+        sales_data (pd.DataFrame): line items with Date, Product and Quantity
+        history_days (int, optional): keep only the last history_days days
+
+    Returns:
+        tuple: (products, days, matrix) where matrix[i, j] is units of products[i] sold on days[j]
+    """
+    dates = pd.to_datetime(sales_data['Date'], errors='coerce').dt.normalize()
+    valid = dates.notna().to_numpy()
+    dates = dates[valid]
+    products, product_codes = np.unique(sales_data['Product'].to_numpy()[valid].astype(str), return_inverse=True)
+    if len(dates) == 0:
+        return products, pd.DatetimeIndex([]), np.zeros((len(products), 0))
+
+    first, last = dates.min(), dates.max()
+    if history_days:
+        first = max(first, last - pd.Timedelta(days=history_days - 1))
+    days = pd.date_range(first, last, freq='D')
+    day_codes = ((dates - first).dt.days).to_numpy()
+    keep = day_codes >= 0
+
+    matrix = np.zeros((len(products), len(days)))
+    quantities = pd.to_numeric(sales_data['Quantity'], errors='coerce').fillna(0).to_numpy()[valid]
+    # Scatter-add every line item into its (SKU, day) cell in one pass
+    np.add.at(matrix, (product_codes[keep], day_codes[keep]), quantities[keep])
+    return products, days, matrix
+
+
+def exponential_smoothing(matrix, alpha=DEFAULT_ALPHA):
+    """
+    Return the simple exponential smoothing level of every row at the last day.
+
+    The level is a weighted sum of the history with weights alpha * (1 - alpha)^age,
+    so all SKUs are smoothed with one matrix-vector product.
+    """
+    n_days = matrix.shape[1]
+    if n_days == 0:
+        return np.zeros(matrix.shape[0])
+    ages = np.arange(n_days - 1, -1, -1)
+    weights = alpha * (1 - alpha) ** ages
+    # The oldest day starts the recursion, so it takes the remaining weight
+    weights[0] = (1 - alpha) ** (n_days - 1)
+    return matrix @ weights
+
+
+def seasonal_naive(matrix, horizon, season=7, seasons=4):
+    """
+    Forecast each row as the average of the same weekday over the last seasons weeks.
+
+    Returns:
+        np.ndarray: (rows, horizon) forecast
+    """
+    rows, n_days = matrix.shape
+    if n_days < season:
+        return np.repeat(matrix.mean(axis=1, keepdims=True) if n_days else np.zeros((rows, 1)), horizon, axis=1)
+    usable = min(seasons, n_days // season) * season
+    profile = matrix[:, -usable:].reshape(rows, -1, season).mean(axis=1)
+    # The window spans whole seasons, so forecast day h lines up with profile column h % season
+    return profile[:, np.arange(horizon) % season]
+
+
+def forecast_demand(matrix, horizon=14, alpha=DEFAULT_ALPHA, holdout=HOLDOUT_DAYS):
+    """
+    Forecast daily demand for every SKU, picking the better model per SKU.
+
+    Both models are scored on the last holdout days (fitted on the days before) and
+    each SKU uses the one with the lower mean absolute error.
+
+    Returns:
+        tuple: (forecast (rows, horizon), model name per row)
+    """
+    rows, n_days = matrix.shape
+    smoothed = np.repeat(exponential_smoothing(matrix, alpha)[:, None], horizon, axis=1)
+    seasonal = seasonal_naive(matrix, horizon)
+    if n_days < holdout + 14:
+        return smoothed, np.full(rows, "exponential smoothing")
+
+    train, test = matrix[:, :-holdout], matrix[:, -holdout:]
+    ses_error = np.abs(test - exponential_smoothing(train, alpha)[:, None]).mean(axis=1)
+    seasonal_error = np.abs(test - seasonal_naive(train, holdout)).mean(axis=1)
+    use_seasonal = seasonal_error < ses_error
+    forecast = np.where(use_seasonal[:, None], seasonal, smoothed)
+    models = np.where(use_seasonal, "seasonal naive", "exponential smoothing")
+    return forecast, models
+
+
+def _data_version(sales_data):
+    """Fallback fingerprint of the sales history when the caller has no version for it."""
+    return len(sales_data), float(pd.to_numeric(sales_data['Quantity'], errors='coerce').sum())
+
+
+def reorder_plan(sales_data, on_hand=None, horizon=14, lead_time_days=7, history_days=180, alpha=DEFAULT_ALPHA,
+                 version=None):
+    """
+    Forecast demand for all SKUs and suggest reorder quantities.
+
+    The suggestion covers forecast demand over the lead time plus the horizon and a
+    safety stock of SAFETY_Z standard deviations of daily demand over the lead time,
+    minus stock on hand. Forecasts are cached per data version.
+
+    Args:
+        sales_data (pd.DataFrame): line items with Date, Product and Quantity
+        on_hand (dict, optional): {sku: units on hand}; missing SKUs count as 0
+        horizon (int): days to forecast
+        lead_time_days (int): days between ordering and receiving stock
+        history_days (int): days of history the models look at
+        alpha (float): exponential smoothing factor
+        version (optional): version of sales_data, e.g. figure_cache.data_version of its files
+
+    Returns:
+        pd.DataFrame: per SKU model, daily forecast, demand over lead time + horizon,
+        on hand and suggested reorder quantity, largest suggestion first
+    """
+    key = (version if version is not None else _data_version(sales_data), horizon, lead_time_days, history_days, alpha)
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is None:
+        products, days, matrix = demand_matrix(sales_data, history_days)
+        forecast, models = forecast_demand(matrix, horizon + lead_time_days, alpha)
+        demand = forecast.sum(axis=1)
+        daily_std = matrix.std(axis=1) if matrix.shape[1] else np.zeros(len(products))
+        safety = SAFETY_Z * daily_std * math.sqrt(lead_time_days)
+        cached = pd.DataFrame({
+            'Product': products,
+            'Model': models,
+            'Daily Forecast': forecast[:, :horizon].mean(axis=1).round(2),
+            'Forecast Demand': demand.round(1),
+            'Safety Stock': safety.round(1)
+        })
+        with _cache_lock:
+            if len(_cache) >= CACHE_SIZE:
+                _cache.pop(next(iter(_cache)))
+            _cache[key] = cached
+
+    plan = cached.copy()
+    on_hand = on_hand or {}
+    plan['On Hand'] = plan['Product'].map(lambda sku: on_hand.get(sku, 0))
+    plan['Reorder Qty'] = np.ceil(
+        np.maximum(plan['Forecast Demand'] + plan['Safety Stock'] - plan['On Hand'], 0)
+    ).astype(int)
+    return plan.sort_values('Reorder Qty', ascending=False).reset_index(drop=True)
@@ -0,0 +1,372 @@
+"""
+Table-driven GST: slab rates per HSN code, versioned by effective date.
+
+Every SKU maps to an HSN code (its category's default unless overridden) and
+every HSN code to a list of (effective from, rate in basis points) versions. The
+table is compiled into sorted NumPy arrays keyed on (HSN index, time), so the
+rate of any number of line items is one searchsorted call, and tax is computed
+in integer paise, rounded half up per line.
+
+Changes to the built-in table are kept in data/gst_slabs.json:
+    {"hsn": {"Dove Bath Soap": "3401"}, "slabs": {"3401": [["2025-04-01 00:00:00", 1800]]}}
+
+End-of-day summary straight from the ledger:
+    python -m utils.gst summary --date 2025-03-01
+    python -m utils.gst bench --rows 3000000
+"""
+import argparse
+import bisect
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .data import product_categories
+
+# Effective-from date of the built-in slabs
+BASE_EFFECTIVE_FROM = "1970-01-01 00:00:00"
+
+# HSN code of each category, with the rates the bills have always used
+DEFAULT_CATEGORY_HSN = {"Cosmetics": "3304", "Groceries": "1904", "Drinks": "2202"}
+DEFAULT_SLABS = {"3304": 1200, "1904": 500, "2202": 1800}
+
+# Bill categories by the cart's category keys
+CATEGORY_NAMES = {"cosmetic": "Cosmetics", "grocery": "Groceries", "drink": "Drinks"}
+
+# Batch keys are HSN index * _HSN_SPAN + seconds since _EPOCH; the span exceeds any such time
+_EPOCH = int(pd.Timestamp("1900-01-01").timestamp())
+_HSN_SPAN = 10 ** 10
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def default_slabs_path():
+    """Return the default slab changes file, data/gst_slabs.json."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'gst_slabs.json')
+
+
+def _timestamp(when):
+    if when is None:
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    # Already normalized (e.g. by category_taxes for each of its lines)
+    if isinstance(when, str) and len(when) == 19:
+        return when
+    return pd.Timestamp(when).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def to_paise(amount):
+    """Convert rupees (int, float or array) to integer paise."""
+    return np.rint(np.asarray(amount, dtype=float) * 100).astype(np.int64)
+
+
+def tax_paise(taxable, rate_bp):
+    """Tax on integer paise at rates in basis points, rounded half up (arrays or scalars)."""
+    return (np.asarray(taxable, dtype=np.int64) * np.asarray(rate_bp, dtype=np.int64) + 5000) // 10000
+
+
+class _Slabs:
+    """
+    One compiled version of the slab table: SKU -> HSN code -> rate versions.
+
+    Lookups run without the engine's lock, so a reload compiles a new _Slabs and
+    swaps it in whole rather than editing this one.
+    """
+
+    def __init__(self, sku_hsn, versions):
+        self.sku_hsn = sku_hsn
+        self.hsn_codes = sorted(versions)
+        self.hsn_index = {hsn: i for i, hsn in enumerate(self.hsn_codes)}
+        # Per HSN code for single-cart lookups
+        self.effective = {hsn: sorted(v) for hsn, v in versions.items()}
+        self.rates = {hsn: [versions[hsn][when] for when in self.effective[hsn]] for hsn in versions}
+        # One sorted array of (HSN index, effective time) keys for batch lookups
+        keys, rates = [], []
+        for hsn in self.hsn_codes:
+            seconds = pd.to_datetime(self.effective[hsn]).values.astype('datetime64[s]').astype(np.int64)
+            keys.append(self.hsn_index[hsn] * _HSN_SPAN + (seconds - _EPOCH))
+            rates.append(self.rates[hsn])
+        self.keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+        self.key_rates = np.concatenate([np.asarray(r, dtype=np.int64) for r in rates]) if rates else np.zeros(0, dtype=np.int64)
+        self.key_hsn = self.keys // _HSN_SPAN
+
+    def hsn_for(self, sku):
+        return self.sku_hsn.get(sku) or DEFAULT_CATEGORY_HSN.get(product_categories.get(sku))
+
+    def rate_bp(self, sku, when):
+        hsn = self.hsn_for(sku)
+        effective = self.effective.get(hsn)
+        if not effective:
+            return None
+        i = bisect.bisect_right(effective, when) - 1
+        return self.rates[hsn][i] if i >= 0 else None
+
+    def lookup(self, products, dates):
+        """Return (HSN index, rate in basis points) per line, both -1 where unknown."""
+        codes, uniques = pd.factorize(np.asarray(products, dtype=object))
+        # Map each distinct SKU once, then broadcast
+        unique_hsn = np.array([self.hsn_index.get(self.hsn_for(sku), -1) for sku in uniques], dtype=np.int64)
+        hsn = unique_hsn[codes] if len(uniques) else np.zeros(len(codes), dtype=np.int64)
+        hsn[codes < 0] = -1
+        seconds = pd.to_datetime(dates).values.astype('datetime64[s]').astype(np.int64)
+        query = hsn * _HSN_SPAN + (seconds - _EPOCH)
+        pos = np.searchsorted(self.keys, query, side='right') - 1
+        found = (pos >= 0) & (hsn >= 0)
+        found[found] &= self.key_hsn[pos[found]] == hsn[found]
+        rates = np.full(len(query), -1, dtype=np.int64)
+        rates[found] = self.key_rates[pos[found]]
+        return hsn, rates
+
+    def hsn_names(self, hsn):
+        # Index -1 (no HSN code) picks the trailing None
+        return np.array(self.hsn_codes + [None], dtype=object)[hsn]
+
+
+class GSTEngine:
+    """Compiled slab table: SKU -> HSN code -> rate versions."""
+
+    def __init__(self, slabs_path=None):
+        self.slabs_path = slabs_path or default_slabs_path()
+        self.lock = threading.Lock()
+        self.mtime = None
+        self._load()
+
+    def _load(self):
+        changes = {}
+        if os.path.exists(self.slabs_path):
+            with open(self.slabs_path, "r", encoding="utf-8") as f:
+                changes = json.load(f)
+            self.mtime = os.stat(self.slabs_path).st_mtime_ns
+        self.changes = {"hsn": dict(changes.get("hsn", {})), "slabs": {k: list(v) for k, v in changes.get("slabs", {}).items()}}
+        sku_hsn = {sku: DEFAULT_CATEGORY_HSN[category] for sku, category in product_categories.items()}
+        sku_hsn.update(self.changes["hsn"])
+        versions = {hsn: {BASE_EFFECTIVE_FROM: rate} for hsn, rate in DEFAULT_SLABS.items()}
+        for hsn, slabs in self.changes["slabs"].items():
+            for effective_from, rate_bp in slabs:
+                versions.setdefault(hsn, {})[effective_from] = int(rate_bp)
+        self.slabs = _Slabs(sku_hsn, versions)
+
+    def refresh(self):
+        """Reload the table if another process has changed the file."""
+        if os.path.exists(self.slabs_path) and os.stat(self.slabs_path).st_mtime_ns != self.mtime:
+            with self.lock:
+                self._load()
+
+    def hsn_for(self, sku):
+        return self.slabs.hsn_for(sku)
+
+    def rate_bp(self, sku, when=None):
+        """Return the rate in basis points for sku at when, or None if its HSN code has no slab yet."""
+        return self.slabs.rate_bp(sku, _timestamp(when))
+
+    def rates_bp(self, products, dates):
+        """
+        Look up the rate of many line items at once.
+
+        Args:
+            products (array-like): SKU per line
+            dates (array-like): sale time per line (anything pd.to_datetime accepts)
+
+        Returns:
+            np.ndarray: rate in basis points per line; -1 where no slab applies
+        """
+        return self.slabs.lookup(products, dates)[1]
+
+    def category_taxes(self, lines, discounts=None, when=None):
+        """
+        Tax one cart line by line in paise and total it per category.
+
+        Args:
+            lines (iterable): (sku, quantity, unit price) per line
+            discounts (dict, optional): PromotionEngine.evaluate result; each line is taxed on its
+                price less its own discount and its share of its category's coupon
+            when (datetime, optional): moment of sale. If None, now.
+
+        Returns:
+            dict: {category key: tax in rupees}
+        """
+        when = _timestamp(when)
+        slabs = self.slabs
+        taxes = dict.fromkeys(CATEGORY_NAMES, 0)
+        keys = {category: key for key, category in CATEGORY_NAMES.items()}
+        for sku, _, net in net_line_paise(lines, discounts):
+            rate = slabs.rate_bp(sku, when)
+            if rate is None:
+                raise KeyError(f"No GST slab for {sku} (HSN {slabs.hsn_for(sku)}) at {when}")
+            key = keys.get(product_categories.get(sku))
+            if key is not None:
+                taxes[key] += int(tax_paise(net, rate))
+        return {key: tax / 100 for key, tax in taxes.items()}
+
+    @staticmethod
+    def _taxed(slabs, line_items, date_column, product_column, taxable_column):
+        """Return HSN index, rate, taxable paise and tax paise arrays for line items."""
+        hsn, rates = slabs.lookup(line_items[product_column].to_numpy(), line_items[date_column].to_numpy())
+        taxable = to_paise(line_items[taxable_column].to_numpy())
+        tax = np.where(rates >= 0, tax_paise(taxable, np.maximum(rates, 0)), 0)
+        return hsn, rates, taxable, tax
+
+    def tax_frame(self, line_items, date_column='Date', product_column='Product', taxable_column='Total'):
+        """
+        Add HSN, Rate (basis points), Taxable and Tax (paise) columns to line items, vectorized.
+
+        Lines without a slab get Rate -1 and no tax.
+        """
+        # One version of the table for both the lookup and the HSN names
+        slabs = self.slabs
+        hsn, rates, taxable, tax = self._taxed(slabs, line_items, date_column, product_column, taxable_column)
+        return line_items.assign(HSN=slabs.hsn_names(hsn), Rate=rates, Taxable=taxable, Tax=tax)
+
+    def tax_summary(self, line_items, by_day=True, date_column='Date', product_column='Product', taxable_column='Total'):
+        """
+        Summarize taxable value and tax per HSN code and rate (and day), in rupees.
+
+        Line item Totals are net of their promotion Discount (line offer and coupon
+        share), so each line is taxed on the same paise as on its receipt.
+
+        CGST and SGST are the two halves of the tax, the odd paise going to SGST.
+        """
+        columns = (['Day'] if by_day else []) + ['HSN', 'Rate %', 'Lines', 'Taxable Value', 'CGST', 'SGST', 'Total Tax']
+        if line_items.empty:
+            return pd.DataFrame(columns=columns)
+        slabs = self.slabs
+        hsn, rates, taxable, tax = self._taxed(slabs, line_items, date_column, product_column, taxable_column)
+        # Group on integer codes only; names are attached to the few summary rows afterwards
+        taxed = pd.DataFrame({'_hsn': hsn, 'Rate': rates, 'Taxable': taxable, 'Tax': tax})
+        keys = ['_hsn', 'Rate']
+        if by_day:
+            taxed['Day'] = pd.to_datetime(line_items[date_column]).to_numpy().astype('datetime64[D]')
+            keys = ['Day'] + keys
+        summary = taxed.groupby(keys, sort=True).agg(
+            Lines=('Tax', 'size'), Taxable=('Taxable', 'sum'), Tax=('Tax', 'sum')
+        ).reset_index()
+        cgst = summary['Tax'] // 2
+        summary = summary.assign(**{
+            'HSN': slabs.hsn_names(summary['_hsn'].to_numpy()),
+            'Rate %': summary['Rate'].where(summary['Rate'] >= 0) / 100,
+            'Taxable Value': summary['Taxable'] / 100,
+            'CGST': cgst / 100,
+            'SGST': (summary['Tax'] - cgst) / 100,
+            'Total Tax': summary['Tax'] / 100
+        })
+        return summary[columns]
+
+    def set_rate(self, hsn, rate_percent, effective_from=None):
+        """Record a new slab rate for an HSN code from effective_from (default: now)."""
+        with self.lock:
+            self.changes["slabs"].setdefault(hsn, []).append([_timestamp(effective_from), int(round(rate_percent * 100))])
+            self._save()
+
+    def set_hsn(self, sku, hsn):
+        """Assign an HSN code to a SKU."""
+        with self.lock:
+            self.changes["hsn"][sku] = hsn
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.slabs_path)), exist_ok=True)
+        tmp_path = f"{self.slabs_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.changes, f, indent=2)
+        os.replace(tmp_path, self.slabs_path)
+        self._load()
+
+
+def net_line_paise(lines, discounts=None):
+    """
+    Split a cart's promotion discounts over its lines in integer paise.
+
+    Each line loses its own discount and a share of its category's coupon, so
+    the nets are exactly what the receipt taxes.
+
+    Args:
+        lines (iterable): (sku, quantity, unit price) per line
+        discounts (dict, optional): PromotionEngine.evaluate result
+
+    Returns:
+        list: (sku, gross paise, net paise) per line, in the order given
+    """
+    lines = [(sku, int(to_paise(price)) * int(qty)) for sku, qty, price in lines]
+    nets = []
+    by_category = {}
+    for i, (sku, gross) in enumerate(lines):
+        line_discount = int(to_paise(discounts["lines"].get(sku, 0))) if discounts else 0
+        nets.append(gross - line_discount)
+        by_category.setdefault(product_categories.get(sku), []).append((i, line_discount))
+    if discounts:
+        for category, entries in by_category.items():
+            # Whatever the category discount holds beyond its lines' own is the coupon share
+            coupon = int(to_paise(discounts["categories"].get(category, 0))) - sum(d for _, d in entries)
+            shared = _allocate([nets[i] for i, _ in entries], max(coupon, 0), [lines[i][0] for i, _ in entries])
+            for (i, _), net in zip(entries, shared):
+                nets[i] = net
+    return [(sku, gross, net) for (sku, gross), net in zip(lines, nets)]
+
+
+def _allocate(amounts, total, keys):
+    """
+    Subtract total from amounts in proportion to them, in whole paise (largest remainder).
+
+    Equal remainders go in order of keys (the SKUs), so the split does not depend on line order.
+    """
+    base = sum(amounts)
+    if not total or not base:
+        return amounts
+    shares = [total * amount // base for amount in amounts]
+    remainders = sorted(range(len(amounts)), key=lambda i: (-(total * amounts[i] % base), keys[i]))
+    for i in remainders[:total - sum(shares)]:
+        shares[i] += 1
+    return [amount - share for amount, share in zip(amounts, shares)]
+
+
+def get_gst_engine(slabs_path=None):
+    """Return the process-wide engine for slabs_path, reloading it if the file changed."""
+    slabs_path = slabs_path or default_slabs_path()
+    with _engines_lock:
+        engine = _engines.get(slabs_path)
+        if engine is None:
+            engine = _engines[slabs_path] = GSTEngine(slabs_path)
+    engine.refresh()
+    return engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GST summaries over the ledger.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary = subparsers.add_parser("summary", help="Tax per HSN code and rate for a day or a range")
+    summary.add_argument("--date", default=None, help="Day to summarize, YYYY-MM-DD (default: today)")
+    summary.add_argument("--end", default=None, help="Last day of a range starting at --date")
+    summary.add_argument("--ledger", default=None, help="Ledger database (default: data/ledger.db)")
+    bench = subparsers.add_parser("bench", help="Time the vectorized summary on synthetic line items")
+    bench.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    engine = get_gst_engine()
+    if args.command == "bench":
+        rng = np.random.default_rng(0)
+        skus = np.array(sorted(product_categories), dtype=object)
+        line_items = pd.DataFrame({
+            'Date': pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 90 * 86400, args.rows), unit='s'),
+            'Product': skus[rng.integers(0, len(skus), args.rows)],
+            'Total': rng.integers(1, 50, args.rows) * 10.0
+        })
+        start = time.perf_counter()
+        result = engine.tax_summary(line_items)
+        print(f"{args.rows} lines -> {len(result)} summary rows in {time.perf_counter() - start:.2f}s")
+        return 0
+
+    from .ledger import read_line_items
+    first = pd.Timestamp(args.date or datetime.now().date())
+    last = pd.Timestamp(args.end) if args.end else first
+    line_items = read_line_items(args.ledger)
+    line_items = line_items[(line_items['Date'] >= first) & (line_items['Date'] < last + pd.Timedelta(days=1))]
+    print(engine.tax_summary(line_items, by_day=args.end is not None).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,325 @@
+import argparse
+import csv
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from .data import prices
+from .file_lock import file_lock
+
+# Units on hand at or below which a SKU is flagged for reordering
+DEFAULT_REORDER_LEVEL = 10
+
+# Deltas kept in the log before it is folded into a new snapshot
+COMPACT_AFTER = 10000
+
+# Bill numbers remembered so saving and exporting a bill decrements stock once
+RECENT_SALES = 5000
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def default_stock_dir():
+    """Return the directory holding the stock snapshot and delta log, data/stock."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'stock')
+
+
+class StockLedger:
+    """
+    Stock on hand per SKU, kept as a snapshot plus an append-only delta log.
+
+    Every change appends one line to stock_deltas.jsonl; loading reads the
+    snapshot and replays only the deltas written after it. Lookups and updates
+    are O(1) per SKU.
+
+    Several processes can share a stock directory. Appends and compaction hold
+    stock.lock, and each process first replays the deltas the others appended
+    since it last looked, so sequence numbers stay in order and no delta is lost.
+
+    SKUs start untracked at 0 units and raise no reorder alert until they are
+    counted (import_counts), received or given a reorder level.
+    """
+
+    def __init__(self, stock_dir=None):
+        self.stock_dir = stock_dir or default_stock_dir()
+        self.snapshot_path = os.path.join(self.stock_dir, "stock_snapshot.json")
+        self.log_path = os.path.join(self.stock_dir, "stock_deltas.jsonl")
+        self.lock_path = os.path.join(self.stock_dir, "stock.lock")
+        self.lock = threading.Lock()
+        os.makedirs(self.stock_dir, exist_ok=True)
+        with self.lock, file_lock(self.lock_path):
+            self._load()
+
+    def _load(self):
+        self.on_hand_by_sku = {sku: 0 for sku in prices}
+        self.reorder_levels = {}
+        self.tracked = set()
+        self.alerts = set()
+        self.recent_sales = deque(maxlen=RECENT_SALES)
+        self.seq = 0
+        self.log_entries = 0
+        # Bytes of the delta log replayed so far, and which log file they belong to
+        self.log_offset = 0
+        self.log_id = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self.seq = snapshot["seq"]
+            self.on_hand_by_sku.update(snapshot["on_hand"])
+            self.reorder_levels.update(snapshot["reorder_levels"])
+            self.recent_sales.extend(snapshot["recent_sales"])
+            self.tracked.update(snapshot["tracked"])
+        self._catch_up()
+        for sku in self.on_hand_by_sku:
+            self._refresh_alert(sku)
+
+    def _catch_up(self):
+        """Replay deltas appended to the log since the last read; call with stock.lock held."""
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return
+        log_id = (stat.st_dev, stat.st_ino)
+        if self.log_id is not None and (log_id != self.log_id or stat.st_size < self.log_offset):
+            # Another process compacted the log; start again from its snapshot
+            self._load()
+            return
+        self.log_id = log_id
+        if stat.st_size == self.log_offset:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self.log_offset)
+            data = f.read()
+        # Only whole lines; a partial last line is either being written or torn by a crash
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn line from a crash mid-write
+                continue
+            self.log_entries += 1
+            if entry["seq"] <= self.seq:
+                continue
+            self._apply(entry)
+            self._refresh_alert(entry["sku"])
+            self.seq = entry["seq"]
+        self.log_offset += end
+
+    def _apply(self, entry):
+        if entry["kind"] == "level":
+            self.reorder_levels[entry["sku"]] = entry["value"]
+        elif entry["kind"] == "count":
+            self.on_hand_by_sku[entry["sku"]] = entry["value"]
+        else:
+            self.on_hand_by_sku[entry["sku"]] = self.on_hand_by_sku.get(entry["sku"], 0) + entry["value"]
+        if entry["kind"] != "sale":
+            self.tracked.add(entry["sku"])
+        if entry.get("ref") and entry["kind"] == "sale":
+            self.recent_sales.append(entry["ref"])
+
+    def _refresh_alert(self, sku):
+        if sku in self.tracked and self.on_hand_by_sku.get(sku, 0) <= self.reorder_level(sku):
+            self.alerts.add(sku)
+        else:
+            self.alerts.discard(sku)
+
+    @contextmanager
+    def _transaction(self):
+        """Hold both locks with this process caught up on the shared log."""
+        with self.lock, file_lock(self.lock_path):
+            self._catch_up()
+            yield
+
+    def _commit(self, entries):
+        """Apply entries and append them to the log as one durable write; call inside _transaction."""
+        lines = []
+        for entry in entries:
+            self.seq += 1
+            entry = {**entry, "seq": self.seq, "at": datetime.now().isoformat(timespec="seconds")}
+            self._apply(entry)
+            self._refresh_alert(entry["sku"])
+            lines.append(json.dumps(entry))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        with open(self.log_path, "ab") as f:
+            # Bytes past the replayed offset can only be a torn line; end it so it is skipped on its own
+            if f.tell() > self.log_offset:
+                data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            self.log_offset = f.tell()
+        stat = os.stat(self.log_path)
+        self.log_id = (stat.st_dev, stat.st_ino)
+        self.log_entries += len(lines)
+        if self.log_entries >= COMPACT_AFTER:
+            self._compact()
+
+    def refresh(self):
+        """Pick up stock changes made by other processes."""
+        with self._transaction():
+            pass
+
+    def on_hand(self, sku):
+        return self.on_hand_by_sku.get(sku, 0)
+
+    def reorder_level(self, sku):
+        return self.reorder_levels.get(sku, DEFAULT_REORDER_LEVEL)
+
+    def record_sale(self, items, bill_number=None):
+        """
+        Decrement stock for every SKU sold on a bill.
+
+        Args:
+            items (dict): {sku: quantity}; zero quantities are ignored
+            bill_number (str, optional): bill reference; a bill already recorded is skipped
+
+        Returns:
+            bool: True if stock was decremented
+        """
+        return self.record_sales([(bill_number, items)]) > 0
+
+    def record_sales(self, sales):
+        """Decrement stock for many (bill_number, items) sales with a single log write."""
+        with self._transaction():
+            entries = []
+            recorded = 0
+            seen = set(self.recent_sales)
+            for bill_number, items in sales:
+                if bill_number and bill_number in seen:
+                    continue
+                bill_entries = [
+                    {"kind": "sale", "sku": sku, "value": -int(qty), "ref": bill_number}
+                    for sku, qty in items.items() if qty > 0
+                ]
+                if bill_entries:
+                    entries.extend(bill_entries)
+                    recorded += 1
+                    seen.add(bill_number)
+            if entries:
+                self._commit(entries)
+            return recorded
+
+    def receive(self, sku, quantity, reference=None):
+        """Add received units to a SKU."""
+        with self._transaction():
+            self._commit([{"kind": "receipt", "sku": sku, "value": int(quantity), "ref": reference}])
+
+    def set_reorder_level(self, sku, level):
+        with self._transaction():
+            self._commit([{"kind": "level", "sku": sku, "value": int(level)}])
+
+    def import_counts(self, counts, reference=None):
+        """
+        Set the units on hand of SKUs from a stock count, e.g. the opening stock.
+
+        Args:
+            counts (dict): {sku: units on hand}
+            reference (str, optional): where the count came from
+
+        Returns:
+            int: number of SKUs counted
+        """
+        with self._transaction():
+            entries = [{"kind": "count", "sku": sku, "value": int(qty), "ref": reference} for sku, qty in counts.items()]
+            if entries:
+                self._commit(entries)
+            return len(entries)
+
+    def reorder_alerts(self):
+        """Return [(sku, on hand, reorder level)] for SKUs at or below their reorder level."""
+        self.refresh()
+        return sorted((sku, self.on_hand(sku), self.reorder_level(sku)) for sku in self.alerts)
+
+    def stock_table(self):
+        """Return a row per SKU with on-hand units, reorder level and whether to reorder."""
+        self.refresh()
+        return [
+            {
+                "Product": sku,
+                "On Hand": qty,
+                "Reorder Level": self.reorder_level(sku),
+                "Tracked": sku in self.tracked,
+                "Reorder": sku in self.alerts
+            }
+            for sku, qty in sorted(self.on_hand_by_sku.items())
+        ]
+
+    def compact(self):
+        """Write a new snapshot and start an empty delta log."""
+        with self._transaction():
+            self._compact()
+
+    def _compact(self):
+        with open(f"{self.snapshot_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "seq": self.seq,
+                "on_hand": self.on_hand_by_sku,
+                "reorder_levels": self.reorder_levels,
+                "tracked": sorted(self.tracked),
+                "recent_sales": list(self.recent_sales)
+            }, f)
+        os.replace(f"{self.snapshot_path}.tmp", self.snapshot_path)
+        # A new log file, so other processes see the old one is gone; replay skips
+        # deltas up to seq even if the replacement is lost
+        open(f"{self.log_path}.tmp", "w", encoding="utf-8").close()
+        os.replace(f"{self.log_path}.tmp", self.log_path)
+        stat = os.stat(self.log_path)
+        self.log_id = (stat.st_dev, stat.st_ino)
+        self.log_offset = 0
+        self.log_entries = 0
+
+
+def read_counts_from(f):
+    """Read a stock count CSV with Product and On Hand columns from a text file into {sku: units}."""
+    return {row["Product"].strip(): int(float(row["On Hand"])) for row in csv.DictReader(f) if row.get("Product")}
+
+
+def read_counts(csv_path):
+    """Read a stock count CSV file into {sku: units}."""
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        return read_counts_from(f)
+
+
+def sales_from_rows(rows):
+    """Group bill rows (as built by build_bill_rows) into [(bill_number, {sku: quantity})]."""
+    sales = {}
+    for row in rows:
+        items = sales.setdefault(row['Bill Number'], {})
+        items[row['Product']] = items.get(row['Product'], 0) + int(row['Quantity'])
+    return list(sales.items())
+
+
+def get_stock_ledger(stock_dir=None):
+    """Return the process-wide ledger for stock_dir, loading it on first use."""
+    stock_dir = stock_dir or default_stock_dir()
+    with _ledgers_lock:
+        if stock_dir not in _ledgers:
+            _ledgers[stock_dir] = StockLedger(stock_dir)
+        return _ledgers[stock_dir]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stock on hand per SKU.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    counts = subparsers.add_parser("import-counts", help="Set units on hand from a stock count CSV (Product, On Hand)")
+    counts.add_argument("csv_path")
+    counts.add_argument("--stock-dir", default=None, help="Stock directory (default: data/stock)")
+    args = parser.parse_args(argv)
+
+    try:
+        skus = read_counts(args.csv_path)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error reading stock count: {e}")
+        return 1
+    counted = get_stock_ledger(args.stock_dir).import_counts(skus, reference=os.path.basename(args.csv_path))
+    print(f"Counted {counted} products")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+# Columns of a bill line item, as written by export_bill_to_excel; Total is net of the promotion Discount
+LEDGER_COLUMNS = ['Date', 'Bill Number', 'Customer Name', 'Phone', 'Category', 'Product', 'Quantity', 'Price', 'Discount', 'Total']
+
+# Ledger column name -> SQLite column name
+SQL_COLUMNS = {
+    'Date': 'date',
+    'Bill Number': 'bill_number',
+    'Customer Name': 'customer_name',
+    'Phone': 'phone',
+    'Category': 'category',
+    'Product': 'product',
+    'Quantity': 'quantity',
+    'Price': 'price',
+    'Discount': 'discount',
+    'Total': 'total'
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bills (
+    bill_number TEXT PRIMARY KEY,
+    date TEXT,
+    customer_name TEXT,
+    phone TEXT,
+    total REAL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS line_items (
+    id INTEGER PRIMARY KEY,
+    bill_number TEXT NOT NULL,
+    date TEXT,
+    customer_name TEXT,
+    phone TEXT,
+    category TEXT,
+    product TEXT,
+    quantity INTEGER,
+    price REAL,
+    discount REAL,
+    total REAL
+);
+CREATE INDEX IF NOT EXISTS idx_line_items_date ON line_items (date);
+CREATE INDEX IF NOT EXISTS idx_line_items_category_product ON line_items (category, product);
+CREATE INDEX IF NOT EXISTS idx_line_items_bill ON line_items (bill_number);
+"""
+
+_write_lock = threading.Lock()
+
+
+def default_ledger_path():
+    """Return the default ledger location, data/ledger.db next to the master file."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'ledger.db')
+
+
+def connect(ledger_path=None):
+    """Open the ledger database, creating the schema if needed."""
+    ledger_path = ledger_path or default_ledger_path()
+    os.makedirs(os.path.dirname(os.path.abspath(ledger_path)), exist_ok=True)
+    conn = sqlite3.connect(ledger_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def append_bills(bill_data, source=None, ledger_path=None):
+    """
+    Append line items to the ledger, skipping bills whose number is already stored.
+
+    Args:
+        bill_data (pd.DataFrame): line items with the LEDGER_COLUMNS columns
+        source (str, optional): where the rows came from (file name, terminal, ...)
+        ledger_path (str, optional): ledger database path. If None, the default path is used.
+
+    Returns:
+        int: number of new bills stored
+    """
+    if bill_data is None or bill_data.empty:
+        return 0
+
+    rows = bill_data.reindex(columns=LEDGER_COLUMNS).copy()
+    rows['Date'] = pd.to_datetime(rows['Date'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
+    rows = rows.astype(object).where(rows.notna(), None)
+
+    # One header row per bill; the bill total is the sum of its line totals
+    bills = rows.groupby('Bill Number', sort=False).agg(
+        date=('Date', 'first'),
+        customer_name=('Customer Name', 'first'),
+        phone=('Phone', 'first'),
+        total=('Total', 'sum')
+    ).reset_index()
+
+    with _write_lock:
+        conn = connect(ledger_path)
+        try:
+            with conn:
+                existing = set()
+                numbers = bills['Bill Number'].tolist()
+                # Look the numbers up in chunks to stay under SQLite's variable limit
+                for i in range(0, len(numbers), 500):
+                    chunk = numbers[i:i + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    existing.update(
+                        row[0] for row in conn.execute(
+                            f"SELECT bill_number FROM bills WHERE bill_number IN ({placeholders})", chunk
+                        )
+                    )
+                new_bills = bills[~bills['Bill Number'].isin(existing)]
+                if new_bills.empty:
+                    return 0
+                conn.executemany(
+                    "INSERT INTO bills (bill_number, date, customer_name, phone, total, source) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(*row, source) for row in new_bills.itertuples(index=False, name=None)]
+                )
+                new_rows = rows[rows['Bill Number'].isin(set(new_bills['Bill Number']))]
+                conn.executemany(
+                    "INSERT INTO line_items (date, bill_number, customer_name, phone, category, product, quantity, price, discount, total) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    new_rows.itertuples(index=False, name=None)
+                )
+                return len(new_bills)
+        finally:
+            conn.close()
+
+
+def read_line_items(ledger_path=None):
+    """Read every line item from the ledger as a DataFrame with the LEDGER_COLUMNS names."""
+    conn = connect(ledger_path)
+    try:
+        select = ", ".join(f'{sql} AS "{name}"' for name, sql in SQL_COLUMNS.items())
+        df = pd.read_sql_query(f"SELECT {select} FROM line_items ORDER BY id", conn)
+    finally:
+        conn.close()
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    return df
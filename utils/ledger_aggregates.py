@@ -0,0 +1,416 @@
+"""
+Out-of-core aggregation of the ledger for the analytics charts and reports.
+
+The file-based analytics concatenate every bill file into one DataFrame and
+derive Week, Month, MonthName, Year and Day columns for every line before
+grouping, so peak memory is several times the raw data. This path reads the
+ledger's line items in id order, BILLING_AGG_CHUNK_ROWS at a time and only the
+columns it needs. It folds each chunk into partial aggregates:
+    - exact Total, Quantity and line counts per (day, category, product)
+    - exact bill counts per (day, category) and per day
+    - a t-digest of bill values per (day, category) and per day, for the median and p90 bill
+Partial sums are merged whenever they pass a quarter of the memory ceiling
+(BILLING_AGG_MEMORY_MB). Chunks shrink when a single chunk would take more than
+that, so memory stays bounded whatever the size of the ledger. A bill's lines
+are stored together, and a chunk that ends part-way through a bill carries
+the rest into the next chunk. Refreshing folds in only the rows appended since.
+
+Results have the same shape as the MongoDB pushdown in mongo_storage
+(sales_summary, sales_by, sales_over_time), so the charts can read either:
+    BILLING_ANALYTICS_SOURCE=ledger streamlit run streamlit_app.py
+    python -m utils.ledger_aggregates bench --rows 2000000
+"""
+import argparse
+import os
+import random
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from .data import prices as base_prices, product_categories
+from .ledger import append_bills, default_ledger_path, read_line_items
+from .sketches import ALL_CATEGORIES, TDigest
+from .sql_analytics import connect_readonly, filter_clause
+
+# Line items read per chunk, before any shrinking to fit the memory ceiling
+CHUNK_ROWS = int(os.environ.get("BILLING_AGG_CHUNK_ROWS", "200000"))
+
+# Memory ceiling in MB for one chunk plus the partial and merged aggregates
+MEMORY_MB = float(os.environ.get("BILLING_AGG_MEMORY_MB", "256"))
+
+# Smallest chunk the reader shrinks to
+MIN_CHUNK_ROWS = 1000
+
+KEYS = ['Day', 'Category', 'Product']
+
+_aggregates = {}
+_aggregates_lock = threading.Lock()
+
+
+class LedgerAggregates:
+    """Partial aggregates of the ledger's line items, folded in chunk by chunk."""
+
+    def __init__(self, ledger_path=None, chunk_rows=None, memory_mb=None):
+        self.ledger_path = ledger_path or default_ledger_path()
+        self.chunk_rows = chunk_rows or CHUNK_ROWS
+        self.memory_limit = int((memory_mb or MEMORY_MB) * 1024 * 1024)
+        self.peak_chunk_bytes = 0
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.last_id = 0
+        self.rows = 0
+        self.sums = None
+        self.partials = []
+        self.partial_bytes = 0
+        self.bill_counts = {}
+        self.digests = {}
+        self.carry = None
+
+    def refresh(self):
+        """Fold in the line items appended since the last refresh; returns the number of rows read."""
+        if not os.path.exists(self.ledger_path):
+            return 0
+        read = 0
+        with self.lock:
+            conn = connect_readonly(self.ledger_path)
+            try:
+                while True:
+                    # Keyset pagination: each chunk starts after the last id already folded
+                    chunk = pd.read_sql_query(
+                        "SELECT id, substr(date, 1, 10) AS Day, bill_number, category AS Category, "
+                        "product AS Product, quantity AS Quantity, total AS Total "
+                        "FROM line_items WHERE id > ? ORDER BY id LIMIT ?",
+                        conn, params=(self.last_id, self.chunk_rows)
+                    )
+                    if chunk.empty:
+                        break
+                    read += len(chunk)
+                    self.last_id = int(chunk['id'].iat[-1])
+                    self._fold(chunk)
+                # The last bill read is complete: bills are written in one transaction
+                if self.carry is not None:
+                    self._add(self.carry)
+                    self.carry = None
+                self._compact()
+            except BaseException:
+                # A half-folded refresh cannot be resumed; start over on the next one
+                self._reset()
+                raise
+            finally:
+                conn.close()
+            self.rows += read
+        return read
+
+    def _fold(self, chunk):
+        chunk_bytes = int(chunk.memory_usage(deep=True).sum())
+        self.peak_chunk_bytes = max(self.peak_chunk_bytes, chunk_bytes)
+        # Keep a single chunk within a quarter of the ceiling
+        if chunk_bytes > self.memory_limit // 4 and self.chunk_rows > MIN_CHUNK_ROWS:
+            self.chunk_rows = max(MIN_CHUNK_ROWS, int(self.chunk_rows * (self.memory_limit // 4) / chunk_bytes))
+
+        if self.carry is not None:
+            chunk = pd.concat([self.carry, chunk], ignore_index=True)
+        # Hold back the bill the chunk ends in; its remaining lines may be in the next chunk
+        tail = (chunk['bill_number'] == chunk['bill_number'].iat[-1]).to_numpy()
+        self.carry = chunk[tail]
+        self._add(chunk[~tail])
+
+    def _add(self, lines):
+        if lines.empty:
+            return
+        lines = lines.assign(
+            Day=pd.to_datetime(lines['Day'], format='%Y-%m-%d', errors='coerce'),
+            Category=lines['Category'].astype(str).str.title()
+        ).dropna(subset=['Day'])
+
+        partial = lines.groupby(KEYS, sort=False).agg(
+            Total=('Total', 'sum'), Quantity=('Quantity', 'sum'), Lines=('Total', 'size')
+        )
+        self.partials.append(partial)
+        self.partial_bytes += int(partial.memory_usage(deep=True).sum())
+        if self.partial_bytes > self.memory_limit // 4:
+            self._compact()
+
+        # Bill values per day and category, and per day over all categories
+        per_category = lines.groupby(['Day', 'Category', 'bill_number'], sort=False)['Total'].sum()
+        for (day, category), values in per_category.groupby(level=[0, 1], sort=False):
+            self._add_bills((day, category), values.to_numpy())
+        per_bill = lines.groupby(['Day', 'bill_number'], sort=False)['Total'].sum()
+        for day, values in per_bill.groupby(level=0, sort=False):
+            self._add_bills((day, ALL_CATEGORIES), values.to_numpy())
+
+    def _add_bills(self, key, values):
+        self.bill_counts[key] = self.bill_counts.get(key, 0) + len(values)
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = TDigest()
+        digest.add_many(values)
+
+    def _compact(self):
+        """Merge the partial sums into the running sums and check them against the ceiling."""
+        if not self.partials:
+            return
+        frames = self.partials if self.sums is None else [self.sums, *self.partials]
+        self.sums = pd.concat(frames).groupby(level=[0, 1, 2], sort=False).sum()
+        self.partials = []
+        self.partial_bytes = 0
+        size = int(self.sums.memory_usage(deep=True).sum())
+        if size > self.memory_limit // 2:
+            raise MemoryError(
+                f"Ledger aggregates take {size / 2 ** 20:.1f} MB, over half of the "
+                f"{self.memory_limit / 2 ** 20:.1f} MB ceiling (BILLING_AGG_MEMORY_MB)"
+            )
+
+    def is_empty(self):
+        return self.sums is None or self.sums.empty
+
+    def date_range(self):
+        """Return the first and last sale dates as datetime.date."""
+        days = self.sums.index.get_level_values('Day')
+        return days.min().date(), days.max().date()
+
+    def categories(self):
+        return sorted(self.sums.index.get_level_values('Category').unique())
+
+    def products(self, category=None):
+        sums = self.sums
+        if category and category != 'All':
+            sums = sums[sums.index.get_level_values('Category') == category]
+        return sorted(sums.index.get_level_values('Product').unique())
+
+    def _filtered(self, start_date=None, end_date=None, category=None, product=None):
+        """Return the (day, category, product) sums matching the analytics filters as columns."""
+        index = self.sums.index
+        mask = np.ones(len(index), dtype=bool)
+        days = index.get_level_values('Day')
+        if start_date is not None:
+            mask &= days >= pd.Timestamp(start_date)
+        if end_date is not None:
+            mask &= days <= pd.Timestamp(end_date)
+        if category and category != 'All':
+            mask &= index.get_level_values('Category') == category
+        if product and product != 'All':
+            mask &= index.get_level_values('Product') == product
+        return self.sums[mask].reset_index()
+
+    def sales_summary(self, start_date=None, end_date=None, category=None, product=None):
+        """
+        Return the Sales Summary metrics for the filtered line items.
+
+        Returns:
+            dict: total, quantity, average (per line item), bills, median_bill and p90_bill
+        """
+        rows = self._filtered(start_date, end_date, category, product)
+        lines = int(rows['Lines'].sum())
+        if not lines:
+            return {"total": 0.0, "quantity": 0, "average": 0.0, "bills": 0, "median_bill": 0.0, "p90_bill": 0.0}
+        summary = {
+            "total": float(rows['Total'].sum()),
+            "quantity": int(rows['Quantity'].sum()),
+            "average": float(rows['Total'].sum()) / lines
+        }
+        if product and product != 'All':
+            # Bill values are only kept per category; a single product is left to SQLite, which sorts on disk
+            summary.update(self._product_bills(start_date, end_date, category, product))
+            return summary
+
+        bucket = category if category and category != 'All' else ALL_CATEGORIES
+        start = pd.Timestamp(start_date) if start_date is not None else None
+        end = pd.Timestamp(end_date) if end_date is not None else None
+        # Digests grow during a refresh in another session
+        with self.lock:
+            keys = [
+                key for key in self.digests
+                if key[1] == bucket and (start is None or key[0] >= start) and (end is None or key[0] <= end)
+            ]
+            digest = TDigest.merged(self.digests[key] for key in keys)
+            summary["bills"] = sum(self.bill_counts[key] for key in keys)
+        summary["median_bill"] = digest.quantile(0.5)
+        summary["p90_bill"] = digest.quantile(0.9)
+        return summary
+
+    def _product_bills(self, start_date, end_date, category, product):
+        where, params = filter_clause(start_date, end_date, category, product)
+        per_bill = f"SELECT SUM(total) AS value FROM line_items{where} GROUP BY bill_number"
+        conn = connect_readonly(self.ledger_path)
+        try:
+            bills = conn.execute(f"SELECT COUNT(*) FROM ({per_bill})", params).fetchone()[0]
+            result = {"bills": bills}
+            # Nearest-rank percentiles, as the MongoDB pushdown computes them
+            for name, q in (("median_bill", 0.5), ("p90_bill", 0.9)):
+                rank = min(bills - 1, int(q * (bills - 1) + 0.5))
+                value = conn.execute(f"{per_bill} ORDER BY value LIMIT 1 OFFSET ?", [*params, max(rank, 0)]).fetchone()
+                result[name] = value[0] if value else 0.0
+        finally:
+            conn.close()
+        return result
+
+    def sales_by(self, field, start_date=None, end_date=None, category=None, product=None):
+        """
+        Return Total and Quantity per 'Category' or 'Product' for the filtered line items.
+
+        Returns:
+            pd.DataFrame: columns field, Total and Quantity
+        """
+        rows = self._filtered(start_date, end_date, category, product)
+        return rows.groupby(field)[['Total', 'Quantity']].sum().reset_index()
+
+    def sales_over_time(self, grouping="Day", start_date=None, end_date=None, category=None, product=None):
+        """
+        Return Total and Quantity per day, ISO week or month for the filtered line items.
+
+        Returns:
+            pd.DataFrame: Date (Day), Year/Week/Period (Week) or Month (Month) plus Total and Quantity
+        """
+        rows = self._filtered(start_date, end_date, category, product)
+        daily = rows.groupby('Day')[['Total', 'Quantity']].sum()
+        if grouping == "Day":
+            df = daily.reset_index().rename(columns={'Day': 'Date'})
+            df['Date'] = df['Date'].dt.date
+            return df
+        if grouping == "Week":
+            # Calendar year and ISO week, matching the pandas Year/Week columns
+            keys = [daily.index.year.rename('Year'), daily.index.isocalendar().week.astype(int).rename('Week')]
+            df = daily.groupby(keys).sum().reset_index()
+            df['Period'] = df['Year'].astype(str) + '-W' + df['Week'].astype(str)
+            return df
+        return daily.groupby(daily.index.strftime('%Y-%m').rename('Month')).sum().reset_index()
+
+    def sales_by_category_product(self, start_date=None, end_date=None, category=None, product=None):
+        """Return Total, Quantity and line count per (Category, Product) for the filtered line items."""
+        rows = self._filtered(start_date, end_date, category, product)
+        return rows.groupby(['Category', 'Product'])[['Total', 'Quantity', 'Lines']].sum().reset_index()
+
+    def monthly_sales(self, start_date=None, end_date=None, category=None, product=None):
+        """Return Total per calendar year and month name, as the Time Series report lists it."""
+        daily = self.sales_over_time("Day", start_date, end_date, category, product)
+        days = pd.to_datetime(daily['Date'])
+        return daily.groupby([days.dt.year.rename('Year'), days.dt.strftime('%B').rename('MonthName')])['Total'].sum().reset_index()
+
+
+def get_ledger_aggregates(ledger_path=None):
+    """Return the process-wide aggregates of a ledger, folding in any rows appended since the last call."""
+    ledger_path = ledger_path or default_ledger_path()
+    with _aggregates_lock:
+        aggregates = _aggregates.get(ledger_path)
+        if aggregates is None:
+            aggregates = _aggregates[ledger_path] = LedgerAggregates(ledger_path)
+    aggregates.refresh()
+    return aggregates
+
+
+def _synthetic_ledger(ledger_path, rows, seed=1):
+    """Fill a ledger with about `rows` random line items over two years, for benchmarks."""
+    rng = random.Random(seed)
+    skus = sorted(base_prices)
+    start = datetime(2024, 1, 1)
+    batch = []
+    written = 0
+    bill = 0
+    while written + len(batch) < rows:
+        when = start + timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+        for sku in rng.sample(skus, rng.randint(1, 6)):
+            qty = rng.randint(1, 5)
+            batch.append({
+                'Date': when, 'Bill Number': f"SYN{bill:09d}", 'Customer Name': f"Customer {rng.randint(1, 5000)}",
+                'Phone': "9000000000", 'Category': product_categories.get(sku, "Groceries"), 'Product': sku,
+                'Quantity': qty, 'Price': base_prices[sku], 'Total': qty * base_prices[sku]
+            })
+        bill += 1
+        if len(batch) >= 50000:
+            written += len(batch)
+            append_bills(pd.DataFrame(batch), source="bench", ledger_path=ledger_path)
+            batch = []
+    if batch:
+        append_bills(pd.DataFrame(batch), source="bench", ledger_path=ledger_path)
+
+
+def _in_memory_summary(ledger_path):
+    """The file-style path for comparison: one frame, derived columns, then group by."""
+    sales_data = read_line_items(ledger_path)
+    sales_data['Week'] = sales_data['Date'].dt.isocalendar().week
+    sales_data['Month'] = sales_data['Date'].dt.strftime('%Y-%m')
+    sales_data['MonthName'] = sales_data['Date'].dt.strftime('%B')
+    sales_data['Year'] = sales_data['Date'].dt.year
+    sales_data['Day'] = sales_data['Date'].dt.day_name()
+    bill_values = sales_data.groupby('Bill Number')['Total'].sum()
+    return {
+        "total": sales_data['Total'].sum(),
+        "bills": sales_data['Bill Number'].nunique(),
+        "median_bill": bill_values.median(),
+        "months": sales_data.groupby('Month')['Total'].sum()
+    }
+
+
+def _bench(rows, chunk_rows, memory_mb, ledger_path=None):
+    if ledger_path is None:
+        ledger_path = os.path.join(os.path.dirname(default_ledger_path()), f"bench_ledger_{rows}.db")
+        if not os.path.exists(ledger_path):
+            print(f"Writing {rows} synthetic line items to {ledger_path} ...")
+            _synthetic_ledger(ledger_path, rows)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    aggregates = LedgerAggregates(ledger_path, chunk_rows, memory_mb)
+    aggregates.refresh()
+    chunked = aggregates.sales_summary()
+    months = aggregates.sales_over_time("Month").set_index('Month')['Total']
+    chunked_seconds = time.perf_counter() - start
+    chunked_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    full = _in_memory_summary(ledger_path)
+    full_seconds = time.perf_counter() - start
+    full_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(f"{aggregates.rows} line items")
+    print(f"chunked:   {chunked_seconds:.2f}s, peak {chunked_peak / 2 ** 20:.0f} MB "
+          f"(chunks of {aggregates.chunk_rows} rows, largest {aggregates.peak_chunk_bytes / 2 ** 20:.1f} MB)")
+    print(f"in memory: {full_seconds:.2f}s, peak {full_peak / 2 ** 20:.0f} MB")
+    month_gap = float((months - full["months"]).abs().max())
+    print(f"total {chunked['total']:.2f} vs {full['total']:.2f}, bills {chunked['bills']} vs {full['bills']}, "
+          f"median bill {chunked['median_bill']:.2f} vs {full['median_bill']:.2f}, largest monthly difference {month_gap:.6f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate the ledger in bounded-memory chunks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary = subparsers.add_parser("summary", help="Print the sales summary and monthly totals of a ledger")
+    summary.add_argument("--ledger", default=None, help="Ledger database (default: data/ledger.db)")
+    bench = subparsers.add_parser("bench", help="Compare time and peak memory with the in-memory path")
+    bench.add_argument("--rows", type=int, default=1000000, help="Synthetic line items (ignored with --ledger)")
+    bench.add_argument("--ledger", default=None, help="Benchmark an existing ledger instead")
+    for sub in (summary, bench):
+        sub.add_argument("--chunk-rows", type=int, default=None)
+        sub.add_argument("--memory-mb", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        _bench(args.rows, args.chunk_rows, args.memory_mb, args.ledger)
+        return 0
+    aggregates = LedgerAggregates(args.ledger, args.chunk_rows, args.memory_mb)
+    try:
+        aggregates.refresh()
+    except MemoryError as e:
+        print(f"Error: {e}")
+        return 1
+    if aggregates.is_empty():
+        print("The ledger has no line items.")
+        return 1
+    for name, value in aggregates.sales_summary().items():
+        print(f"{name:<12}{value:>16.2f}")
+    print(aggregates.sales_over_time("Month").to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
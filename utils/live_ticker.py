@@ -0,0 +1,110 @@
+import os
+import sqlite3
+from collections import deque
+from datetime import date, datetime
+
+from .ledger import default_ledger_path
+
+# Line items read from the ledger per query while catching up
+POLL_CHUNK = 5000
+
+# Most recent bills shown on the ticker
+RECENT_BILLS = 10
+
+
+class SalesTicker:
+    """
+    Running totals for today, fed by the line items appended to the ledger.
+
+    The ticker remembers the rowid of the last line item it has read, so each poll
+    reads only the rows written since and adds them to the totals. The first poll of
+    a day reads today's rows through the date index.
+    """
+
+    def __init__(self, ledger_path=None):
+        self.ledger_path = ledger_path or default_ledger_path()
+        self.last_id = None
+        self.day = None
+        self._reset(date.today())
+
+    def _reset(self, day):
+        self.day = day
+        self.total = 0.0
+        self.quantity = 0
+        self.bill_numbers = set()
+        self.hourly = [0.0] * 24
+        self.recent_bills = deque(maxlen=RECENT_BILLS)
+        self.updated_at = None
+
+    def _add(self, bill_number, when, quantity, total):
+        total = total or 0.0
+        self.total += total
+        self.quantity += quantity or 0
+        self.hourly[int(when[11:13] or 0)] += total
+        if bill_number not in self.bill_numbers:
+            self.bill_numbers.add(bill_number)
+            self.recent_bills.appendleft({"Time": when[11:19], "Bill Number": bill_number, "Total": total})
+        elif self.recent_bills and self.recent_bills[0]["Bill Number"] == bill_number:
+            self.recent_bills[0]["Total"] += total
+
+    def poll(self):
+        """
+        Read the line items appended since the last poll and fold today's into the totals.
+
+        Returns:
+            int: number of new line items read
+        """
+        today = date.today()
+        if today != self.day:
+            # Keep last_id: rows read before midnight stay read, only the totals restart
+            self._reset(today)
+        if not os.path.exists(self.ledger_path):
+            return 0
+
+        day_start = today.strftime('%Y-%m-%d')
+        read = 0
+        conn = sqlite3.connect(f"file:{os.path.abspath(self.ledger_path)}?mode=ro", uri=True, timeout=30)
+        try:
+            if self.last_id is None:
+                # First poll: today's rows by date, then follow the rowid from the newest row
+                self.last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM line_items").fetchone()[0]
+                for row in conn.execute(
+                    "SELECT id, bill_number, date, quantity, total FROM line_items "
+                    "WHERE date >= ? AND id <= ? ORDER BY id",
+                    (day_start, self.last_id)
+                ):
+                    self._fold(row, day_start)
+                    read += 1
+            else:
+                while True:
+                    rows = conn.execute(
+                        "SELECT id, bill_number, date, quantity, total FROM line_items "
+                        "WHERE id > ? ORDER BY id LIMIT ?",
+                        (self.last_id, POLL_CHUNK)
+                    ).fetchall()
+                    if not rows:
+                        break
+                    for row in rows:
+                        self._fold(row, day_start)
+                    self.last_id = rows[-1][0]
+                    read += len(rows)
+        finally:
+            conn.close()
+        self.updated_at = datetime.now()
+        return read
+
+    def _fold(self, row, day_start):
+        _, bill_number, when, quantity, total = row
+        # Late-arriving history (e.g. a migration) advances the offset without touching today
+        if when and when[:10] == day_start:
+            self._add(bill_number, when, quantity, total)
+
+    def summary(self):
+        """Return today's totals as a dict for the ticker metrics."""
+        bills = len(self.bill_numbers)
+        return {
+            "total": self.total,
+            "quantity": self.quantity,
+            "bills": bills,
+            "average_bill": self.total / bills if bills else 0.0
+        }
@@ -0,0 +1,414 @@
+"""
+Concurrent cashier load test against a running Streamlit server.
+
+Each simulated cashier opens its own session on the app's websocket, as a
+browser tab does, and repeats a billing flow: enter the customer, set a few
+quantities, calculate, save, export, look the bill up in the search sidebar
+and start a new bill. Every step is one rerun. Its latency runs from sending
+the widget change to the end of the rerun it triggers. Widgets inside a
+fragment send their fragment id, as the browser does, so those steps are
+measured as fragment reruns.
+
+For each number of cashiers a fresh copy of the app, without bills/ and
+data/, is started with `streamlit run` on a free port. Runs start cold and
+never touch the real bills:
+    python -m utils.load_test --sessions 1,2,4,8 --bills 5
+
+Afterwards the stored bills are checked for data loss:
+- every saved bill text must match the preview its cashier calculated;
+- every exported workbook must hold the quantities entered;
+- every exported bill must reach the ledger once the event consumers catch up;
+- no two bills may share a number.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+from .data import cosmetic_products, drink_products, grocery_products
+from .ledger import read_line_items
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Steps of the cashier flow, in the order they are reported
+ACTIONS = ("load", "customer", "quantity", "calculate", "save", "export", "search", "new_bill")
+
+# Quantity widget key -> product, for every product on the billing page
+SKU_KEYS = {
+    f"{prefix}_{variant['name']}": variant['name']
+    for prefix, products in (("cosmetic", cosmetic_products), ("grocery", grocery_products), ("drink", drink_products))
+    for variants in products.values()
+    for variant in variants
+}
+
+WIDGET_TYPES = {"button", "number_input", "text_input", "selectbox", "radio", "checkbox"}
+# A rerun ends with one of these; FINISHED_EARLY_FOR_RERUN means st.rerun() started another
+DONE = {ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+        ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY}
+
+
+class CashierSession:
+    """One simulated browser session: the widgets it was sent and the values it has set."""
+
+    def __init__(self, port, timeout=60.0):
+        self.url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        self.timeout = timeout
+        self.widgets = {}
+        self.states = {}
+        self.cache = {}
+        self.errors = []
+        self.preview = ""
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await websocket_connect(self.url, subprotocols=["streamlit"])
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    def set(self, label, value, sidebar=False):
+        """
+        Set a widget's value for the next rerun, as the browser would on a change.
+
+        Args:
+            label (str): widget key, or its label for widgets without one
+            value: new value; an option for selectboxes and radios, ignored for buttons
+            sidebar (bool): whether the widget is in the sidebar
+
+        Returns:
+            str: the id of the fragment the widget belongs to, or "" if none
+        """
+        kind, proto, fragment_id = self.widgets[(sidebar, label)]
+        state = WidgetState(id=proto.id)
+        if kind == "button":
+            state.trigger_value = True
+        elif kind == "number_input":
+            state.double_value = value
+        elif kind == "text_input":
+            state.string_value = value
+        elif kind == "checkbox":
+            state.bool_value = value
+        else:
+            state.int_value = list(proto.options).index(value)
+        self.states[proto.id] = state
+        return fragment_id
+
+    async def rerun(self, fragment_id=""):
+        """Request a rerun with the current widget values and wait until it has finished."""
+        msg = BackMsg()
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        msg.rerun_script.fragment_id = fragment_id
+        # A button press is sent once
+        self.states = {key: state for key, state in self.states.items() if not state.HasField("trigger_value")}
+        self.errors = []
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        await asyncio.wait_for(self._read_until_finished(), self.timeout)
+
+    async def act(self, label, value=None, sidebar=False):
+        """Change one widget and wait for the rerun it triggers."""
+        await self.rerun(self.set(label, value, sidebar))
+
+    async def _read_until_finished(self):
+        while True:
+            data = await self.ws.read_message()
+            if data is None:
+                raise ConnectionError("server closed the session")
+            msg = ForwardMsg()
+            msg.ParseFromString(data)
+            kind = msg.WhichOneof("type")
+            if kind == "ref_hash":
+                # Large messages are sent once and referred to by hash afterwards
+                msg = self.cache[msg.ref_hash]
+                kind = msg.WhichOneof("type")
+            elif msg.metadata.cacheable:
+                self.cache[msg.hash] = msg
+            if kind == "delta":
+                self._apply(msg)
+            elif kind == "script_finished" and msg.script_finished in DONE:
+                return
+
+    def _apply(self, msg):
+        if msg.delta.WhichOneof("type") != "new_element":
+            return
+        element = msg.delta.new_element
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors.append(element.exception.message)
+        elif kind == "text_area" and element.text_area.label == "Bill":
+            area = element.text_area
+            self.preview = area.value if area.set_value else area.default
+        elif kind in WIDGET_TYPES:
+            proto = getattr(element, kind)
+            # Widget ids end in the user key, or "None" when the widget has none
+            key = proto.id.rsplit("-", 1)[-1]
+            sidebar = msg.metadata.delta_path[0] == 1
+            self.widgets[(sidebar, proto.label if key == "None" else key)] = (kind, proto, msg.delta.fragment_id)
+
+
+async def _cashier(port, index, bills, rng, think, samples, errors, produced):
+    session = CashierSession(port)
+
+    async def step(action, coroutine):
+        start = time.perf_counter()
+        try:
+            await coroutine
+        except Exception:
+            errors[action] += 1
+            raise
+        samples[action].append(time.perf_counter() - start)
+        if session.errors:
+            errors[action] += 1
+        if think:
+            await asyncio.sleep(rng.uniform(0, 2 * think))
+
+    try:
+        await session.connect()
+        await step("load", session.rerun())
+        previous = {}
+        for n in range(bills):
+            session.set("Customer Name", f"Cashier {index} Customer {n}")
+            await step("customer", session.act("Phone Number", f"9{index:04d}{n:05d}"))
+
+            # Clear the last bill's quantities, then enter this one's
+            items = {key: rng.randint(1, 4) for key in rng.sample(sorted(SKU_KEYS), rng.randint(1, 4))}
+            for key in previous:
+                if key not in items:
+                    await step("quantity", session.act(key, 0))
+            for key, qty in items.items():
+                await step("quantity", session.act(key, qty))
+            previous = items
+
+            await step("calculate", session.act("calc_button"))
+            match = re.search(r"Bill Number: (\S+)", session.preview)
+            if not match:
+                errors["calculate"] += 1
+                continue
+            bill_number = match.group(1)
+            produced.append({
+                "bill_number": bill_number,
+                "content": session.preview,
+                "items": {SKU_KEYS[key]: qty for key, qty in items.items()}
+            })
+            await step("save", session.act("save_button"))
+            await step("export", session.act("excel_button"))
+
+            # Look the bill up again from the search sidebar
+            session.set("Select Bill Number:", bill_number, sidebar=True)
+            await step("search", session.act("view_bill_by_number", sidebar=True))
+            if f"Bill Number: {bill_number}" not in session.preview:
+                errors["search"] += 1
+
+            await step("new_bill", session.act("New Bill", sidebar=True))
+    except Exception as e:
+        errors["aborted"] += 1
+        print(f"Cashier {index} stopped: {type(e).__name__}: {e}")
+    finally:
+        session.close()
+
+
+def check_stored_bills(app_dir, produced, ledger_wait=30.0):
+    """
+    Check what the cashiers produced against the bill files and the ledger.
+
+    Returns:
+        dict: bills, duplicate_numbers, texts_lost (missing or different text),
+        workbooks_lost (missing or different quantities) and ledger_missing
+    """
+    counts = Counter(bill["bill_number"] for bill in produced)
+    checks = {
+        "bills": len(produced),
+        "duplicate_numbers": sum(count - 1 for count in counts.values()),
+        "texts_lost": 0,
+        "workbooks_lost": 0,
+        "ledger_missing": 0
+    }
+    for bill in produced:
+        text_path = os.path.join(app_dir, "bills", f"{bill['bill_number']}.txt")
+        try:
+            with open(text_path, "r", encoding="utf-8") as f:
+                if f.read() != bill["content"]:
+                    checks["texts_lost"] += 1
+        except OSError:
+            checks["texts_lost"] += 1
+        try:
+            workbook = pd.read_excel(os.path.join(app_dir, "bills", f"{bill['bill_number']}.xlsx"))
+            if dict(zip(workbook["Product"], workbook["Quantity"])) != bill["items"]:
+                checks["workbooks_lost"] += 1
+        except Exception:
+            checks["workbooks_lost"] += 1
+
+    # The ledger is written by a background consumer; give it time to catch up
+    ledger_path = os.path.join(app_dir, "data", "ledger.db")
+    expected = set(counts)
+    deadline = time.monotonic() + ledger_wait
+    while True:
+        try:
+            missing = expected - set(read_line_items(ledger_path)["Bill Number"])
+        except Exception:
+            missing = expected
+        if not missing or time.monotonic() > deadline:
+            break
+        time.sleep(0.5)
+    checks["ledger_missing"] = len(missing)
+    return checks
+
+
+def summarize(samples, errors):
+    """Return a row per action: count, p50/p95/p99/max in ms and errors."""
+    rows = []
+    for action in ACTIONS:
+        seconds = np.array(samples.get(action, []))
+        row = {"action": action, "count": len(seconds), "errors": errors.get(action, 0)}
+        if len(seconds):
+            p50, p95, p99 = np.percentile(seconds, [50, 95, 99]) * 1000
+            row.update(p50=round(p50, 1), p95=round(p95, 1), p99=round(p99, 1), max=round(seconds.max() * 1000, 1))
+        rows.append(row)
+    return rows
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def copy_app(dest):
+    """Copy the app into dest without its bills, data or build output."""
+    shutil.copytree(APP_ROOT, dest, ignore=shutil.ignore_patterns(
+        ".git", "bills", "data", "build", "dist", "profiles", "__pycache__", ".*.feather"
+    ))
+    os.makedirs(os.path.join(dest, "data"), exist_ok=True)
+
+
+def start_server(app_dir, port, log_path, timeout=60.0):
+    """Start `streamlit run` for the app in app_dir and wait until it answers its health check."""
+    log = open(log_path, "w", encoding="utf-8")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", "streamlit_app.py",
+         "--server.headless=true", f"--server.port={port}", "--server.address=127.0.0.1",
+         "--server.fileWatcherType=none", "--browser.gatherUsageStats=false"],
+        cwd=app_dir, stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"streamlit exited with code {process.returncode}; see {log_path}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=2) as response:
+                if response.read().strip() == b"ok":
+                    return process
+        except OSError:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"streamlit did not start within {timeout:g}s; see {log_path}")
+
+
+def run_level(sessions, bills, think=0.0, seed=1, work_dir=None):
+    """
+    Run one load level: a fresh server and `sessions` cashiers of `bills` bills each.
+
+    Returns:
+        dict: sessions, bills, seconds, bills_per_second, reruns_per_second,
+        actions (see summarize), aborted and checks (see check_stored_bills)
+    """
+    app_dir = os.path.join(work_dir, f"app_{sessions}")
+    copy_app(app_dir)
+    port = _free_port()
+    server = start_server(app_dir, port, os.path.join(work_dir, f"server_{sessions}.log"))
+    samples = defaultdict(list)
+    errors = Counter()
+    produced = []
+    try:
+        async def run_all():
+            await asyncio.gather(*(
+                _cashier(port, index, bills, random.Random(seed * 1000 + index), think, samples, errors, produced)
+                for index in range(sessions)
+            ))
+
+        start = time.perf_counter()
+        asyncio.run(run_all())
+        seconds = time.perf_counter() - start
+        checks = check_stored_bills(app_dir, produced)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    reruns = sum(len(values) for values in samples.values())
+    return {
+        "sessions": sessions,
+        "bills": len(produced),
+        "seconds": round(seconds, 2),
+        "bills_per_second": round(len(produced) / seconds, 2),
+        "reruns_per_second": round(reruns / seconds, 2),
+        "actions": summarize(samples, errors),
+        "aborted": errors.get("aborted", 0),
+        "checks": checks
+    }
+
+
+def _print_level(result):
+    print(f"\n== {result['sessions']} cashier(s): {result['bills']} bills in {result['seconds']}s "
+          f"({result['bills_per_second']} bills/s, {result['reruns_per_second']} reruns/s)")
+    print(f"{'action':<10}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+    for row in result["actions"]:
+        if row["count"]:
+            print(f"{row['action']:<10}{row['count']:>7}{row['p50']:>10}{row['p95']:>10}{row['p99']:>10}"
+                  f"{row['max']:>10}{row['errors']:>8}")
+    checks = result["checks"]
+    print(f"stored bills: {checks['duplicate_numbers']} duplicate numbers, {checks['texts_lost']} texts lost, "
+          f"{checks['workbooks_lost']} workbooks lost, {checks['ledger_missing']} missing from the ledger; "
+          f"{result['aborted']} cashiers aborted")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent cashiers against a local Streamlit server.")
+    parser.add_argument("--sessions", default="1,2,4,8", help="Comma-separated numbers of concurrent cashiers")
+    parser.add_argument("--bills", type=int, default=5, help="Bills per cashier")
+    parser.add_argument("--think", type=float, default=0.0, help="Mean seconds a cashier pauses between steps")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--work-dir", default=None, help="Where the app copies and server logs go (default: a temp dir)")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="billing_load_")
+    os.makedirs(work_dir, exist_ok=True)
+    results = []
+    for sessions in (int(n) for n in args.sessions.split(",")):
+        result = run_level(sessions, args.bills, args.think, args.seed, work_dir)
+        _print_level(result)
+        results.append(result)
+
+    # How the busiest steps hold up as cashiers are added
+    print(f"\n{'cashiers':>8}{'bills/s':>10}{'quantity p95':>14}{'calculate p95':>15}{'errors':>8}{'lost':>6}")
+    for result in results:
+        rows = {row["action"]: row for row in result["actions"]}
+        lost = sum(value for key, value in result["checks"].items() if key != "bills")
+        print(f"{result['sessions']:>8}{result['bills_per_second']:>10}{rows['quantity'].get('p95', '-'):>14}"
+              f"{rows['calculate'].get('p95', '-'):>15}{sum(row['errors'] for row in result['actions']):>8}{lost:>6}")
+    print(f"\nApp copies and server logs: {work_dir}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
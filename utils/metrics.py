@@ -0,0 +1,238 @@
+import bisect
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prefix used for every exported metric name
+METRIC_PREFIX = "billing"
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_rerun = threading.local()
+_server = None
+_last_flush = 0.0
+
+
+class Histogram:
+    """Fixed-bucket latency histogram, cheap enough to update on every call."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+def observe(operation, seconds):
+    """Record one latency sample for an operation."""
+    with _lock:
+        histogram = _histograms.get(operation)
+        if histogram is None:
+            histogram = _histograms[operation] = Histogram()
+        histogram.observe(seconds)
+    # Keep the samples of the current script run for the sidebar panel
+    samples = getattr(_rerun, "samples", None)
+    if samples is not None:
+        samples.append((operation, seconds))
+
+
+def inc(name, amount=1):
+    """Increment a named counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    """Set a named gauge to its current value (e.g. a queue depth or lag)."""
+    with _lock:
+        _gauges[name] = value
+
+
+def timed(operation=None):
+    """Decorator that records the latency of every call to the wrapped function."""
+    def decorator(func):
+        name = operation or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                inc(f"{name}_errors")
+                raise
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def track(operation):
+    """Context manager that records the latency of the enclosed block."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc(f"{operation}_errors")
+        raise
+    finally:
+        observe(operation, time.perf_counter() - start)
+
+
+class StageTimer:
+    """Attribute the time between consecutive marks to named stages of one run."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.stages = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self._last)
+        self._last = now
+
+    def finish(self):
+        # One observation per stage per run, however often the stage was marked
+        for stage, seconds in self.stages.items():
+            observe(f"{self.prefix}_{stage}", seconds)
+        self.stages = {}
+
+
+def begin_rerun():
+    """Start collecting samples for the current script run (one per session thread)."""
+    _rerun.samples = []
+
+
+def rerun_samples():
+    """Return the (operation, seconds) samples recorded since begin_rerun()."""
+    return list(getattr(_rerun, "samples", None) or [])
+
+
+def snapshot():
+    """Return a summary row per operation: count, mean, p50, p95 and p99 in seconds."""
+    with _lock:
+        rows = []
+        for operation, histogram in sorted(_histograms.items()):
+            rows.append({
+                "operation": operation,
+                "count": histogram.count,
+                "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                "p50": histogram.quantile(0.50),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+            })
+        return rows
+
+
+def render_prometheus():
+    """Render all histograms, counters and gauges in the Prometheus text exposition format."""
+    lines = [
+        f"# HELP {METRIC_PREFIX}_operation_seconds Latency of billing and analytics operations.",
+        f"# TYPE {METRIC_PREFIX}_operation_seconds histogram",
+    ]
+    with _lock:
+        for operation, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_operation_seconds_bucket{{operation="{operation}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_bucket{{operation="{operation}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_sum{{operation="{operation}"}} {histogram.sum:.6f}')
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_count{{operation="{operation}"}} {histogram.count}')
+        for name, value in sorted(_counters.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+        for name, value in sorted(_gauges.items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+            lines.append(f"{METRIC_PREFIX}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(file_path):
+    """Write the Prometheus text snapshot to a file atomically."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+def flush(min_interval=5.0):
+    """Export to BILLING_METRICS_FILE if it is set, at most once per min_interval seconds."""
+    global _last_flush
+    file_path = os.environ.get("BILLING_METRICS_FILE")
+    if not file_path:
+        return None
+    now = time.monotonic()
+    if now - _last_flush < min_interval:
+        return None
+    _last_flush = now
+    return export_prometheus(file_path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are frequent, keep them out of the console
+        pass
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    Serve /metrics on a background thread.
+
+    The port defaults to BILLING_METRICS_PORT and the address to BILLING_METRICS_HOST,
+    or 127.0.0.1 so the metrics are only reachable from this machine unless asked.
+    """
+    global _server
+    if port is None:
+        port = os.environ.get("BILLING_METRICS_PORT")
+        if not port:
+            return None
+    host = host or os.environ.get("BILLING_METRICS_HOST", "127.0.0.1")
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                print(f"Could not start metrics server on {host}:{port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
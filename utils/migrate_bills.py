@@ -0,0 +1,326 @@
+"""
+Migrate legacy bills/BILLxxxxx.txt and .xlsx files into the SQLite ledger.
+
+    python -m utils.migrate_bills --bills-dir bills --workers 8
+
+Files are parsed in a process pool and written in batches. After every batch the
+files it finished or failed are appended to the checkpoint log, so an interrupted
+run picks up where it stopped. Bill numbers already in the ledger are skipped.
+A file with no line items, or with rows lacking a bill number or a readable date,
+is reported as failed and none of its rows are written.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .excel_cache import read_excel_cached
+from .customers import rebuild_customers
+from .gst import net_line_paise
+from .ledger import LEDGER_COLUMNS, append_bills, read_line_items
+
+# Date formats written by generate_bill and tried by the sidebar date search
+DATE_FORMATS = ["%d-%m-%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S"]
+
+# Section headings used by generate_bill, old and new
+TXT_SECTIONS = {"COSMETICS": "Cosmetics", "GROCERIES": "Groceries", "DRINKS": "Drinks", "ENERGY DRINKS": "Drinks"}
+
+# Older exports spelled some categories differently
+CATEGORY_ALIASES = {"Energy Drinks": "Drinks", "Grocery": "Groceries", "Cosmetic": "Cosmetics", "Drink": "Drinks"}
+
+# "<product>   <qty>   <price>   <total>" line of a text bill
+ITEM_LINE = re.compile(r"^(?P<product>.+?)\s+(?P<qty>\d+)\s+(?P<price>\d+(?:\.\d+)?)\s+(?P<total>\d+(?:\.\d+)?)\s*$")
+
+# "<Label> Discount: -<amount>" line closing a category section
+DISCOUNT_LINE = re.compile(r"^\w+ Discount: -(?P<amount>\d+(?:\.\d+)?)$")
+
+# "<description>   -<amount>" line of the OFFERS APPLIED section
+OFFER_LINE = re.compile(r"^(?P<description>.+?)\s*-(?P<amount>\d+(?:\.\d+)?)$")
+
+# Offers that discount single lines, as described by promotions.describe: a SKU or a category target
+LINE_OFFER = re.compile(r"^(?:(?P<percent>\d+(?:\.\d+)?)% off |Buy \d+ get \d+ free: )(?P<target>.+?)(?: \(min \d+\))?$")
+
+DEFAULT_CHECKPOINT = os.path.join("data", "migration_checkpoint.json")
+
+
+def parse_txt_bill(file_path):
+    """Parse a bill text file written by generate_bill into line-item rows, net of discounts."""
+    header = {}
+    rows = []
+    category = None
+    category_discounts = {}
+    offers = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            stripped = line.strip()
+            if stripped in TXT_SECTIONS:
+                category = TXT_SECTIONS[stripped]
+                continue
+            if stripped == "OFFERS APPLIED":
+                category = "OFFERS"
+                continue
+            for label, key in (("Bill Number:", "Bill Number"), ("Customer Name:", "Customer Name"),
+                               ("Phone Number:", "Phone"), ("Date:", "Date")):
+                if line.startswith(label):
+                    header[key] = line.split(label, 1)[1].strip()
+                    break
+            else:
+                if category is None or not stripped:
+                    continue
+                if category == "OFFERS":
+                    match = OFFER_LINE.match(stripped)
+                    if match:
+                        offers.append((match.group("description"), float(match.group("amount"))))
+                    else:
+                        category = None
+                    continue
+                match = DISCOUNT_LINE.match(stripped)
+                if match:
+                    category_discounts[category] = category_discounts.get(category, 0) + float(match.group("amount"))
+                    continue
+                match = ITEM_LINE.match(stripped)
+                if match:
+                    rows.append({
+                        "Category": category,
+                        "Product": match.group("product").strip(),
+                        "Quantity": int(match.group("qty")),
+                        "Price": float(match.group("price")),
+                        "Total": float(match.group("total"))
+                    })
+    if category_discounts:
+        _net_of_discounts(rows, category_discounts, offers)
+    if "Bill Number" not in header:
+        header["Bill Number"] = os.path.splitext(os.path.basename(file_path))[0]
+    return [{**header, **row} for row in rows]
+
+
+def _net_of_discounts(rows, category_discounts, offers):
+    """
+    Set each row's Discount and net Total from the receipt's category discounts.
+
+    Line offers are read back from OFFERS APPLIED (a SKU offer is that line's
+    discount, a category percentage is re-applied to the category's other lines),
+    and the rest of each category discount is its coupon share, split as the app does.
+    """
+    line_discounts = {}
+    products = {row["Product"] for row in rows}
+    category_offers = []
+    for description, amount in offers:
+        match = LINE_OFFER.match(description)
+        if not match:
+            continue
+        if match.group("target") in products:
+            line_discounts[match.group("target")] = amount
+        elif match.group("percent"):
+            category_offers.append((match.group("target"), float(match.group("percent"))))
+    for target, percent in category_offers:
+        for row in rows:
+            if row["Category"] == target and row["Product"] not in line_discounts:
+                gross = row["Quantity"] * row["Price"]
+                line_discounts[row["Product"]] = round(min(gross * percent / 100, gross), 2)
+    discounts = {"lines": line_discounts, "categories": category_discounts}
+    lines = [(row["Product"], row["Quantity"], row["Price"]) for row in rows]
+    for row, (_, gross, net) in zip(rows, net_line_paise(lines, discounts)):
+        row["Discount"] = (gross - net) / 100
+        row["Total"] = net / 100
+
+
+def parse_excel_bill(file_path):
+    """Read a bill workbook written by export_bill_to_excel into line-item rows."""
+    df = read_excel_cached(file_path)
+    if "Category" not in df.columns or "Bill Number" not in df.columns:
+        raise ValueError("missing Category / Bill Number columns")
+    df = df[df["Category"] != "TOTAL"]
+    # Real timestamps become ISO strings; every date is parsed for the whole batch at once
+    if "Date" in df.columns and pd.api.types.is_datetime64_any_dtype(df["Date"]):
+        df["Date"] = df["Date"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return df.reindex(columns=LEDGER_COLUMNS).to_dict("records")
+
+
+def parse_file(file_path):
+    """Parse one legacy file; runs in a worker process."""
+    try:
+        if file_path.lower().endswith(".txt"):
+            rows = parse_txt_bill(file_path)
+        else:
+            rows = parse_excel_bill(file_path)
+        return file_path, rows, None
+    except Exception as e:
+        return file_path, [], str(e)
+
+
+def normalize_rows(rows):
+    """
+    Normalize categories and dates and drop duplicate bills, all column-wise.
+
+    Returns:
+        tuple: (DataFrame, {source: rows without a bill number or readable date});
+        every row of such a source is left out
+    """
+    df = pd.DataFrame(rows).reindex(columns=LEDGER_COLUMNS + ["Source"])
+
+    # Categories: trim, title case, map legacy spellings
+    category = df["Category"].astype(str).str.strip().str.title()
+    df["Category"] = category.replace(CATEGORY_ALIASES)
+
+    # Dates: try each known format over the whole column, then a generic parse
+    raw_dates = df["Date"].astype(str).str.strip()
+    dates = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    for date_format in DATE_FORMATS:
+        missing = dates.isna()
+        if not missing.any():
+            break
+        dates[missing] = pd.to_datetime(raw_dates[missing], format=date_format, errors="coerce")
+    missing = dates.isna()
+    if missing.any():
+        dates[missing] = pd.to_datetime(raw_dates[missing], errors="coerce", dayfirst=True)
+    df["Date"] = dates
+
+    df["Quantity"] = pd.to_numeric(df["Quantity"], errors="coerce").fillna(0).astype(int)
+    df["Price"] = pd.to_numeric(df["Price"], errors="coerce").fillna(0.0)
+    df["Total"] = pd.to_numeric(df["Total"], errors="coerce").fillna(df["Quantity"] * df["Price"])
+    # Bills from before promotions carry no Discount column
+    df["Discount"] = pd.to_numeric(df["Discount"], errors="coerce").fillna(0.0)
+
+    # A file with unusable rows is left out whole, so a fixed file can be migrated again
+    unusable = df["Bill Number"].isna() | df["Date"].isna()
+    dropped = df.loc[unusable, "Source"].value_counts().to_dict()
+    df = df[~df["Source"].isin(dropped)]
+
+    # A bill may exist as both .xlsx and .txt (or twice in a workbook); keep one source per bill
+    first_source = df.groupby("Bill Number", sort=False)["Source"].transform("first")
+    return df[df["Source"] == first_source], dropped
+
+
+def load_checkpoint(checkpoint_path):
+    """Replay the checkpoint log into {"done": set of files, "failed": {file: error}}."""
+    checkpoint = {"done": set(), "failed": {}}
+    if not os.path.exists(checkpoint_path):
+        return checkpoint
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A torn last line from a crash mid-write
+                continue
+            if entry["error"]:
+                checkpoint["failed"][entry["file"]] = entry["error"]
+            else:
+                checkpoint["done"].add(entry["file"])
+                checkpoint["failed"].pop(entry["file"], None)
+    return checkpoint
+
+
+def append_checkpoint(entries, checkpoint_path):
+    """Append (file, error or None) entries to the checkpoint log as one durable write."""
+    if not entries:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    with open(checkpoint_path, "a", encoding="utf-8") as f:
+        f.write("".join(json.dumps({"file": file_path, "error": error}) + "\n" for file_path, error in entries))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def migrate(bills_dir="bills", ledger_path=None, checkpoint_path=DEFAULT_CHECKPOINT,
+            workers=None, batch_files=200, report=print, customers_path=None):
+    """
+    Migrate every legacy bill file in bills_dir into the ledger.
+
+    Workbooks are migrated before text files, so a bill saved both ways keeps
+    its structured Excel rows.
+
+    Returns:
+        dict: files migrated, bills added, failures and files per second
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    done = set(checkpoint["done"])
+    files = sorted(glob.glob(os.path.join(bills_dir, "*.xlsx"))) + sorted(glob.glob(os.path.join(bills_dir, "*.txt")))
+    todo = [path for path in files if path not in done]
+
+    start = time.perf_counter()
+    processed = 0
+    bills_added = 0
+    batch_rows = []
+    batch_paths = []
+    batch_failed = []
+
+    def commit_batch():
+        nonlocal bills_added, batch_rows, batch_paths, batch_failed
+        if batch_rows:
+            rows, dropped = normalize_rows(batch_rows)
+            bills_added += append_bills(rows.drop(columns=["Source"]), source="migration", ledger_path=ledger_path)
+            for file_path, count in dropped.items():
+                batch_failed.append((file_path, f"{count} rows without a bill number or readable date"))
+        failed_paths = {file_path for file_path, _ in batch_failed}
+        entries = batch_failed + [(file_path, None) for file_path in batch_paths if file_path not in failed_paths]
+        append_checkpoint(entries, checkpoint_path)
+        for file_path, error in entries:
+            if error:
+                checkpoint["failed"][file_path] = error
+            else:
+                checkpoint["failed"].pop(file_path, None)
+        batch_rows = []
+        batch_paths = []
+        batch_failed = []
+        elapsed = time.perf_counter() - start
+        report(f"{processed}/{len(todo)} files, {bills_added} bills added, "
+               f"{processed / elapsed if elapsed else 0:.1f} files/s, {len(checkpoint['failed'])} failures")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for file_path, rows, error in pool.map(parse_file, todo, chunksize=16):
+            processed += 1
+            if not error and not rows:
+                error = "no line items found"
+            if error:
+                # Failed files stay out of "done" so the next run retries them
+                batch_failed.append((file_path, error))
+            else:
+                batch_rows.extend({**row, "Source": file_path} for row in rows)
+                batch_paths.append(file_path)
+            if processed % batch_files == 0:
+                commit_batch()
+    commit_batch()
+
+    # Migrated bills can be older than ones already counted; rebuild the customer dimension once
+    if bills_added:
+        rebuild_customers(read_line_items(ledger_path), customers_path)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "files": processed,
+        "skipped": len(files) - len(todo),
+        "bills_added": bills_added,
+        "failed": dict(checkpoint["failed"]),
+        "files_per_second": round(processed / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate legacy bill files into the ledger database.")
+    parser.add_argument("--bills-dir", default="bills", help="Directory holding BILLxxxxx.txt/.xlsx files")
+    parser.add_argument("--ledger", default=None, help="Ledger database path (default: data/ledger.db)")
+    parser.add_argument("--customers", default=None, help="Customer dimension path (default: data/customers.json)")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Checkpoint file used to resume")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--batch-files", type=int, default=200, help="Files per ledger write and checkpoint")
+    args = parser.parse_args(argv)
+
+    result = migrate(args.bills_dir, args.ledger, args.checkpoint, args.workers, args.batch_files,
+                     customers_path=args.customers)
+    for file_path, error in result["failed"].items():
+        print(f"Failed {file_path}: {error}")
+    print(f"Migrated {result['files']} files ({result['skipped']} already done), "
+          f"{result['bills_added']} bills added, {result['files_per_second']} files/s")
+    return 0 if not result["failed"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
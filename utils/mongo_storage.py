@@ -0,0 +1,350 @@
+"""
+MongoDB storage backend for bills and line items.
+
+Enable with BILLING_MONGO_URI (e.g. mongodb://localhost:27017); the database name
+defaults to "pythonbill" and can be changed with BILLING_MONGO_DB. Every function
+also takes a db argument, so a mongomock database can stand in for a server:
+    db = mongomock.MongoClient()["pythonbill"]
+    append_bills(df, db=db)
+
+The analytics aggregates are computed by aggregation pipelines on the server, so
+only grouped results come back to Python. Bills saved before MongoDB was enabled
+are copied over from the ledger with:
+    python -m utils.mongo_storage backfill
+"""
+import argparse
+import os
+import threading
+from datetime import datetime, time
+
+import pandas as pd
+
+from .ledger import LEDGER_COLUMNS, SQL_COLUMNS, connect
+
+try:
+    from pymongo import ASCENDING, MongoClient
+except ImportError:  # pragma: no cover - pymongo is in requirements.txt
+    MongoClient = None
+    ASCENDING = 1
+
+# Ledger column name -> line item document field
+MONGO_FIELDS = {
+    'Date': 'date',
+    'Bill Number': 'bill_number',
+    'Customer Name': 'customer_name',
+    'Phone': 'phone',
+    'Category': 'category',
+    'Product': 'product',
+    'Quantity': 'quantity',
+    'Price': 'price',
+    'Discount': 'discount',
+    'Total': 'total'
+}
+
+# Bill numbers looked up per existence query
+LOOKUP_CHUNK = 1000
+
+_client = None
+_client_lock = threading.Lock()
+_indexed = set()
+
+
+def enabled():
+    """Return True when BILLING_MONGO_URI is set."""
+    return bool(os.environ.get("BILLING_MONGO_URI"))
+
+
+def get_database(client=None):
+    """
+    Return the billing database, creating its indexes on first use.
+
+    Args:
+        client (optional): a MongoClient (or mongomock client) to use instead of BILLING_MONGO_URI
+
+    Returns:
+        Database: the BILLING_MONGO_DB database
+    """
+    global _client
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                if MongoClient is None:
+                    raise RuntimeError("pymongo is not installed")
+                _client = MongoClient(os.environ["BILLING_MONGO_URI"], serverSelectionTimeoutMS=5000)
+            client = _client
+    db = client[os.environ.get("BILLING_MONGO_DB", "pythonbill")]
+    ensure_indexes(db)
+    return db
+
+
+def ensure_indexes(db):
+    """Create the compound indexes the analytics pipelines and customer lookups use."""
+    key = id(db)
+    if key in _indexed:
+        return
+    db.line_items.create_index(
+        [("date", ASCENDING), ("category", ASCENDING), ("product", ASCENDING)], name="date_category_product"
+    )
+    db.line_items.create_index([("customer_name", ASCENDING), ("date", ASCENDING)], name="customer_date")
+    db.line_items.create_index([("bill_number", ASCENDING)], name="bill_number")
+    _indexed.add(key)
+
+
+def append_bills(bill_data, source=None, db=None):
+    """
+    Insert line items and one document per bill, skipping bills already stored.
+
+    Args:
+        bill_data (pd.DataFrame): line items with the LEDGER_COLUMNS columns
+        source (str, optional): where the rows came from (app, service, ...)
+        db (optional): database to write to. If None, get_database() is used.
+
+    Returns:
+        int: number of new bills stored
+    """
+    if bill_data is None or bill_data.empty:
+        return 0
+    db = db if db is not None else get_database()
+
+    rows = bill_data.reindex(columns=LEDGER_COLUMNS).copy()
+    rows['Date'] = pd.to_datetime(rows['Date'], errors='coerce')
+    rows = rows.rename(columns=MONGO_FIELDS)
+
+    numbers = rows['bill_number'].astype(str).unique().tolist()
+    existing = set()
+    for i in range(0, len(numbers), LOOKUP_CHUNK):
+        chunk = numbers[i:i + LOOKUP_CHUNK]
+        existing.update(doc["_id"] for doc in db.bills.find({"_id": {"$in": chunk}}, {"_id": 1}))
+    rows = rows[~rows['bill_number'].astype(str).isin(existing)]
+    if rows.empty:
+        return 0
+
+    bills = rows.groupby('bill_number', sort=False).agg(
+        date=('date', 'first'),
+        customer_name=('customer_name', 'first'),
+        phone=('phone', 'first'),
+        total=('total', 'sum'),
+        quantity=('quantity', 'sum')
+    ).reset_index()
+    bill_docs = []
+    for doc in bills.to_dict("records"):
+        doc = _clean(doc)
+        doc["_id"] = str(doc.pop("bill_number"))
+        doc["source"] = source
+        bill_docs.append(doc)
+    item_docs = [_clean(doc) for doc in rows.to_dict("records")]
+
+    # The two inserts are not one transaction. Line items go first and the bill
+    # documents mark them complete, so an interrupted call leaves no bill without
+    # its lines; lines left behind by one are cleared here before the retry.
+    new_numbers = [doc["_id"] for doc in bill_docs]
+    for i in range(0, len(new_numbers), LOOKUP_CHUNK):
+        db.line_items.delete_many({"bill_number": {"$in": new_numbers[i:i + LOOKUP_CHUNK]}})
+    db.line_items.insert_many(item_docs, ordered=True)
+    db.bills.insert_many(bill_docs, ordered=True)
+    return len(bill_docs)
+
+
+def covers(bill_numbers, db=None):
+    """Return True if every one of bill_numbers is stored, so the aggregates see the same bills."""
+    db = db if db is not None else get_database()
+    numbers = list({str(number) for number in bill_numbers})
+    for i in range(0, len(numbers), LOOKUP_CHUNK):
+        chunk = numbers[i:i + LOOKUP_CHUNK]
+        if db.bills.count_documents({"_id": {"$in": chunk}}) < len(chunk):
+            return False
+    return True
+
+
+def backfill(ledger_path=None, chunk_rows=50000, db=None):
+    """
+    Copy the ledger's bills that are not stored yet, chunk_rows line items at a time.
+
+    Bills saved before BILLING_MONGO_URI was set are only in the ledger; until
+    they are copied the analytics keep aggregating the bill files.
+
+    Returns:
+        int: number of bills copied
+    """
+    db = db if db is not None else get_database()
+    select = ", ".join(f'{sql} AS "{name}"' for name, sql in SQL_COLUMNS.items())
+    conn = connect(ledger_path)
+    copied = 0
+    carry = None
+    try:
+        for chunk in pd.read_sql_query(f"SELECT {select} FROM line_items ORDER BY id", conn, chunksize=chunk_rows):
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            # A bill's lines are stored together; hold back the last one in case it runs into the next chunk
+            last = chunk['Bill Number'].iloc[-1]
+            tail = chunk['Bill Number'] == last
+            carry = chunk[tail]
+            copied += append_bills(chunk[~tail], source="backfill", db=db)
+        if carry is not None:
+            copied += append_bills(carry, source="backfill", db=db)
+    finally:
+        conn.close()
+    return copied
+
+
+def mirror_bills(bill_data, source=None):
+    """Copy bills to MongoDB when BILLING_MONGO_URI is set; errors are printed, not raised."""
+    if not enabled():
+        return 0
+    try:
+        return append_bills(bill_data, source=source)
+    except Exception as e:
+        print(f"Error writing bills to MongoDB: {e}")
+        return 0
+
+
+def _clean(doc):
+    """Convert pandas/numpy values to types BSON can store."""
+    clean = {}
+    for field, value in doc.items():
+        if isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime() if not pd.isna(value) else None
+        elif pd.api.types.is_scalar(value) and pd.isna(value):
+            value = None
+        elif hasattr(value, "item"):
+            value = value.item()
+        clean[field] = value
+    return clean
+
+
+def _match(start_date=None, end_date=None, category=None, product=None):
+    """Build the $match stage for the analytics filters; 'All' means no filter."""
+    match = {}
+    if start_date is not None or end_date is not None:
+        match["date"] = {}
+        if start_date is not None:
+            match["date"]["$gte"] = datetime.combine(start_date, time.min)
+        if end_date is not None:
+            match["date"]["$lte"] = datetime.combine(end_date, time.max)
+    if category and category != 'All':
+        match["category"] = category
+    if product and product != 'All':
+        match["product"] = product
+    return {"$match": match}
+
+
+def sales_summary(start_date=None, end_date=None, category=None, product=None, db=None):
+    """
+    Return the Sales Summary metrics for the filtered line items.
+
+    Returns:
+        dict: total, quantity, average (per line item), bills, median_bill and p90_bill
+    """
+    db = db if db is not None else get_database()
+    match = _match(start_date, end_date, category, product)
+    per_bill = [match, {"$group": {"_id": "$bill_number", "total": {"$sum": "$total"}}}]
+
+    totals = list(db.line_items.aggregate([
+        match,
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": "$total"},
+            "quantity": {"$sum": "$quantity"},
+            "lines": {"$sum": 1}
+        }}
+    ]))
+    counted = list(db.line_items.aggregate(per_bill + [{"$count": "bills"}]))
+    if not totals or not totals[0]["lines"] or not counted:
+        return {"total": 0.0, "quantity": 0, "average": 0.0, "bills": 0, "median_bill": 0.0, "p90_bill": 0.0}
+
+    bills = counted[0]["bills"]
+    summary = {
+        "total": totals[0]["total"],
+        "quantity": totals[0]["quantity"],
+        "average": totals[0]["total"] / totals[0]["lines"],
+        "bills": bills
+    }
+    # Nearest-rank percentiles: sort the bill totals on the server and fetch one value each
+    for name, q in (("median_bill", 0.5), ("p90_bill", 0.9)):
+        rank = min(bills - 1, int(q * (bills - 1) + 0.5))
+        value = list(db.line_items.aggregate(
+            per_bill + [{"$sort": {"total": 1}}, {"$skip": rank}, {"$limit": 1}], allowDiskUse=True
+        ))
+        summary[name] = value[0]["total"] if value else 0.0
+    return summary
+
+
+def sales_by(field, start_date=None, end_date=None, category=None, product=None, db=None):
+    """
+    Return Total and Quantity per 'Category' or 'Product' for the filtered line items.
+
+    Returns:
+        pd.DataFrame: columns field, Total and Quantity
+    """
+    db = db if db is not None else get_database()
+    docs = db.line_items.aggregate([
+        _match(start_date, end_date, category, product),
+        {"$group": {
+            "_id": f"${MONGO_FIELDS[field]}",
+            "Total": {"$sum": "$total"},
+            "Quantity": {"$sum": "$quantity"}
+        }},
+        {"$sort": {"_id": 1}}
+    ])
+    df = pd.DataFrame(list(docs), columns=["_id", "Total", "Quantity"])
+    return df.rename(columns={"_id": field})
+
+
+def sales_over_time(grouping="Day", start_date=None, end_date=None, category=None, product=None, db=None):
+    """
+    Return Total and Quantity per day, ISO week or month for the filtered line items.
+
+    Returns:
+        pd.DataFrame: Date (Day), Year/Week/Period (Week) or Month (Month) plus Total and Quantity
+    """
+    db = db if db is not None else get_database()
+    if grouping == "Day":
+        key = {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}
+    elif grouping == "Week":
+        # Calendar year and ISO week, matching the pandas Year/Week columns
+        key = {"$dateToString": {"format": "%Y-%V", "date": "$date"}}
+    else:
+        key = {"$dateToString": {"format": "%Y-%m", "date": "$date"}}
+
+    docs = list(db.line_items.aggregate([
+        _match(start_date, end_date, category, product),
+        {"$group": {"_id": key, "Total": {"$sum": "$total"}, "Quantity": {"$sum": "$quantity"}}},
+        {"$sort": {"_id": 1}}
+    ]))
+    if grouping == "Week":
+        if not docs:
+            return pd.DataFrame(columns=["Total", "Quantity", "Year", "Week", "Period"])
+        df = pd.DataFrame(docs, columns=["_id", "Total", "Quantity"])
+        df[["Year", "Week"]] = df["_id"].str.split("-", expand=True).astype(int)
+        df = df.drop(columns=["_id"]).sort_values(["Year", "Week"]).reset_index(drop=True)
+        df['Period'] = df['Year'].astype(str) + '-W' + df['Week'].astype(str)
+        return df
+    if grouping == "Day":
+        df = pd.DataFrame(docs, columns=["_id", "Total", "Quantity"]).rename(columns={"_id": "Date"})
+        df['Date'] = pd.to_datetime(df['Date']).dt.date
+        return df
+    return pd.DataFrame(docs, columns=["_id", "Total", "Quantity"]).rename(columns={"_id": "Month"})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MongoDB storage for bills and line items.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="Copy the ledger's bills missing from MongoDB")
+    backfill_parser.add_argument("--ledger", default=None, help="Ledger database (default: data/ledger.db)")
+    backfill_parser.add_argument("--chunk-rows", type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    if not enabled():
+        print("Error: BILLING_MONGO_URI is not set")
+        return 1
+    try:
+        copied = backfill(args.ledger, args.chunk_rows)
+    except Exception as e:
+        print(f"Error backfilling MongoDB: {e}")
+        return 1
+    print(f"Copied {copied} bills to MongoDB")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,172 @@
+import bisect
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from .data import prices as base_prices
+
+# Effective-from date of the prices in utils/data.py
+BASE_EFFECTIVE_FROM = "1970-01-01 00:00:00"
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def default_catalog_path():
+    """Return the default price history file, data/price_history.json."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'price_history.json')
+
+
+def _timestamp(when):
+    """Format a date/datetime/string as the sortable 'YYYY-MM-DD HH:MM:SS' key used in the catalog."""
+    if when is None:
+        when = datetime.now()
+    return pd.Timestamp(when).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class PriceCatalog:
+    """
+    Prices per SKU as a list of (effective from, price) versions.
+
+    Each SKU keeps its effective-from timestamps sorted, so the price in force at
+    any moment is one bisect away. The prices in utils/data.py are the version in
+    force before any recorded change.
+
+    Lookups run without the lock, so changes never edit the published history:
+    they build a new {sku: (effective, prices)} dict and swap it in whole.
+    """
+
+    def __init__(self, catalog_path=None):
+        self.catalog_path = catalog_path or default_catalog_path()
+        self.lock = threading.Lock()
+        self.mtime = None
+        self._load()
+
+    def _load(self):
+        saved = {}
+        if os.path.exists(self.catalog_path):
+            with open(self.catalog_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.mtime = os.stat(self.catalog_path).st_mtime_ns
+        versions = {sku: ([BASE_EFFECTIVE_FROM], [price]) for sku, price in base_prices.items()}
+        for sku, changes in saved.items():
+            for effective_from, price in changes:
+                _insert(versions.setdefault(sku, ([], [])), effective_from, price)
+        self.history = versions
+
+    def _save(self):
+        # Only the changes are stored; the base version comes from utils/data.py
+        history = {
+            sku: [[when, price] for when, price in zip(effective, prices) if when != BASE_EFFECTIVE_FROM]
+            for sku, (effective, prices) in self.history.items()
+        }
+        history = {sku: changes for sku, changes in history.items() if changes}
+        os.makedirs(os.path.dirname(os.path.abspath(self.catalog_path)), exist_ok=True)
+        tmp_path = f"{self.catalog_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(history, f)
+        os.replace(tmp_path, self.catalog_path)
+        self.mtime = os.stat(self.catalog_path).st_mtime_ns
+
+    def refresh(self):
+        """Reload the history if another process has changed the file."""
+        if os.path.exists(self.catalog_path) and os.stat(self.catalog_path).st_mtime_ns != self.mtime:
+            with self.lock:
+                self._load()
+
+    def price_as_of(self, sku, when=None):
+        """
+        Return the price of sku in force at when.
+
+        Args:
+            sku (str): product variant name
+            when (datetime or str, optional): moment of sale. If None, now.
+
+        Returns:
+            float or None: the price, or None if the SKU had no price yet
+        """
+        effective, prices = self.history.get(sku, ((), ()))
+        i = bisect.bisect_right(effective, _timestamp(when)) - 1
+        return prices[i] if i >= 0 else None
+
+    def prices_as_of(self, when=None):
+        """Return {sku: price} in force at when, in the shape generate_bill and friends expect."""
+        key = _timestamp(when)
+        snapshot = {}
+        for sku, (effective, prices) in self.history.items():
+            i = bisect.bisect_right(effective, key) - 1
+            if i >= 0:
+                snapshot[sku] = prices[i]
+        return snapshot
+
+    def set_price(self, sku, price, effective_from=None):
+        """Record a new price for sku from effective_from (default: now)."""
+        with self.lock:
+            effective, prices = self.history.get(sku, ([], []))
+            version = (list(effective), list(prices))
+            _insert(version, _timestamp(effective_from), price)
+            self.history = {**self.history, sku: version}
+            self._save()
+
+    def history_frame(self):
+        """Return every price version as a DataFrame with Product, Effective From and Price."""
+        rows = [
+            (sku, pd.Timestamp(when), price)
+            for sku, (effective, prices) in self.history.items()
+            for when, price in zip(effective, prices)
+        ]
+        return pd.DataFrame(rows, columns=['Product', 'Effective From', 'Price'])
+
+    def as_of_join(self, line_items, date_column='Date', product_column='Product', price_column='List Price'):
+        """
+        Add the list price in force at each line item's date.
+
+        Uses one sorted merge_asof over all rows instead of a lookup per row, so it
+        scales to millions of line items.
+
+        Returns:
+            pd.DataFrame: line_items (in their original order) with a price_column column
+        """
+        if line_items.empty:
+            return line_items.assign(**{price_column: pd.Series(dtype=float)})
+        history = self.history_frame().rename(columns={
+            'Product': product_column, 'Effective From': '_effective_from', 'Price': price_column
+        }).sort_values('_effective_from')
+        items = line_items.assign(
+            _row=range(len(line_items)),
+            _date=pd.to_datetime(line_items[date_column], errors='coerce')
+        )
+        dated = items.dropna(subset=['_date']).sort_values('_date')
+        joined = pd.merge_asof(
+            dated, history, left_on='_date', right_on='_effective_from', by=product_column, direction='backward'
+        )
+        # Rows without a usable date keep a missing list price
+        joined = pd.concat([joined, items[items['_date'].isna()]], ignore_index=True)
+        joined = joined.sort_values('_row').drop(columns=['_row', '_date', '_effective_from'])
+        joined.index = line_items.index
+        return joined
+
+
+def _insert(version, effective_from, price):
+    """Add or replace the price from effective_from in an (effective, prices) pair of sorted lists."""
+    effective, prices = version
+    i = bisect.bisect_left(effective, effective_from)
+    if i < len(effective) and effective[i] == effective_from:
+        prices[i] = price
+    else:
+        effective.insert(i, effective_from)
+        prices.insert(i, price)
+
+
+def get_price_catalog(catalog_path=None):
+    """Return the process-wide catalog for catalog_path, reloading it if the file changed."""
+    catalog_path = catalog_path or default_catalog_path()
+    with _catalogs_lock:
+        catalog = _catalogs.get(catalog_path)
+        if catalog is None:
+            catalog = _catalogs[catalog_path] = PriceCatalog(catalog_path)
+    catalog.refresh()
+    return catalog
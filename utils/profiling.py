@@ -0,0 +1,182 @@
+"""
+Opt-in per-rerun CPU and memory profiling for the Streamlit app.
+
+Enable with BILLING_PROFILE=1. Optional settings:
+    BILLING_PROFILE_SAMPLE  fraction of reruns to profile (default 1.0)
+    BILLING_PROFILE_DIR     where dumps and summaries go (default "profiles")
+    BILLING_PROFILE_KEEP    number of .prof dumps to keep (default 50)
+    BILLING_PROFILE_TOP     number of allocators / slow reruns to record (default 10)
+"""
+import cProfile
+import glob
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+# Size at which reruns.jsonl is rotated to reruns.jsonl.1
+MAX_LOG_BYTES = 5 * 1024 * 1024
+
+_lock = threading.Lock()
+_tracing_sessions = 0
+_local = threading.local()
+
+
+def _settings():
+    """Read the profiling settings from the environment."""
+    return {
+        "enabled": os.environ.get("BILLING_PROFILE", "") not in ("", "0", "false", "False"),
+        "sample": float(os.environ.get("BILLING_PROFILE_SAMPLE", "1.0")),
+        "dir": os.environ.get("BILLING_PROFILE_DIR", "profiles"),
+        "keep": int(os.environ.get("BILLING_PROFILE_KEEP", "50")),
+        "top": int(os.environ.get("BILLING_PROFILE_TOP", "10")),
+    }
+
+
+class RerunProfile:
+    """CPU profile, allocation trace and DataFrame sizes for one script run."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.started_at = datetime.now()
+        self.frames = {}
+        self.profiler = cProfile.Profile()
+        self._start = time.perf_counter()
+
+    def start(self):
+        global _tracing_sessions
+        with _lock:
+            if _tracing_sessions == 0:
+                tracemalloc.start()
+            _tracing_sessions += 1
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler is active on this interpreter; keep the memory trace only
+            self.profiler = None
+        self._start = time.perf_counter()
+
+    def stop(self):
+        """Stop profiling and return (elapsed seconds, top allocators)."""
+        global _tracing_sessions
+        elapsed = time.perf_counter() - self._start
+        if self.profiler is not None:
+            self.profiler.disable()
+        with _lock:
+            snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            _tracing_sessions -= 1
+            if _tracing_sessions == 0:
+                tracemalloc.stop()
+        allocators = []
+        if snapshot is not None:
+            for stat in snapshot.statistics("lineno")[:self.settings["top"]]:
+                frame = stat.traceback[0]
+                allocators.append({
+                    "location": f"{frame.filename}:{frame.lineno}",
+                    "size_kb": round(stat.size / 1024, 1),
+                    "count": stat.count
+                })
+        return elapsed, allocators
+
+
+def start_rerun():
+    """
+    Start profiling this rerun if profiling is enabled and the rerun is sampled.
+
+    Pair every call with finish_rerun() in a finally block, so a rerun ended by
+    st.rerun(), st.stop() or an error still releases its memory trace.
+    """
+    settings = _settings()
+    if not settings["enabled"] or random.random() >= settings["sample"]:
+        return None
+    profile = RerunProfile(settings)
+    profile.start()
+    _local.active = profile
+    return profile
+
+
+def note_frame(name, df):
+    """Record the size of a DataFrame built during the current profiled rerun."""
+    profile = getattr(_local, "active", None)
+    if profile is not None and isinstance(df, pd.DataFrame):
+        profile.frames[name] = _frame_size(df)
+
+
+def _frame_size(df):
+    return {"rows": len(df), "size_kb": round(df.memory_usage(deep=True).sum() / 1024, 1)}
+
+
+def finish_rerun(profile, session_state=None):
+    """Stop profiling, write the dump and update the summary of the slowest reruns."""
+    if profile is None:
+        return None
+    _local.active = None
+    elapsed, allocators = profile.stop()
+    settings = profile.settings
+
+    # Size of DataFrames kept in session state, next to the analytics frames
+    frames = dict(profile.frames)
+    if session_state is not None:
+        for key in list(session_state.keys()):
+            value = session_state[key]
+            if isinstance(value, pd.DataFrame):
+                frames[f"session_state.{key}"] = _frame_size(value)
+
+    os.makedirs(settings["dir"], exist_ok=True)
+    stamp = profile.started_at.strftime("%Y%m%d_%H%M%S_%f")
+    dump_path = None
+    if profile.profiler is not None:
+        dump_path = os.path.join(settings["dir"], f"rerun_{stamp}.prof")
+        profile.profiler.dump_stats(dump_path)
+
+    record = {
+        "started_at": profile.started_at.isoformat(),
+        "seconds": round(elapsed, 4),
+        "dump": dump_path,
+        "top_allocators": allocators,
+        "frames": frames
+    }
+    with _lock:
+        log_path = os.path.join(settings["dir"], "reruns.jsonl")
+        # Rotate the rerun log once it passes a few megabytes
+        if os.path.exists(log_path) and os.path.getsize(log_path) > MAX_LOG_BYTES:
+            os.replace(log_path, f"{log_path}.1")
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        slowest = _update_slowest(settings["dir"], record, settings["top"])
+        _rotate_dumps(settings["dir"], settings["keep"], {r["dump"] for r in slowest})
+    return record
+
+
+def _rotate_dumps(profile_dir, keep, protected):
+    """Delete the oldest .prof dumps beyond the limit, keeping those of the slowest reruns."""
+    dumps = sorted(glob.glob(os.path.join(profile_dir, "rerun_*.prof")))
+    for old_dump in dumps[:-keep] if keep > 0 else dumps:
+        if old_dump in protected:
+            continue
+        try:
+            os.remove(old_dump)
+        except OSError:
+            pass
+
+
+def _update_slowest(profile_dir, record, top):
+    """Keep a small JSON summary of the slowest reruns seen so far."""
+    summary_path = os.path.join(profile_dir, "slowest_reruns.json")
+    slowest = []
+    if os.path.exists(summary_path):
+        try:
+            with open(summary_path, "r", encoding="utf-8") as f:
+                slowest = json.load(f)
+        except (OSError, ValueError):
+            slowest = []
+    slowest.append(record)
+    slowest = sorted(slowest, key=lambda r: r["seconds"], reverse=True)[:top]
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(slowest, f, indent=2)
+    return slowest
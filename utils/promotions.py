@@ -0,0 +1,421 @@
+"""
+Promotion engine: offers evaluated per cart.
+
+Rules live in data/promotions.json as a list of objects:
+    {"id": "DOVE-B2G1", "type": "buy_x_get_y", "sku": "Dove Bath Soap", "buy": 2, "get": 1}
+    {"id": "DRINKS10", "type": "percent_off", "category": "Drinks", "percent": 10, "min_qty": 3}
+    {"id": "TEA5", "type": "percent_off", "sku": "Tata Tea", "percent": 5}
+    {"id": "SAVE50", "type": "threshold", "min_subtotal": 500, "amount_off": 50}
+    {"id": "SAVE5PC", "type": "threshold", "min_subtotal": 2000, "percent": 5}
+Any rule may carry "start" and/or "end" ("YYYY-MM-DD HH:MM:SS", end exclusive).
+
+Each line gets the single best of its SKU offers and its category offer (offers
+do not stack), then the best threshold coupon applies to the discounted cart.
+For every span of time in which the set of active rules is constant, rules are
+compiled into per-SKU, per-category and threshold tables sorted by their minimum
+quantity or subtotal, with the best offer up to each position. A cart costs a
+bisect or two per line and per category, however many promotions exist:
+    python -m utils.promotions bench --rules 10000
+    python -m utils.promotions reprice --out repriced.csv
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from .data import prices as base_prices, product_categories
+from .gst import _allocate, to_paise
+
+RULE_TYPES = ("buy_x_get_y", "percent_off", "threshold")
+
+# Compiled rule tables kept per span of time; older spans are rebuilt on demand
+MAX_CACHED_SPANS = 64
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def default_promotions_path():
+    """Return the default rules file, data/promotions.json."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'promotions.json')
+
+
+def _timestamp(when):
+    if when is None:
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(when, str) and len(when) == 19:
+        return when
+    return pd.Timestamp(when).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def describe(rule):
+    """Return a short human-readable description of a rule for the receipt."""
+    target = rule.get("sku") or rule.get("category")
+    if rule["type"] == "buy_x_get_y":
+        return f"Buy {rule['buy']} get {rule['get']} free: {target}"
+    if rule["type"] == "percent_off":
+        minimum = f" (min {rule['min_qty']})" if rule.get("min_qty") else ""
+        return f"{rule['percent']:g}% off {target}{minimum}"
+    off = f"₹{rule['amount_off']:g}" if "amount_off" in rule else f"{rule['percent']:g}%"
+    return f"{off} off bills over ₹{rule['min_subtotal']:g}"
+
+
+def _validate(rule):
+    if rule.get("type") not in RULE_TYPES:
+        raise ValueError(f"Unknown promotion type in {rule.get('id')}: {rule.get('type')}")
+    if rule["type"] == "buy_x_get_y" and not (rule.get("sku") and rule.get("buy", 0) > 0 and rule.get("get", 0) > 0):
+        raise ValueError(f"buy_x_get_y promotion {rule.get('id')} needs sku, buy and get")
+    if rule["type"] == "percent_off" and not (bool(rule.get("sku")) != bool(rule.get("category")) and 0 < rule.get("percent", 0) <= 100):
+        raise ValueError(f"percent_off promotion {rule.get('id')} needs a percent and either sku or category")
+    if rule["type"] == "threshold" and ("amount_off" in rule) == ("percent" in rule):
+        raise ValueError(f"threshold promotion {rule.get('id')} needs either amount_off or percent")
+
+
+def _active(rule, when):
+    return rule.get("start", "") <= when and (not rule.get("end") or when < rule["end"])
+
+
+def _line_discount(rule, qty, price):
+    """Discount a SKU rule gives one line."""
+    if rule["type"] == "buy_x_get_y":
+        return (qty // (rule["buy"] + rule["get"])) * rule["get"] * price
+    return qty * price * rule["percent"] / 100
+
+
+class _Table:
+    """Rules sorted by a minimum, with the running best value up to each position."""
+
+    def __init__(self, entries):
+        # entries: (minimum, value, rule); best value wins, first rule on ties
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self.minimums = [minimum for minimum, _, _ in entries]
+        self.best = []
+        best = None
+        for minimum, value, rule in entries:
+            if best is None or value > best[0]:
+                best = (value, rule)
+            self.best.append(best)
+
+    def lookup(self, amount):
+        """Return (value, rule) of the best rule whose minimum is at most amount, or None."""
+        i = bisect.bisect_right(self.minimums, amount)
+        return self.best[i - 1] if i else None
+
+
+class PromotionEngine:
+    """Active promotions indexed by SKU, category and cart threshold."""
+
+    def __init__(self, rules=None, promotions_path=None):
+        self.promotions_path = promotions_path or default_promotions_path()
+        self.lock = threading.Lock()
+        self.mtime = None
+        if rules is None:
+            rules = self._read()
+        self._compile(rules)
+
+    def _read(self):
+        if not os.path.exists(self.promotions_path):
+            return []
+        with open(self.promotions_path, "r", encoding="utf-8") as f:
+            rules = json.load(f)
+        self.mtime = os.stat(self.promotions_path).st_mtime_ns
+        return rules
+
+    def _compile(self, rules):
+        for rule in rules:
+            _validate(rule)
+        rules = list(rules)
+        # Moments where a rule starts or ends; between two of them the compiled tables are fixed
+        boundaries = sorted({rule[key] for rule in rules for key in ("start", "end") if rule.get(key)})
+        # One assignment: evaluate runs unlocked and must never pair new boundaries with old span tables
+        self.compiled = (rules, boundaries, {})
+
+    @property
+    def rules(self):
+        return self.compiled[0]
+
+    def refresh(self):
+        """Recompile the rules if another process has changed the file."""
+        if os.path.exists(self.promotions_path) and os.stat(self.promotions_path).st_mtime_ns != self.mtime:
+            with self.lock:
+                self._compile(self._read())
+
+    def _span_tables(self, when):
+        """Return the SKU, category and threshold tables for the span of time containing when."""
+        rules, boundaries, spans = self.compiled
+        span = bisect.bisect_right(boundaries, when)
+        tables = spans.get(span)
+        if tables is None:
+            sku_percent, sku_free, categories, amount_off, percent = {}, {}, {}, [], []
+            for rule in rules:
+                if not _active(rule, when):
+                    continue
+                if rule["type"] == "buy_x_get_y":
+                    # Only the first rule of each buy/get shape can matter
+                    sku_free.setdefault(rule["sku"], {}).setdefault((rule["buy"], rule["get"]), rule)
+                elif rule["type"] == "percent_off" and rule.get("sku"):
+                    sku_percent.setdefault(rule["sku"], []).append((rule.get("min_qty", 0), rule["percent"], rule))
+                elif rule["type"] == "percent_off":
+                    categories.setdefault(rule["category"], []).append((rule.get("min_qty", 0), rule["percent"], rule))
+                elif "amount_off" in rule:
+                    amount_off.append((rule["min_subtotal"], rule["amount_off"], rule))
+                else:
+                    percent.append((rule["min_subtotal"], rule["percent"], rule))
+            tables = (
+                {sku: _Table(entries) for sku, entries in sku_percent.items()},
+                {sku: list(shapes.items()) for sku, shapes in sku_free.items()},
+                {category: _Table(entries) for category, entries in categories.items()},
+                _Table(amount_off),
+                _Table(percent)
+            )
+            if len(spans) >= MAX_CACHED_SPANS:
+                spans.clear()
+            spans[span] = tables
+        return tables
+
+    def evaluate(self, lines, when=None):
+        """
+        Work out the discounts on one cart.
+
+        Args:
+            lines (iterable): (sku, quantity, unit price) for every line with a non-zero quantity
+            when (datetime or str, optional): moment of sale, for rule start/end dates. If None, now.
+
+        Returns:
+            dict: 'lines' {sku: discount}, 'categories' {category: discount including its share of
+            the cart coupon}, 'cart' (coupon amount), 'total' and 'applied' [{'id', 'description', 'amount'}]
+        """
+        when = _timestamp(when)
+        sku_percent, sku_free, category_tables, amount_off, percent_off = self._span_tables(when)
+        lines = list(lines)
+
+        # Category offers depend on how many units of the category are in the cart
+        category_qty = {}
+        for sku, qty, _ in lines:
+            category = product_categories.get(sku)
+            category_qty[category] = category_qty.get(category, 0) + qty
+
+        line_discounts = {}
+        applied = {}
+        net = {}
+        for sku, qty, price in lines:
+            category = product_categories.get(sku)
+            best, best_rule = 0.0, None
+            table = category_tables.get(category)
+            found = table.lookup(category_qty[category]) if table else None
+            table = sku_percent.get(sku)
+            found_sku = table.lookup(qty) if table else None
+            if found_sku and (not found or found_sku[0] > found[0]):
+                found = found_sku
+            if found:
+                best, best_rule = qty * price * found[0] / 100, found[1]
+            for (buy, get), rule in sku_free.get(sku, ()):
+                discount = (qty // (buy + get)) * get * price
+                if discount > best:
+                    best, best_rule = discount, rule
+            best = round(min(best, qty * price), 2)
+            if best > 0:
+                line_discounts[sku] = best
+                applied[best_rule["id"]] = (best_rule, applied.get(best_rule["id"], (None, 0))[1] + best)
+            net[category] = net.get(category, 0) + qty * price - best
+
+        # One coupon for the whole cart, whichever saves the most on the discounted subtotal
+        subtotal = sum(net.values())
+        cart_discount, cart_rule = 0.0, None
+        for table, as_percent in ((amount_off, False), (percent_off, True)):
+            found = table.lookup(subtotal)
+            if found:
+                discount = subtotal * found[0] / 100 if as_percent else found[0]
+                if discount > cart_discount:
+                    cart_discount, cart_rule = discount, found[1]
+        cart_discount = round(min(cart_discount, subtotal), 2)
+        if cart_rule is not None and cart_discount > 0:
+            applied[cart_rule["id"]] = (cart_rule, cart_discount)
+
+        # The coupon is shared across categories in proportion to their value, so each is taxed on its net
+        categories = {}
+        for sku, discount in line_discounts.items():
+            category = product_categories.get(sku)
+            categories[category] = categories.get(category, 0) + discount
+        if cart_discount and subtotal:
+            # Split in whole paise (largest remainder), so the shares add up to the coupon exactly
+            names = list(net)
+            values = [int(to_paise(net[category])) for category in names]
+            kept = _allocate(values, int(to_paise(cart_discount)), names)
+            for category, value, left in zip(names, values, kept):
+                categories[category] = round(categories.get(category, 0) + (value - left) / 100, 2)
+
+        return {
+            "lines": line_discounts,
+            "categories": categories,
+            "cart": cart_discount,
+            "total": round(sum(line_discounts.values()) + cart_discount, 2),
+            "applied": [
+                {"id": rule_id, "description": describe(rule), "amount": round(amount, 2)}
+                for rule_id, (rule, amount) in applied.items()
+            ]
+        }
+
+    def evaluate_items(self, prices, *item_dicts, when=None):
+        """Evaluate a cart given as {sku: quantity} dicts (e.g. cosmetic, grocery and drink items)."""
+        return self.evaluate(
+            [(sku, qty, prices[sku]) for items in item_dicts for sku, qty in items.items() if qty > 0], when
+        )
+
+    def reprice(self, line_items, date_column='Date', bill_column='Bill Number', product_column='Product',
+                quantity_column='Quantity', price_column='Price'):
+        """
+        Re-price historical bills under the rules active at each bill's date.
+
+        Returns:
+            pd.DataFrame: one row per bill with Bill Number, Date, Gross, Discount, Net and Promotions
+        """
+        columns = [bill_column, date_column, 'Gross', 'Discount', 'Net', 'Promotions']
+        if line_items.empty:
+            return pd.DataFrame(columns=columns)
+        items = line_items[[bill_column, date_column, product_column, quantity_column, price_column]]
+        items = items.assign(_when=pd.to_datetime(items[date_column], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S'))
+        rows = []
+        for bill_number, bill in items.groupby(bill_column, sort=False):
+            lines = list(zip(bill[product_column], bill[quantity_column], bill[price_column]))
+            when = bill['_when'].iloc[0]
+            result = self.evaluate(lines, when if isinstance(when, str) else None)
+            gross = float((bill[quantity_column] * bill[price_column]).sum())
+            rows.append((
+                bill_number, bill[date_column].iloc[0], gross, result["total"], round(gross - result["total"], 2),
+                ", ".join(entry["id"] for entry in result["applied"])
+            ))
+        return pd.DataFrame(rows, columns=columns)
+
+    def add_rule(self, rule):
+        """Add or replace (by id) a rule and save the rules file."""
+        _validate(rule)
+        with self.lock:
+            rules = [existing for existing in self.rules if existing["id"] != rule["id"]] + [rule]
+            os.makedirs(os.path.dirname(os.path.abspath(self.promotions_path)), exist_ok=True)
+            tmp_path = f"{self.promotions_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rules, f, indent=2)
+            os.replace(tmp_path, self.promotions_path)
+            self.mtime = os.stat(self.promotions_path).st_mtime_ns
+            self._compile(rules)
+
+
+def get_promotion_engine(promotions_path=None):
+    """Return the process-wide engine for promotions_path, recompiling it if the file changed."""
+    promotions_path = promotions_path or default_promotions_path()
+    with _engines_lock:
+        engine = _engines.get(promotions_path)
+        if engine is None:
+            engine = _engines[promotions_path] = PromotionEngine(promotions_path=promotions_path)
+    engine.refresh()
+    return engine
+
+
+def _scan_total(rules, lines, when):
+    """Reference evaluation that checks every rule against the cart; used by the benchmark."""
+    when = _timestamp(when)
+    active = [rule for rule in rules if _active(rule, when)]
+    category_qty = {}
+    for sku, qty, _ in lines:
+        category_qty[product_categories.get(sku)] = category_qty.get(product_categories.get(sku), 0) + qty
+    subtotal = 0.0
+    total = 0.0
+    for sku, qty, price in lines:
+        best = 0.0
+        for rule in active:
+            if rule["type"] == "percent_off" and rule.get("category") == product_categories.get(sku) \
+                    and rule.get("min_qty", 0) <= category_qty[rule["category"]]:
+                best = max(best, qty * price * rule["percent"] / 100)
+            elif rule["type"] != "threshold" and rule.get("sku") == sku and rule.get("min_qty", 0) <= qty:
+                best = max(best, _line_discount(rule, qty, price))
+        best = round(min(best, qty * price), 2)
+        total += best
+        subtotal += qty * price - best
+    coupon = 0.0
+    for rule in active:
+        if rule["type"] == "threshold" and rule["min_subtotal"] <= subtotal:
+            coupon = max(coupon, rule["amount_off"] if "amount_off" in rule else subtotal * rule["percent"] / 100)
+    return round(total + round(min(coupon, subtotal), 2), 2)
+
+
+def random_rules(n, seed=0):
+    """Generate n plausible rules over the catalog SKUs, for benchmarks."""
+    rng = random.Random(seed)
+    skus = sorted(base_prices)
+    categories = sorted(set(product_categories.values()))
+    rules = []
+    for i in range(n):
+        kind = rng.random()
+        start = f"2025-{rng.randint(1, 12):02d}-01 00:00:00"
+        end = f"2026-{rng.randint(1, 12):02d}-01 00:00:00"
+        if kind < 0.45:
+            rule = {"type": "buy_x_get_y", "sku": rng.choice(skus), "buy": rng.randint(1, 4), "get": 1}
+        elif kind < 0.85:
+            rule = {"type": "percent_off", "sku": rng.choice(skus), "percent": rng.choice([5, 10, 15, 20])}
+        elif kind < 0.95:
+            rule = {"type": "percent_off", "category": rng.choice(categories), "percent": rng.choice([5, 10, 15]),
+                    "min_qty": rng.randint(1, 10)}
+        else:
+            rule = {"type": "threshold", "min_subtotal": rng.randint(2, 100) * 50}
+            rule["amount_off" if rng.random() < 0.5 else "percent"] = rng.choice([5, 10, 25, 50])
+        rules.append({"id": f"P{i:05d}", "start": start, "end": end, **rule})
+    return rules
+
+
+def _bench(n_rules, n_carts, cart_lines):
+    rng = random.Random(1)
+    skus = sorted(base_prices)
+    carts = [
+        [(sku, rng.randint(1, 6), base_prices[sku]) for sku in rng.sample(skus, cart_lines)]
+        for _ in range(n_carts)
+    ]
+    when = "2025-12-15 12:00:00"
+    for count in sorted({100, 1000, n_rules}):
+        rules = random_rules(count)
+        start = time.perf_counter()
+        engine = PromotionEngine(rules)
+        compiled = time.perf_counter() - start
+        start = time.perf_counter()
+        totals = [engine.evaluate(cart, when)["total"] for cart in carts]
+        indexed = (time.perf_counter() - start) / n_carts
+        sample = carts[:max(1, n_carts // 10)]
+        start = time.perf_counter()
+        expected = [_scan_total(rules, cart, when) for cart in sample]
+        scanned = (time.perf_counter() - start) / len(sample)
+        mismatches = sum(abs(a - b) > 0.011 for a, b in zip(totals, expected))
+        print(f"{count:>6} rules: compile {compiled * 1000:.1f} ms, indexed {indexed * 1e6:.0f} us/cart, "
+              f"full scan {scanned * 1e6:.0f} us/cart, {mismatches} mismatches")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the promotion engine or re-price the ledger's bills.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench = subparsers.add_parser("bench", help="Time cart evaluation against the number of rules")
+    bench.add_argument("--rules", type=int, default=10000)
+    bench.add_argument("--carts", type=int, default=2000)
+    bench.add_argument("--lines", type=int, default=10, help="Lines per cart")
+    reprice = subparsers.add_parser("reprice", help="Re-price ledger bills under the rules in force at their dates")
+    reprice.add_argument("--ledger", default=None, help="Ledger database (default: data/ledger.db)")
+    reprice.add_argument("--promotions", default=None, help="Rules file (default: data/promotions.json)")
+    reprice.add_argument("--out", required=True, help="CSV file to write")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        _bench(args.rules, args.carts, args.lines)
+        return 0
+    from .ledger import read_line_items
+    repriced = PromotionEngine(promotions_path=args.promotions).reprice(read_line_items(args.ledger))
+    repriced.to_csv(args.out, index=False)
+    print(f"Re-priced {len(repriced)} bills, {repriced['Discount'].sum():.2f} in discounts -> {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,482 @@
+import base64
+import bisect
+import calendar
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import deque
+
+import pandas as pd
+
+from .file_lock import file_lock
+
+# HyperLogLog precision: 2**12 registers, about 1.6% standard error
+HLL_PRECISION = 12
+
+# t-digest compression: higher keeps more centroids and tighter tails
+TDIGEST_COMPRESSION = 100
+
+# Bill numbers remembered to stop a re-export from being counted twice
+RECENT_BILLS = 5000
+
+# Bucket category used for whole-bill values across all categories
+ALL_CATEGORIES = "All"
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch; sparse until it fills a quarter of its registers."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.sparse = {}
+        self.registers = None
+
+    def add(self, value):
+        h = _hash64(value)
+        index = h >> (64 - self.precision)
+        remainder = (h << self.precision) & ((1 << 64) - 1)
+        # Position of the first set bit after the index bits
+        rank = 65 - remainder.bit_length() if remainder else 64 - self.precision + 1
+        self._set(index, rank)
+
+    def _set(self, index, rank):
+        if self.registers is not None:
+            if rank > self.registers[index]:
+                self.registers[index] = rank
+            return
+        if rank > self.sparse.get(index, 0):
+            self.sparse[index] = rank
+            if len(self.sparse) > self.m // 4:
+                self._densify()
+
+    def _densify(self):
+        self.registers = bytearray(self.m)
+        for index, rank in self.sparse.items():
+            self.registers[index] = rank
+        self.sparse = {}
+
+    def merge(self, other):
+        if other.registers is None:
+            for index, rank in other.sparse.items():
+                self._set(index, rank)
+        else:
+            if self.registers is None:
+                self._densify()
+            self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self):
+        if self.registers is None:
+            values = self.sparse.values()
+            zeros = self.m - len(self.sparse)
+        else:
+            values = self.registers
+            zeros = values.count(0)
+        total = zeros + sum(2.0 ** -r for r in values if r)
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / total
+        # Small-range correction: linear counting while registers are still empty
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        if self.registers is None:
+            return {"p": self.precision, "s": self.sparse}
+        return {"p": self.precision, "d": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data):
+        hll = cls(data["p"])
+        if "d" in data:
+            hll.registers = bytearray(base64.b64decode(data["d"]))
+        else:
+            hll.sparse = {int(k): v for k, v in data["s"].items()}
+        return hll
+
+
+class TDigest:
+    """Mergeable quantile sketch (merging t-digest with the k1 scale function)."""
+
+    def __init__(self, compression=TDIGEST_COMPRESSION):
+        self.compression = compression
+        self.centroids = []
+        self.buffer = []
+        self.count = 0
+
+    def add(self, value, weight=1):
+        self.buffer.append((float(value), weight))
+        self.count += weight
+        if len(self.buffer) > 5 * self.compression:
+            self._compress()
+
+    def add_many(self, values):
+        """Add a batch of values with weight 1, compressing at most once."""
+        self.buffer.extend((float(value), 1) for value in values)
+        self.count += len(values)
+        if len(self.buffer) > 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self.buffer.extend(other.centroids)
+        self.count += other.count
+        self._compress()
+        return self
+
+    @classmethod
+    def merged(cls, digests, compression=TDIGEST_COMPRESSION):
+        """Return a new digest of many digests, compressed once rather than per merge."""
+        digest = cls(compression)
+        for other in digests:
+            other._compress()
+            digest.buffer.extend(other.centroids)
+            digest.count += other.count
+        digest._compress()
+        return digest
+
+    def _compress(self):
+        if not self.buffer:
+            return
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        total = sum(w for _, w in points)
+        merged = []
+        seen = 0.0
+        mean, weight = points[0]
+        k_low = self._k(0.0)
+        for value, w in points[1:]:
+            q = (seen + weight + w) / total
+            if self._k(q) - k_low <= 1.0:
+                mean += (value - mean) * w / (weight + w)
+                weight += w
+            else:
+                merged.append((mean, weight))
+                seen += weight
+                k_low = self._k(seen / total)
+                mean, weight = value, w
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def _k(self, q):
+        q = min(max(q, 1e-12), 1 - 1e-12)
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def quantile(self, q):
+        self._compress()
+        if not self.centroids:
+            return 0.0
+        if len(self.centroids) == 1:
+            return self.centroids[0][0]
+        # Interpolate between centroid midpoints
+        target = q * self.count
+        cumulative = []
+        running = 0.0
+        for _, w in self.centroids:
+            cumulative.append(running + w / 2)
+            running += w
+        i = bisect.bisect_left(cumulative, target)
+        if i == 0:
+            return self.centroids[0][0]
+        if i >= len(self.centroids):
+            return self.centroids[-1][0]
+        (m0, _), (m1, _) = self.centroids[i - 1], self.centroids[i]
+        c0, c1 = cumulative[i - 1], cumulative[i]
+        return m0 + (m1 - m0) * (target - c0) / (c1 - c0)
+
+    def to_dict(self):
+        self._compress()
+        return {"c": self.compression, "n": self.count, "cs": self.centroids}
+
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(data["c"])
+        digest.centroids = [tuple(c) for c in data["cs"]]
+        digest.count = data["n"]
+        return digest
+
+
+class SalesBucket:
+    """Exact sums plus distinct-count and quantile sketches for one (day, category)."""
+
+    def __init__(self):
+        self.total = 0.0
+        self.quantity = 0
+        self.lines = 0
+        self.bills = HyperLogLog()
+        self.customers = HyperLogLog()
+        self.bill_values = TDigest()
+
+    def merge(self, other):
+        self.total += other.total
+        self.quantity += other.quantity
+        self.lines += other.lines
+        self.bills.merge(other.bills)
+        self.customers.merge(other.customers)
+        self.bill_values.merge(other.bill_values)
+        return self
+
+    @classmethod
+    def merged(cls, buckets):
+        """Return a new bucket of many buckets; the bill values are compressed once."""
+        bucket = cls()
+        for other in buckets:
+            bucket.total += other.total
+            bucket.quantity += other.quantity
+            bucket.lines += other.lines
+            bucket.bills.merge(other.bills)
+            bucket.customers.merge(other.customers)
+        bucket.bill_values = TDigest.merged(other.bill_values for other in buckets)
+        return bucket
+
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "quantity": self.quantity,
+            "lines": self.lines,
+            "bills": self.bills.to_dict(),
+            "customers": self.customers.to_dict(),
+            "bill_values": self.bill_values.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        bucket = cls()
+        bucket.total = data["total"]
+        bucket.quantity = data["quantity"]
+        bucket.lines = data["lines"]
+        bucket.bills = HyperLogLog.from_dict(data["bills"])
+        bucket.customers = HyperLogLog.from_dict(data["customers"])
+        bucket.bill_values = TDigest.from_dict(data["bill_values"])
+        return bucket
+
+
+class SalesSketch:
+    """
+    Per-day, per-category sales buckets maintained as bills are written.
+
+    Each bill is also folded into a per-month rollup, so a summary merges whole
+    months from the rollups and only the days of the months at either end of
+    its range: at most 62 day buckets plus one per month.
+    """
+
+    def __init__(self):
+        # "YYYY-MM-DD|Category" -> SalesBucket; category "All" holds whole-bill values
+        self.buckets = {}
+        # "YYYY-MM|Category" -> SalesBucket of the same bills
+        self.months = {}
+        self.recent_bills = deque(maxlen=RECENT_BILLS)
+        self.seeded = False
+        # (data version, covered) from the last covers() check
+        self.coverage = None
+
+    def add_bills(self, bill_rows):
+        """Fold line items (as built by build_bill_rows) into the day/category buckets."""
+        df = pd.DataFrame(bill_rows)
+        if df.empty:
+            return 0
+        df = df[~df['Bill Number'].isin(set(self.recent_bills))]
+        if df.empty:
+            return 0
+        self.coverage = None
+        df = df.assign(Date=pd.to_datetime(df['Date'], errors='coerce')).dropna(subset=['Date'])
+        df['Day'] = df['Date'].dt.strftime('%Y-%m-%d')
+        df['Category'] = df['Category'].astype(str).str.title()
+
+        # Line-level sums per day and category
+        for (day, category), group in df.groupby(['Day', 'Category']):
+            for bucket in self._buckets(day, category):
+                bucket.total += float(group['Total'].sum())
+                bucket.quantity += int(group['Quantity'].sum())
+                bucket.lines += len(group)
+
+        # Bill-level sketches per day/category and per day overall
+        df = df.rename(columns={'Bill Number': 'bill'})
+        per_category = df.groupby(['Day', 'Category', 'bill'], sort=False).agg(
+            customer=('Customer Name', 'first'), phone=('Phone', 'first'), value=('Total', 'sum')
+        ).reset_index()
+        per_bill = df.groupby(['Day', 'bill'], sort=False).agg(
+            customer=('Customer Name', 'first'), phone=('Phone', 'first'), value=('Total', 'sum')
+        ).reset_index()
+        per_bill['Category'] = ALL_CATEGORIES
+        for row in pd.concat([per_category, per_bill]).itertuples(index=False):
+            for bucket in self._buckets(row.Day, row.Category):
+                bucket.bills.add(row.bill)
+                bucket.customers.add(f"{row.customer}|{row.phone}")
+                bucket.bill_values.add(row.value)
+
+        # Line-level sums for the whole day
+        day_totals = df.groupby('Day').agg(total=('Total', 'sum'), quantity=('Quantity', 'sum'), lines=('Total', 'size'))
+        for day, totals in day_totals.iterrows():
+            for bucket in self._buckets(day, ALL_CATEGORIES):
+                bucket.total += float(totals['total'])
+                bucket.quantity += int(totals['quantity'])
+                bucket.lines += int(totals['lines'])
+
+        self.recent_bills.extend(per_bill['bill'].drop_duplicates())
+        return per_bill['bill'].nunique()
+
+    def _buckets(self, day, category):
+        """Return the day bucket and the month rollup a line of day and category goes into."""
+        return self._bucket(self.buckets, f"{day}|{category}"), self._bucket(self.months, f"{day[:7]}|{category}")
+
+    @staticmethod
+    def _bucket(buckets, key):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = SalesBucket()
+        return bucket
+
+    def _covering(self, start, end, category):
+        """Return the month rollups inside start..end and the day buckets of months it only partly covers."""
+        covering = []
+        for key, month_bucket in self.months.items():
+            month, bucket_category = key.split("|", 1)
+            if bucket_category != category or f"{month}-31" < start or end < f"{month}-01":
+                continue
+            if start <= f"{month}-01" and f"{month}-31" <= end:
+                covering.append(month_bucket)
+                continue
+            year, month_number = int(month[:4]), int(month[5:])
+            for day_number in range(1, calendar.monthrange(year, month_number)[1] + 1):
+                day = f"{month}-{day_number:02d}"
+                bucket = self.buckets.get(f"{day}|{category}")
+                if bucket is not None and start <= day <= end:
+                    covering.append(bucket)
+        return covering
+
+    def covers(self, sales_data, version=None):
+        """
+        True if the sketch holds the same lines as sales_data: equal line counts and totals on every day.
+
+        The sketch may hold bills the frame lacks (batch runs without Excel export)
+        or miss some it has (sample data), and then its summaries describe other
+        sales. The answer is remembered for the given data version.
+        """
+        if version is not None and self.coverage is not None and self.coverage[0] == version:
+            return self.coverage[1]
+        days = pd.to_datetime(sales_data['Date'], errors='coerce').dt.strftime('%Y-%m-%d')
+        expected = sales_data['Total'].groupby(days).agg(['size', 'sum'])
+        sketched = {
+            key.split("|", 1)[0]: bucket for key, bucket in self.buckets.items()
+            if key.endswith(f"|{ALL_CATEGORIES}")
+        }
+        covered = set(sketched) == set(expected.index) and all(
+            sketched[day].lines == lines and abs(sketched[day].total - total) < 0.005
+            for day, lines, total in expected.itertuples(name=None)
+        )
+        if version is not None:
+            self.coverage = (version, covered)
+        return covered
+
+    def summarize(self, start_date=None, end_date=None, category=ALL_CATEGORIES):
+        """
+        Merge the buckets for a date range and category into summary metrics.
+
+        Returns:
+            dict: total, quantity, lines, average line value, distinct bills and
+            customers, and median / p90 bill value
+        """
+        start = str(start_date) if start_date else "0000-00-00"
+        end = str(end_date) if end_date else "9999-99-99"
+        # Merging compresses the buckets' pending bill values, and bills may be added meanwhile
+        with _lock:
+            merged = SalesBucket.merged(self._covering(start, end, category))
+        return {
+            "total": merged.total,
+            "quantity": merged.quantity,
+            "lines": merged.lines,
+            "average": merged.total / merged.lines if merged.lines else 0.0,
+            "bills": merged.bills.count(),
+            "customers": merged.customers.count(),
+            "median_bill": merged.bill_values.quantile(0.5),
+            "p90_bill": merged.bill_values.quantile(0.9)
+        }
+
+    def to_dict(self):
+        return {
+            "seeded": self.seeded,
+            "recent_bills": list(self.recent_bills),
+            "buckets": {key: bucket.to_dict() for key, bucket in self.buckets.items()},
+            "months": {key: bucket.to_dict() for key, bucket in self.months.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls()
+        sketch.seeded = data.get("seeded", False)
+        sketch.recent_bills.extend(data.get("recent_bills", []))
+        sketch.buckets = {key: SalesBucket.from_dict(bucket) for key, bucket in data["buckets"].items()}
+        sketch.months = {key: SalesBucket.from_dict(bucket) for key, bucket in data["months"].items()}
+        return sketch
+
+
+def default_sketches_path():
+    """Return the default sketch file, data/sales_sketches.json."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'sales_sketches.json')
+
+
+def load_sketch(sketches_path=None):
+    """Load the sales sketch, reusing the parsed copy while the file is unchanged."""
+    sketches_path = sketches_path or default_sketches_path()
+    if not os.path.exists(sketches_path):
+        return SalesSketch()
+    version = _file_version(sketches_path)
+    cached = _cache.get(sketches_path)
+    if cached and cached[0] == version:
+        return cached[1]
+    with open(sketches_path, "r", encoding="utf-8") as f:
+        sketch = SalesSketch.from_dict(json.load(f))
+    _cache[sketches_path] = (version, sketch)
+    return sketch
+
+
+def _file_version(path):
+    # Every save replaces the file, so another process's save changes the inode as well as the mtime
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _save_sketch(sketch, sketches_path):
+    os.makedirs(os.path.dirname(os.path.abspath(sketches_path)), exist_ok=True)
+    tmp_path = f"{sketches_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sketch.to_dict(), f)
+    os.replace(tmp_path, sketches_path)
+    _cache[sketches_path] = (_file_version(sketches_path), sketch)
+
+
+def update_sketches(bill_rows, sketches_path=None):
+    """Fold newly written bills into the persisted sketch; returns the number of new bills."""
+    sketches_path = sketches_path or default_sketches_path()
+    os.makedirs(os.path.dirname(os.path.abspath(sketches_path)), exist_ok=True)
+    # The app, the billing service and batch billing update the file from separate processes
+    with _lock, file_lock(f"{sketches_path}.lock"):
+        sketch = load_sketch(sketches_path)
+        added = sketch.add_bills(bill_rows)
+        if added:
+            _save_sketch(sketch, sketches_path)
+        return added
+
+
+def rebuild_sketches(sales_data, sketches_path=None):
+    """Rebuild the sketch from a full line-item history and mark it as covering it."""
+    sketches_path = sketches_path or default_sketches_path()
+    sketch = SalesSketch()
+    if sales_data is not None and not sales_data.empty:
+        sketch.add_bills(sales_data)
+    sketch.seeded = True
+    os.makedirs(os.path.dirname(os.path.abspath(sketches_path)), exist_ok=True)
+    with _lock, file_lock(f"{sketches_path}.lock"):
+        _save_sketch(sketch, sketches_path)
+    return sketch
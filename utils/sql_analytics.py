@@ -0,0 +1,261 @@
+"""
+Read-only SQL analytics over the SQLite sales ledger (data/ledger.db).
+
+Queries run inside SQLite against the indexed line_items table, so filters and
+column choices are applied before any rows reach Python. Ad-hoc queries see a
+`sales` view holding the line items that match the current filters:
+    python -m utils.sql_analytics "SELECT product, SUM(total) FROM sales GROUP BY product" --out products.csv
+"""
+import argparse
+import csv
+import os
+import sqlite3
+from datetime import datetime, time
+from time import monotonic
+
+import pandas as pd
+
+from .ledger import SQL_COLUMNS, default_ledger_path
+
+# Rows fetched from SQLite per write when streaming a result
+STREAM_CHUNK = 5000
+
+# Rows shown in the in-app preview of a custom query
+PREVIEW_ROWS = 200
+
+# Data rows an .xlsx sheet can hold below its header row
+EXCEL_MAX_ROWS = 1048575
+
+# Rows a streamed result may have; a runaway recursive query stops here rather than filling the disk
+STREAM_MAX_ROWS = 5000000
+
+# Seconds a preview or a streamed export may run before SQLite interrupts it
+PREVIEW_SECONDS = float(os.environ.get("BILLING_QUERY_SECONDS", "30"))
+STREAM_SECONDS = float(os.environ.get("BILLING_EXPORT_SECONDS", "300"))
+
+# SQLite virtual machine steps between deadline checks
+_PROGRESS_STEPS = 10000
+
+# Authorizer actions a read-only query may perform
+_READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION}
+if hasattr(sqlite3, "SQLITE_RECURSIVE"):
+    _READ_ACTIONS.add(sqlite3.SQLITE_RECURSIVE)
+
+
+def _authorize(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in _READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def filter_clause(start_date=None, end_date=None, category=None, product=None):
+    """
+    Build a WHERE clause for the analytics filters; 'All' means no filter.
+
+    The ledger stores dates as 'YYYY-MM-DD HH:MM:SS' text, so the date range is a
+    plain string range that uses the date index.
+
+    Returns:
+        tuple: (sql, params), where sql is '' when no filter applies
+    """
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append("date >= ?")
+        params.append(datetime.combine(start_date, time.min).strftime('%Y-%m-%d %H:%M:%S'))
+    if end_date is not None:
+        conditions.append("date <= ?")
+        params.append(datetime.combine(end_date, time.max).strftime('%Y-%m-%d %H:%M:%S'))
+    if category and category != 'All':
+        conditions.append("category = ?")
+        params.append(category)
+    if product and product != 'All':
+        conditions.append("product = ?")
+        params.append(product)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def connect_readonly(ledger_path=None, start_date=None, end_date=None, category=None, product=None, seconds=None):
+    """
+    Open the ledger read-only with a `sales` view of the filtered line items.
+
+    Only SELECT statements are authorized on the returned connection. With
+    seconds set, statements still running that long after connecting fail with
+    sqlite3.OperationalError('interrupted').
+    """
+    ledger_path = ledger_path or default_ledger_path()
+    if not os.path.exists(ledger_path):
+        raise FileNotFoundError(f"Ledger not found: {ledger_path}")
+    conn = sqlite3.connect(f"file:{os.path.abspath(ledger_path)}?mode=ro", uri=True, timeout=30)
+    where, params = filter_clause(start_date, end_date, category, product)
+    # Views cannot take parameters, so the filter values are inlined as quoted literals
+    literals = [conn.execute("SELECT quote(?)", (param,)).fetchone()[0] for param in params]
+    view_where = where.replace("?", "{}").format(*literals)
+    conn.execute(f"CREATE TEMP VIEW sales AS SELECT * FROM main.line_items{view_where}")
+    conn.set_authorizer(_authorize)
+    if seconds is not None:
+        deadline = monotonic() + seconds
+        # A non-zero return aborts the running statement
+        conn.set_progress_handler(lambda: monotonic() > deadline, _PROGRESS_STEPS)
+    return conn
+
+
+def line_items(columns=None, ledger_path=None, **filters):
+    """
+    Read only the requested columns of the line items that match the filters.
+
+    Args:
+        columns (list, optional): ledger column names, e.g. ['Date', 'Total']. If None, all columns.
+        ledger_path (str, optional): ledger database path. If None, the default path is used.
+        **filters: start_date, end_date, category, product
+
+    Returns:
+        pd.DataFrame: the selected columns under their ledger names
+    """
+    columns = columns or list(SQL_COLUMNS)
+    select = ", ".join(f'{SQL_COLUMNS[name]} AS "{name}"' for name in columns)
+    where, params = filter_clause(**filters)
+    conn = connect_readonly(ledger_path)
+    try:
+        df = pd.read_sql_query(f"SELECT {select} FROM line_items{where} ORDER BY id", conn, params=params)
+    finally:
+        conn.close()
+    if 'Date' in df.columns:
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    return df
+
+
+def check_query(sql):
+    """
+    Raise ValueError unless sql starts with SELECT or WITH.
+
+    sqlite3 itself refuses to run more than one statement, and the read-only
+    connection's authorizer rejects anything that writes.
+    """
+    statement = sql.strip().rstrip(";").strip()
+    if not statement:
+        raise ValueError("Query is empty")
+    if statement.split(None, 1)[0].upper() not in ("SELECT", "WITH"):
+        raise ValueError("Only SELECT queries can be run")
+    return statement
+
+
+def preview_query(sql, limit=PREVIEW_ROWS, ledger_path=None, seconds=PREVIEW_SECONDS, **filters):
+    """Run a custom query and return at most limit rows as a DataFrame, within seconds."""
+    statement = check_query(sql)
+    conn = connect_readonly(ledger_path, seconds=seconds, **filters)
+    try:
+        cursor = conn.execute(statement)
+        columns = [column[0] for column in cursor.description]
+        return pd.DataFrame(cursor.fetchmany(limit), columns=columns)
+    except sqlite3.OperationalError as e:
+        # The deadline's interrupt; anything else is a plain query error
+        if str(e) != "interrupted":
+            raise
+        raise ValueError(f"Query ran longer than {seconds:g} seconds and was stopped") from e
+    finally:
+        conn.close()
+
+
+def stream_query(sql, out, fmt="csv", ledger_path=None, chunk_size=STREAM_CHUNK,
+                 max_rows=STREAM_MAX_ROWS, seconds=STREAM_SECONDS, **filters):
+    """
+    Run a custom query and write its rows to out chunk by chunk.
+
+    Args:
+        sql (str): a single SELECT statement; the `sales` view holds the filtered line items
+        out: a text file object for 'csv' or a path/binary file object for 'xlsx'
+        fmt (str): 'csv' or 'xlsx'
+        ledger_path (str, optional): ledger database path. If None, the default path is used.
+        chunk_size (int): rows fetched per write
+        max_rows (int): most rows the result may have
+        seconds (float): how long the query and the writing may take
+        **filters: start_date, end_date, category, product
+
+    Returns:
+        int: number of rows written
+
+    Raises:
+        ValueError: if the result has more than max_rows rows (or too many for a sheet),
+            or takes longer than seconds
+    """
+    statement = check_query(sql)
+    conn = connect_readonly(ledger_path, seconds=seconds, **filters)
+    try:
+        cursor = conn.execute(statement)
+        header = [column[0] for column in cursor.description]
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(header)
+            append = writer.writerows
+        elif fmt == "xlsx":
+            from openpyxl import Workbook
+
+            # Write-only mode keeps just the current row in memory
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("Query")
+            sheet.append(header)
+
+            def append(rows):
+                for row in rows:
+                    sheet.append(row)
+        else:
+            raise ValueError(f"Unknown format: {fmt}")
+
+        written = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if fmt == "xlsx" and written + len(rows) > EXCEL_MAX_ROWS:
+                raise ValueError(f"Result has more than {EXCEL_MAX_ROWS} rows; export it as CSV")
+            if written + len(rows) > max_rows:
+                raise ValueError(f"Result has more than {max_rows} rows")
+            append(rows)
+            written += len(rows)
+        if fmt == "xlsx":
+            workbook.save(out)
+        return written
+    except sqlite3.OperationalError as e:
+        # The deadline's interrupt; anything else is a plain query error
+        if str(e) != "interrupted":
+            raise
+        raise ValueError(f"Query ran longer than {seconds:g} seconds and was stopped") from e
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a read-only SQL query over the sales ledger.")
+    parser.add_argument("sql", help="SELECT statement; the `sales` view holds the filtered line items")
+    parser.add_argument("--out", required=True, help="Output .csv or .xlsx file")
+    parser.add_argument("--ledger", default=None, help="Ledger database (default: data/ledger.db)")
+    parser.add_argument("--start", default=None, help="First date to include, YYYY-MM-DD")
+    parser.add_argument("--end", default=None, help="Last date to include, YYYY-MM-DD")
+    parser.add_argument("--category", default=None, help="Only this category")
+    parser.add_argument("--product", default=None, help="Only this product")
+    parser.add_argument("--max-rows", type=int, default=STREAM_MAX_ROWS, help="Stop if the result has more rows")
+    parser.add_argument("--seconds", type=float, default=STREAM_SECONDS, help="Stop a query running longer than this")
+    args = parser.parse_args(argv)
+
+    filters = {
+        "start_date": datetime.strptime(args.start, "%Y-%m-%d").date() if args.start else None,
+        "end_date": datetime.strptime(args.end, "%Y-%m-%d").date() if args.end else None,
+        "category": args.category,
+        "product": args.product
+    }
+    try:
+        if args.out.lower().endswith(".xlsx"):
+            written = stream_query(args.sql, args.out, "xlsx", args.ledger,
+                                   max_rows=args.max_rows, seconds=args.seconds, **filters)
+        else:
+            with open(args.out, "w", encoding="utf-8", newline="") as f:
+                written = stream_query(args.sql, f, "csv", args.ledger,
+                                       max_rows=args.max_rows, seconds=args.seconds, **filters)
+    except (ValueError, FileNotFoundError, sqlite3.Error) as e:
+        print(f"Query failed: {e}")
+        return 1
+    print(f"Wrote {written} rows to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,485 @@
+"""
+Offline-first replication of bills from a terminal to a central store.
+
+Terminal side: every saved or exported bill is appended to a local durable
+outbox (data/outbox/outbox.jsonl, fsynced) before its bill files are written,
+so a failing bills/ directory or a crash cannot lose it.
+sync() ships the records not yet sent as one gzip-compressed delta file into
+<central>/inbox/ whenever the central directory is reachable.
+
+Several processes on one terminal (the app, batch billing, the billing service)
+share the outbox; enqueueing, compacting and shipping hold file locks in it.
+
+Central side: ingest() applies inbox deltas idempotently. Bill numbers are random
+per terminal, so the central store keeps them as <terminal>-<bill number>: bill
+text goes to <central>/bills/ and line items to <central>/ledger.db, which skips
+bill numbers it already has. It then acknowledges, per terminal in <central>/acks/,
+the highest sequence number up to which every record has arrived, and terminals
+drop acknowledged records. A rejected delta leaves a gap, so its records stay in
+the terminal's journal and are shipped again.
+
+Settings:
+    BILLING_CENTRAL_DIR    central store directory (shared drive or mount); sync is off if unset
+    BILLING_TERMINAL_ID    name of this terminal (default: host name)
+    BILLING_SYNC_INTERVAL  seconds between background syncs (default 10)
+
+Usage:
+    python -m utils.sync_queue sync --central /mnt/billing
+    python -m utils.sync_queue ingest --central /mnt/billing --watch
+    python -m utils.sync_queue status
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from . import metrics
+from .bill_operations import is_valid_bill_number
+from .file_lock import file_lock
+from .ledger import append_bills
+
+# Records shipped per delta file
+MAX_BATCH_RECORDS = 500
+
+# Unprocessed delta files in the central inbox at which terminals stop shipping
+MAX_INBOX_FILES = 200
+
+# Terminal names as terminal_id() produces them; anything else in a delta is refused
+TERMINAL_PATTERN = re.compile(r"[A-Za-z0-9_.]+")
+
+_outboxes = {}
+_outboxes_lock = threading.Lock()
+_worker = None
+
+
+def default_outbox_dir():
+    """Return the default local queue directory, data/outbox."""
+    return os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'outbox')
+
+
+def central_dir():
+    """Return BILLING_CENTRAL_DIR, or None when sync is off."""
+    return os.environ.get("BILLING_CENTRAL_DIR") or None
+
+
+def terminal_id():
+    """Return this terminal's name, safe for use in file names."""
+    name = os.environ.get("BILLING_TERMINAL_ID") or socket.gethostname()
+    return re.sub(r"[^A-Za-z0-9_.]+", "_", name) or "terminal"
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+class Outbox:
+    """
+    Durable local queue of bill records waiting to reach the central store.
+
+    Records carry increasing sequence numbers. sent_seq is the last record shipped
+    to the inbox and acked_seq the last one the central store has applied.
+
+    Other processes append to the same journal, so the sequence numbers and state
+    are re-read under outbox.lock each time rather than kept from construction.
+    """
+
+    def __init__(self, outbox_dir=None, terminal=None):
+        self.outbox_dir = outbox_dir or default_outbox_dir()
+        self.terminal = terminal or terminal_id()
+        self.journal_path = os.path.join(self.outbox_dir, "outbox.jsonl")
+        self.state_path = os.path.join(self.outbox_dir, "state.json")
+        self.lock_path = os.path.join(self.outbox_dir, "outbox.lock")
+        self.sync_lock_path = os.path.join(self.outbox_dir, "sync.lock")
+        # lock guards the journal and sequence numbers; sync_lock serializes shipping
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        os.makedirs(self.outbox_dir, exist_ok=True)
+        with self._transaction():
+            pass
+
+    @contextmanager
+    def _transaction(self):
+        """Hold the journal locks and load the state other processes may have saved."""
+        with self.lock, file_lock(self.lock_path):
+            state = _read_json(self.state_path, {})
+            self.sent_seq = state.get("sent_seq", 0)
+            self.acked_seq = state.get("acked_seq", 0)
+            self.last_sync = state.get("last_sync")
+            yield
+
+    def _tail(self):
+        """
+        Return the last sequence number in the journal and whether it ends in a newline.
+
+        Reads backwards from the end, so the cost does not grow with the journal.
+        """
+        try:
+            f = open(self.journal_path, "rb")
+        except FileNotFoundError:
+            return 0, True
+        with f:
+            pos = f.seek(0, os.SEEK_END)
+            if not pos:
+                return 0, True
+            f.seek(pos - 1)
+            ends_with_newline = f.read(1) == b"\n"
+            data = b""
+            while pos:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+                lines = data.split(b"\n")
+                # Until the start of the file, the first piece may be part of a longer line
+                for line in reversed(lines if not pos else lines[1:]):
+                    try:
+                        return json.loads(line)["seq"], ends_with_newline
+                    except (ValueError, KeyError, TypeError):
+                        continue
+            return 0, ends_with_newline
+
+    def _records(self):
+        """Read every record still in the journal; a torn last line from a crash is skipped."""
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def _save_state(self):
+        _write_json(self.state_path, {
+            "sent_seq": self.sent_seq,
+            "acked_seq": self.acked_seq,
+            "last_sync": self.last_sync
+        })
+
+    def enqueue_many(self, items):
+        """
+        Append (kind, bill_number, payload) records to the journal with one fsync.
+
+        kind is 'bill' (payload {'content': bill text}) or 'rows' (payload {'rows': line items}).
+
+        Returns:
+            int: sequence number of the last record
+        """
+        with self._transaction():
+            last_seq, ends_with_newline = self._tail()
+            seq = max(last_seq, self.acked_seq, self.sent_seq)
+            lines = []
+            now = datetime.now().isoformat(timespec="seconds")
+            for kind, bill_number, payload in items:
+                seq += 1
+                lines.append(json.dumps({
+                    "seq": seq,
+                    "terminal": self.terminal,
+                    "kind": kind,
+                    "bill_number": bill_number,
+                    "payload": payload,
+                    "at": now
+                }, default=str))
+            if lines:
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    # Start a fresh line after a record torn by a crash, so this one stays readable
+                    f.write(("" if ends_with_newline else "\n") + "\n".join(lines) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+            metrics.set_gauge("sync_outbox_pending", seq - self.acked_seq)
+            return seq
+
+    def enqueue(self, kind, bill_number, payload):
+        return self.enqueue_many([(kind, bill_number, payload)])
+
+    def _read_ack(self, central):
+        ack = _read_json(os.path.join(central, "acks", f"{self.terminal}.json"), {})
+        return ack.get("seq", 0)
+
+    def _compact(self, records):
+        """Drop acknowledged records from the journal."""
+        keep = [record for record in records if record["seq"] > self.acked_seq]
+        if len(keep) == len(records):
+            return records
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in keep:
+                f.write(json.dumps(record, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        return keep
+
+    def sync(self, central=None):
+        """
+        Ship unsent records to the central inbox if it is reachable and not backed up.
+
+        The central directory may be a stalled share, so it is only touched without
+        the journal locks held; enqueue never waits on it. Concurrent syncs, in this
+        process or another, take turns on sync.lock instead.
+
+        Returns:
+            dict: status after the attempt, with 'shipped' records and a 'result' of
+            'shipped', 'idle', 'unreachable' or 'backpressure'
+        """
+        central = central or central_dir()
+        with self.sync_lock, file_lock(self.sync_lock_path), metrics.track("sync.ship"):
+            result, shipped = "idle", 0
+            inbox = os.path.join(central, "inbox") if central else None
+            if not central or not os.path.isdir(central):
+                result = "unreachable"
+                metrics.inc("sync_unreachable")
+            else:
+                os.makedirs(inbox, exist_ok=True)
+                acked_seq = self._read_ack(central)
+                in_flight = glob.glob(os.path.join(inbox, f"{self.terminal}-*.jsonl.gz"))
+                backed_up = len(glob.glob(os.path.join(inbox, "*.jsonl.gz"))) >= MAX_INBOX_FILES
+
+                # Copy the next batch out of the journal under the lock
+                with self._transaction():
+                    self.acked_seq = max(self.acked_seq, acked_seq)
+                    records = self._compact(self._records())
+                    if self.sent_seq > self.acked_seq and not in_flight:
+                        # Shipped but neither pending nor acknowledged: ship again, ingest skips duplicates
+                        self.sent_seq = self.acked_seq
+                    batch = [record for record in records if record["seq"] > self.sent_seq][:MAX_BATCH_RECORDS]
+                    self._save_state()
+
+                if backed_up:
+                    result = "backpressure"
+                    metrics.inc("sync_backpressure")
+                elif batch:
+                    name = f"{self.terminal}-{batch[0]['seq']:012d}-{batch[-1]['seq']:012d}.jsonl.gz"
+                    tmp_path = os.path.join(inbox, f".{name}.tmp")
+                    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                        for record in batch:
+                            f.write(json.dumps(record, default=str) + "\n")
+                    # The rename publishes the delta whole; ingest never sees a partial file
+                    os.replace(tmp_path, os.path.join(inbox, name))
+                    shipped = len(batch)
+                    result = "shipped"
+                    metrics.inc("sync_records_shipped", shipped)
+
+                with self._transaction():
+                    if shipped:
+                        self.sent_seq = batch[-1]["seq"]
+                    self.last_sync = datetime.now().isoformat(timespec="seconds")
+                    self._save_state()
+            status = self.status()
+        status.update(result=result, shipped=shipped)
+        return status
+
+    def _status_locked(self):
+        records = [record for record in self._records() if record["seq"] > self.acked_seq]
+        lag = (datetime.now() - datetime.fromisoformat(records[0]["at"])).total_seconds() if records else 0.0
+        metrics.set_gauge("sync_outbox_pending", len(records))
+        metrics.set_gauge("sync_lag_seconds", round(lag, 1))
+        return {
+            "terminal": self.terminal,
+            "pending": len(records),
+            "unsent": sum(1 for record in records if record["seq"] > self.sent_seq),
+            "sent_seq": self.sent_seq,
+            "acked_seq": self.acked_seq,
+            "lag_seconds": lag,
+            "last_sync": self.last_sync
+        }
+
+    def status(self):
+        """Return queue depth, sequence numbers and the age of the oldest unacknowledged record."""
+        with self._transaction():
+            return self._status_locked()
+
+
+def get_outbox(outbox_dir=None):
+    """Return the process-wide outbox for outbox_dir."""
+    outbox_dir = outbox_dir or default_outbox_dir()
+    with _outboxes_lock:
+        if outbox_dir not in _outboxes:
+            _outboxes[outbox_dir] = Outbox(outbox_dir)
+        return _outboxes[outbox_dir]
+
+
+def queue_bill_text(bill_number, content):
+    """Queue a saved bill's text for the central store, when BILLING_CENTRAL_DIR is set."""
+    if not central_dir():
+        return
+    get_outbox().enqueue("bill", bill_number, {"content": content})
+
+
+def queue_rows(rows):
+    """Queue ledger rows for the central store, one record per bill, when BILLING_CENTRAL_DIR is set."""
+    if not central_dir() or not rows:
+        return
+    bills = {}
+    for row in rows:
+        bills.setdefault(row['Bill Number'], []).append(row)
+    get_outbox().enqueue_many([("rows", bill_number, {"rows": bill_rows}) for bill_number, bill_rows in bills.items()])
+
+
+def start_sync_worker(interval=None):
+    """Sync the outbox on a background thread when BILLING_CENTRAL_DIR is set."""
+    global _worker
+    if not central_dir():
+        return None
+    interval = interval or float(os.environ.get("BILLING_SYNC_INTERVAL", "10"))
+    with _outboxes_lock:
+        if _worker is not None:
+            return _worker
+
+        def run():
+            while True:
+                try:
+                    # Drain the backlog in consecutive batches, then wait for the next round
+                    while get_outbox().sync()["result"] == "shipped":
+                        pass
+                except Exception as e:
+                    metrics.inc("sync_failures")
+                    print(f"Error syncing bills: {e}")
+                time.sleep(interval)
+
+        _worker = threading.Thread(target=run, name="bill-sync", daemon=True)
+        _worker.start()
+    return _worker
+
+
+def central_bill_number(terminal, bill_number):
+    """Return the central store's name for a terminal's bill; terminals draw bill numbers independently."""
+    return f"{terminal}-{bill_number}"
+
+
+def ingest(central):
+    """
+    Apply every delta in <central>/inbox to the central store and acknowledge it.
+
+    A terminal's acknowledgement only advances over sequence numbers that have all
+    arrived, so records in a rejected delta are never dropped from its journal.
+
+    Returns:
+        dict: files, records and new bills processed
+    """
+    inbox = os.path.join(central, "inbox")
+    acks_dir = os.path.join(central, "acks")
+    bills_dir = os.path.join(central, "bills")
+    for directory in (inbox, acks_dir, bills_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    files = records_read = new_bills = 0
+    # Zero-padded sequence numbers in the names keep each terminal's deltas in order
+    for path in sorted(glob.glob(os.path.join(inbox, "*.jsonl.gz"))):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        except (OSError, ValueError) as e:
+            print(f"Rejecting {os.path.basename(path)}: {e}")
+            os.makedirs(os.path.join(central, "rejected"), exist_ok=True)
+            os.replace(path, os.path.join(central, "rejected", os.path.basename(path)))
+            continue
+
+        rows = {}
+        seqs = {}
+        for record in records:
+            terminal = record["terminal"]
+            if not isinstance(terminal, str) or not TERMINAL_PATTERN.fullmatch(terminal):
+                print(f"Skipping record {record['seq']}: invalid terminal {terminal!r}")
+                continue
+            seqs.setdefault(terminal, []).append(record["seq"])
+            if not is_valid_bill_number(record["bill_number"]):
+                # The bill number names a file under bills/; refuse anything that could escape it
+                print(f"Skipping record {record['seq']} from {terminal}: "
+                      f"invalid bill number {record['bill_number']!r}")
+                continue
+            bill_number = central_bill_number(terminal, record["bill_number"])
+            if record["kind"] == "bill":
+                _write_bill_text(bills_dir, bill_number, record["payload"]["content"])
+            elif record["kind"] == "rows":
+                rows.setdefault(terminal, []).extend(
+                    {**row, 'Bill Number': bill_number} for row in record["payload"]["rows"]
+                )
+        for terminal, terminal_rows in rows.items():
+            # The ledger skips bill numbers it already holds, so a re-shipped delta adds nothing
+            new_bills += append_bills(pd.DataFrame(terminal_rows), source=terminal,
+                                      ledger_path=os.path.join(central, "ledger.db"))
+
+        for terminal, terminal_seqs in seqs.items():
+            ack_path = os.path.join(acks_dir, f"{terminal}.json")
+            acked = start = _read_json(ack_path, {}).get("seq", 0)
+            for seq in sorted(terminal_seqs):
+                if seq > acked + 1:
+                    # A gap: an earlier delta was rejected or is still missing
+                    break
+                acked = max(acked, seq)
+            if acked > start:
+                _write_json(ack_path, {"seq": acked, "at": datetime.now().isoformat(timespec="seconds")})
+        os.remove(path)
+        files += 1
+        records_read += len(records)
+    metrics.inc("sync_records_ingested", records_read)
+    return {"files": files, "records": records_read, "new_bills": new_bills}
+
+
+def _write_bill_text(bills_dir, bill_number, content):
+    path = os.path.join(bills_dir, f"{bill_number}.txt")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ship queued bills to the central store, or ingest them there.")
+    parser.add_argument("command", choices=["sync", "ingest", "status"])
+    parser.add_argument("--central", default=None, help="Central store directory (default: BILLING_CENTRAL_DIR)")
+    parser.add_argument("--outbox", default=None, help="Local queue directory (default: data/outbox)")
+    parser.add_argument("--watch", action="store_true", help="Keep running, polling every --interval seconds")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between rounds with --watch")
+    args = parser.parse_args(argv)
+
+    central = args.central or central_dir()
+    if args.command == "status":
+        print(json.dumps(Outbox(args.outbox).status(), indent=2))
+        return 0
+    if not central:
+        parser.error("--central or BILLING_CENTRAL_DIR is required")
+
+    while True:
+        if args.command == "sync":
+            outbox = Outbox(args.outbox)
+            status = outbox.sync(central)
+            while status["result"] == "shipped":
+                status = outbox.sync(central)
+            print(f"{status['result']}: {status['pending']} pending, {status['unsent']} unsent, "
+                  f"lag {status['lag_seconds']:.0f}s")
+        else:
+            result = ingest(central)
+            if result["files"] or not args.watch:
+                print(f"Ingested {result['records']} records from {result['files']} files "
+                      f"({result['new_bills']} new bills)")
+        if not args.watch:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,12 @@
+import os
+
+import pandas as pd
 import streamlit as st
 
+from . import metrics
 from .analytics_ui import visualize_sales_data
+from .billing_client import BillingServiceError
+from .live_ticker import SalesTicker
 
 def set_custom_style():
     """Apply custom CSS styling to the Streamlit app."""
@@ -47,8 +53,12 @@ def display_customer_info_section():
     
     return customer_name, phone_number
 
-def display_product_selection(cosmetic_products, grocery_products, drink_products, prices):
-    """Display product selection section with variants"""
+def _quantity_changed(cart, category, sku, key):
+    """Widget callback: push one quantity change into the cart."""
+    cart.set_quantity(category, sku, st.session_state[key])
+
+def display_product_selection(cosmetic_products, grocery_products, drink_products, prices, cart=None):
+    """Display product selection section with variants; quantity changes update cart as they happen"""
     st.markdown('<div class="section-header">Product Selection</div>', unsafe_allow_html=True)
     
     # Create tabs for different product categories
@@ -73,13 +83,15 @@ def display_product_selection(cosmetic_products, grocery_products, drink_product
                 for i, variant in enumerate(variants):
                     with cols[i]:
                         st.markdown(f"**{variant['name']}**")
-                        st.markdown(f"Price: ₹{variant['price']}")
+                        st.markdown(f"Price: ₹{prices.get(variant['name'], variant['price'])}")
                         qty = st.number_input(
                             "Quantity",
                             min_value=0,
                             value=0,
                             step=1,
-                            key=f"cosmetic_{variant['name']}"
+                            key=f"cosmetic_{variant['name']}",
+                            on_change=_quantity_changed if cart is not None else None,
+                            args=(cart, "cosmetic", variant['name'], f"cosmetic_{variant['name']}") if cart is not None else None
                         )
                         cosmetic_items[variant['name']] = qty
     
@@ -97,13 +109,15 @@ def display_product_selection(cosmetic_products, grocery_products, drink_product
                 for i, variant in enumerate(variants):
                     with cols[i]:
                         st.markdown(f"**{variant['name']}**")
-                        st.markdown(f"Price: ₹{variant['price']}")
+                        st.markdown(f"Price: ₹{prices.get(variant['name'], variant['price'])}")
                         qty = st.number_input(
                             "Quantity",
                             min_value=0,
                             value=0,
                             step=1,
-                            key=f"grocery_{variant['name']}"
+                            key=f"grocery_{variant['name']}",
+                            on_change=_quantity_changed if cart is not None else None,
+                            args=(cart, "grocery", variant['name'], f"grocery_{variant['name']}") if cart is not None else None
                         )
                         grocery_items[variant['name']] = qty
     
@@ -121,18 +135,29 @@ def display_product_selection(cosmetic_products, grocery_products, drink_product
                 for i, variant in enumerate(variants):
                     with cols[i]:
                         st.markdown(f"**{variant['name']}**")
-                        st.markdown(f"Price: ₹{variant['price']}")
+                        st.markdown(f"Price: ₹{prices.get(variant['name'], variant['price'])}")
                         qty = st.number_input(
                             "Quantity",
                             min_value=0,
                             value=0,
                             step=1,
-                            key=f"drink_{variant['name']}"
+                            key=f"drink_{variant['name']}",
+                            on_change=_quantity_changed if cart is not None else None,
+                            args=(cart, "drink", variant['name'], f"drink_{variant['name']}") if cart is not None else None
                         )
                         drink_items[variant['name']] = qty
     
     return cosmetic_items, grocery_items, drink_items
 
+def display_cart_total(totals):
+    """Display the running per-category and grand totals of the cart, and any promotion savings."""
+    cols = st.columns(4)
+    cols[0].metric("Cosmetics", f"₹{totals['cosmetic_final']:.2f}")
+    cols[1].metric("Groceries", f"₹{totals['grocery_final']:.2f}")
+    cols[2].metric("Drinks", f"₹{totals['drink_final']:.2f}")
+    saved = totals.get("discount_total", 0)
+    cols[3].metric("Grand Total", f"₹{totals['grand_total']:.2f}", delta=f"₹{saved:.2f} saved" if saved else None)
+
 def display_bill_operations_section():
     """Display the bill operations section with buttons."""
     st.markdown('<div class="section-header">Bill Operations</div>', unsafe_allow_html=True)
@@ -156,3 +181,105 @@ def display_error_message(message):
 def display_data_analysis_section(excel_file_path):
     """Display the data analysis section."""
     visualize_sales_data(excel_file_path)
+
+
+def display_service_search(billing_client):
+    """Display the bill search backed by the billing service; call inside `with st.sidebar`."""
+    search_option = st.radio("Search by:", ["Bill Number", "Customer Name", "Date"])
+    try:
+        bills = billing_client.search_bills("number")
+    except BillingServiceError as e:
+        st.error(str(e))
+        return
+    if not bills:
+        st.info("No bills found. Please save a bill first.")
+        return
+    
+    if search_option == "Customer Name":
+        selected_name = st.selectbox("Select Customer:", sorted({b["customer_name"] for b in bills}))
+        bills = [b for b in bills if b["customer_name"] == selected_name]
+    elif search_option == "Date":
+        dates = sorted({b["date"] for b in bills if b["date"]}, key=lambda d: d[6:] + d[3:5] + d[:2], reverse=True)
+        selected_date = st.selectbox("Select Date:", dates)
+        bills = [b for b in bills if b["date"] == selected_date]
+    
+    selected_bill = st.selectbox("Select Bill:", [b["bill_number"] for b in bills])
+    if st.button("View Bill", key="view_bill_from_service"):
+        try:
+            st.session_state.bill_content = billing_client.load_bill(selected_bill)
+            st.session_state.notice = f"Loaded bill: {selected_bill}"
+            # The preview is drawn by the billing section; rerun the app so it shows this bill
+            st.rerun()
+        except Exception as e:
+            display_error_message(f"Error loading bill: {str(e)}")
+
+def display_latency_panel():
+    """Display the latencies recorded during this rerun in the sidebar, if enabled."""
+    if not st.sidebar.checkbox("Show latency panel", key="show_latency_panel"):
+        return
+    samples = metrics.rerun_samples()
+    if samples:
+        st.sidebar.markdown("**This rerun**")
+        st.sidebar.dataframe(
+            [{"Operation": name, "ms": round(seconds * 1000, 2)} for name, seconds in samples],
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        st.sidebar.info("No timed operations ran in this rerun.")
+    # Running totals since the process started
+    st.sidebar.markdown("**Since start**")
+    st.sidebar.dataframe(
+        [
+            {
+                "Operation": row["operation"],
+                "Calls": row["count"],
+                "Mean ms": round(row["mean"] * 1000, 2),
+                "p95 ms": round(row["p95"] * 1000, 2)
+            }
+            for row in metrics.snapshot()
+        ],
+        use_container_width=True,
+        hide_index=True
+    )
+
+
+# Seconds between live ticker polls of the ledger
+LIVE_TICKER_SECONDS = float(os.environ.get("BILLING_TICKER_SECONDS", "5"))
+
+
+@st.fragment(run_every=LIVE_TICKER_SECONDS)
+def _live_ticker_fragment():
+    # Only this fragment reruns on the timer; the ticker reads just the rows added since its last poll
+    ticker = st.session_state.setdefault("sales_ticker", SalesTicker())
+    ticker.poll()
+    summary = ticker.summary()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Sales Today", f"₹{summary['total']:.2f}")
+    with col2:
+        st.metric("Bills Today", f"{summary['bills']}")
+    with col3:
+        st.metric("Items Sold", f"{summary['quantity']}")
+    with col4:
+        st.metric("Average Bill", f"₹{summary['average_bill']:.2f}")
+
+    chart_col, bills_col = st.columns([2, 1])
+    with chart_col:
+        hourly = pd.DataFrame({"Sales": ticker.hourly}, index=[f"{hour:02d}:00" for hour in range(24)])
+        st.bar_chart(hourly, y="Sales")
+    with bills_col:
+        st.markdown("**Latest Bills**")
+        st.dataframe(pd.DataFrame(list(ticker.recent_bills), columns=["Time", "Bill Number", "Total"]),
+                     use_container_width=True, hide_index=True)
+    if ticker.updated_at:
+        st.caption(f"Updated {ticker.updated_at:%H:%M:%S}; refreshes every {LIVE_TICKER_SECONDS:g}s")
+
+
+def display_live_ticker():
+    """Show today's running sales totals, refreshed in place from the ledger, when enabled in the sidebar."""
+    if not st.sidebar.checkbox("Live Sales Ticker", key="show_live_ticker"):
+        return
+    st.markdown('<div class="section-header">Live Sales</div>', unsafe_allow_html=True)
+    _live_ticker_fragment()